@@ -0,0 +1,125 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class Rejected(Exception):
+    """Request turned away; retry_after is a hint in whole seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """Bounded concurrency for one endpoint: max_in_flight run, max_queue wait, the rest are rejected.
+
+    Waiters are admitted in arrival order and give up after queue_timeout seconds, so
+    a burst turns into fast 429s instead of an ever-growing backlog (and memory) behind
+    the model and SQLite.
+    """
+
+    def __init__(self, max_in_flight, max_queue, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "queue_timeout": 0}
+        self._waiters = []
+        self._service_time = 0.0   # moving average, for Retry-After
+        self._cond = threading.Condition()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        # Roughly how long the current backlog takes to drain
+        backlog = (self.queued + self.in_flight) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(backlog * self._service_time))
+
+    def acquire(self):
+        # Returns seconds spent queued; raises Rejected
+        with self._cond:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                self.admitted += 1
+                return 0.0
+            if len(self._waiters) >= self.max_queue:
+                self.rejected["queue_full"] += 1
+                raise Rejected("queue_full", self.retry_after())
+
+            ticket = object()
+            self._waiters.append(ticket)
+            start = time.monotonic()
+            deadline = start + self.queue_timeout
+            try:
+                while self._waiters[0] is not ticket or self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected["queue_timeout"] += 1
+                        raise Rejected("queue_timeout", self.retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters.remove(ticket)
+                # The next waiter may now be at the head
+                self._cond.notify_all()
+            self.in_flight += 1
+            self.admitted += 1
+            return time.monotonic() - start
+
+    def release(self, service_time=None):
+        with self._cond:
+            self.in_flight -= 1
+            if service_time is not None:
+                self._service_time += 0.1 * (service_time - self._service_time)
+            self._cond.notify_all()
+
+    def status(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_service_ms": round(self._service_time * 1000, 3),
+        }
+
+
+class RateLimiter:
+    """Token bucket per client: `rate` requests per second, bursts of up to `burst`.
+
+    Buckets live in an LRU of max_clients entries; an evicted client just starts
+    again with a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected = 0
+        self._buckets = OrderedDict()   # client -> (tokens, last refill)
+        self._lock = threading.Lock()
+
+    def take(self, client, now=None):
+        # Spends one token or raises Rejected with the wait until the next one
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                self.rejected += 1
+                raise Rejected("rate_limited", max(1, math.ceil((1 - tokens) / self.rate)))
+            self._buckets[client] = (tokens - 1, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+    def status(self):
+        return {"rate": self.rate, "burst": self.burst, "clients": len(self._buckets), "rejected": self.rejected}
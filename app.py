@@ -1,26 +1,139 @@
-from flask import Flask, render_template, request, g, jsonify, redirect, url_for, Response, session
-import pickle
-import sqlite3
+from flask import Flask, render_template, request, g, jsonify, redirect, url_for, Response, session, has_request_context
 import io
 import csv
-from datetime import datetime
+import json
+import asyncio
+import atexit
+import contextvars
+import functools
+import hashlib
+import os
+import re
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from cache import LRUCache, MISSING
+from rules import RuleEngine
+from registry import ModelRegistry
+from online import HashingModel, OnlineTrainer
+from history_writer import HistoryWriter
+from db_pool import get_pool
+from metrics import MetricsRegistry, SamplingProfiler
+from campaigns import MinHashLSH
+from retention import HistoryArchiver
+from shared_state import make_state
+from admission import AdmissionGate, RateLimiter, Rejected
 
 app = Flask(__name__)
 app.config['DATABASE'] = 'spam_data.db'
 app.secret_key = 'super_secret_key_change_this'
 
 def get_db():
+    # Borrowed from this worker's pool (WAL, tuned pragmas, statement cache)
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(app.config['DATABASE'])
-        db.row_factory = sqlite3.Row
+        pool = g._database_pool = get_pool(app.config['DATABASE'])
+        db = g._database = pool.acquire()
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
     db = getattr(g, '_database', None)
     if db is not None:
-        db.close()
+        g._database_pool.release(db)
+
+# Metrics scraped from /metrics. With METRICS_MULTIPROC_DIR (set by gunicorn.conf.py)
+# every worker writes its values there and any worker's /metrics reports the sum
+metrics = MetricsRegistry(os.environ.get("METRICS_MULTIPROC_DIR") or None)
+REQUESTS = metrics.counter("spam_requests_total", "HTTP requests by endpoint, method and status.",
+                           ["endpoint", "method", "status"])
+REQUEST_SECONDS = metrics.histogram("spam_request_duration_seconds", "HTTP request latency.",
+                                    ["endpoint", "method"])
+STAGE_SECONDS = metrics.histogram("spam_stage_duration_seconds", "Latency of each stage inside a request.",
+                                  ["endpoint", "stage"])
+
+# Under the pre-fork server (gunicorn.conf.py) the model is loaded here in the master,
+# and background threads are started in each worker instead (see start_background_tasks)
+PREFORK = os.environ.get("PREFORK") == "1"
+
+# Optional sampling profiler: PROFILE_SAMPLE_INTERVAL=0.01 on start, or /admin/api/profile
+profiler = SamplingProfiler()
+
+def stage(name):
+    # `with stage("predict_proba"):` times one step of the current request
+    endpoint = request.endpoint if has_request_context() else None
+    return STAGE_SECONDS.time(endpoint or "none", name)
+
+@app.before_request
+def start_timer():
+    g._request_start = time.perf_counter()
+
+# Admission control for the prediction endpoints, per worker process: at most
+# ADMISSION_MAX_IN_FLIGHT requests run and ADMISSION_MAX_QUEUE wait (up to
+# ADMISSION_QUEUE_TIMEOUT seconds) across all of them; the rest get 429 + Retry-After.
+# One budget, so gated requests never hold more than in-flight + queue of the worker's
+# threads and the remainder stays free for page loads and the admin (gunicorn.conf.py
+# sizes `threads` from the same settings).
+# RATE_LIMIT=<requests per second>[/<burst>] adds a token bucket per client address.
+# That is the peer address: behind a load balancer or ingress, set TRUSTED_PROXIES to
+# the number of proxies in front, so the client comes from their X-Forwarded-For.
+ADMITTED_ENDPOINTS = ("index", "api_predict", "api_predict_async", "api_predict_batch")
+admission_gate = AdmissionGate(int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "4")),
+                               int(os.environ.get("ADMISSION_MAX_QUEUE", "16")),
+                               float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "1.0")))
+rate_limiter = None
+if os.environ.get("RATE_LIMIT"):
+    rate, _, burst = os.environ["RATE_LIMIT"].partition("/")
+    rate_limiter = RateLimiter(float(rate), float(burst or rate))
+if int(os.environ.get("TRUSTED_PROXIES", "0")) > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ["TRUSTED_PROXIES"]))
+
+ADMISSION_REJECTED = metrics.counter("spam_admission_rejected_total",
+                                     "Requests turned away with 429, by endpoint and reason.", ["endpoint", "reason"])
+ADMISSION_WAIT = metrics.histogram("spam_admission_queue_wait_seconds",
+                                   "Time admitted requests spent queued.", ["endpoint"])
+metrics.gauge("spam_admission_in_flight", "Admitted prediction requests running in this process.",
+              lambda: admission_gate.in_flight)
+metrics.gauge("spam_admission_queued", "Prediction requests waiting for admission in this process.",
+              lambda: admission_gate.queued)
+
+@app.before_request
+def admit_request():
+    # Page loads and dashboards are never queued; only POSTs that run the model
+    if request.endpoint not in ADMITTED_ENDPOINTS or request.method != "POST":
+        return None
+    gate = admission_gate
+    try:
+        if rate_limiter:
+            rate_limiter.take(request.remote_addr)
+        waited = gate.acquire()
+    except Rejected as e:
+        ADMISSION_REJECTED.inc(request.endpoint, e.reason)
+        error = "Rate limit exceeded" if e.reason == "rate_limited" else "Server busy"
+        response = jsonify({"error": f"{error}, retry in {e.retry_after}s", "reason": e.reason})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    ADMISSION_WAIT.observe(waited, request.endpoint)
+    g._admitted = (gate, time.perf_counter())
+
+@app.teardown_request
+def release_admission(exception):
+    admitted = g.pop('_admitted', None)
+    if admitted:
+        gate, start = admitted
+        gate.release(time.perf_counter() - start)
+
+@app.after_request
+def record_request(response):
+    start = getattr(g, '_request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method)
+        REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    return response
 
 def init_db():
     with app.app_context():
@@ -32,7 +145,8 @@ def init_db():
                 source TEXT,
                 result TEXT,
                 probability TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                campaign_id INTEGER
             )
         ''')
         db.execute('''
@@ -40,90 +154,961 @@ def init_db():
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 message TEXT NOT NULL,
                 user_label TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                message_hash TEXT
+            )
+        ''')
+        # Resolved override per normalized message (one row per hash, derived from feedback)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS overrides (
+                message_hash TEXT PRIMARY KEY,
+                label TEXT NOT NULL,
+                is_admin INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # Change counters other worker processes poll to drop stale caches (see LocalState)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        db.execute("INSERT OR IGNORE INTO versions (name) VALUES ('overrides')")
+        # Dashboard counters (total, spam, radar categories, hourly traffic),
+        # kept in step with history so index() never rescans the table
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # Near-duplicate campaigns: one row per cluster plus its LSH band keys
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS campaigns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                signature BLOB NOT NULL,
+                sample TEXT NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                label TEXT,
+                first_seen DATETIME,
+                last_seen DATETIME
+            )
+        ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS campaign_bands (
+                band_key INTEGER NOT NULL,
+                campaign_id INTEGER NOT NULL,
+                PRIMARY KEY (band_key, campaign_id)
+            ) WITHOUT ROWID
+        ''')
+        # Hourly / daily counters for history rows compacted by retention (see retention.py)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS history_rollups (
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                name TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, bucket, name)
+            ) WITHOUT ROWID
+        ''')
+        # Admin-verified examples for online learning, applied in id order by the one
+        # process that owns the online model (see OnlineTrainer)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS online_examples (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message TEXT NOT NULL,
+                label TEXT NOT NULL,
+                created DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_campaigns_size ON campaigns (size)')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_campaigns_labelled ON campaigns (label) WHERE label IS NOT NULL')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_campaign_bands_campaign ON campaign_bands (campaign_id)')
+        # Keyset pagination indexes (newest first, id breaks timestamp ties)
+        db.execute('CREATE INDEX IF NOT EXISTS idx_history_timestamp_id ON history (timestamp, id)')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_feedback_timestamp_id ON feedback (timestamp, id)')
+        # First run against an existing database: backfill once from history
+        if db.execute('SELECT 1 FROM stats WHERE name = "total"').fetchone() is None:
+            rebuild_stats(db)
+        # Databases created before message_hash existed: add and backfill it
+        if 'message_hash' not in [c['name'] for c in db.execute('PRAGMA table_info(feedback)')]:
+            db.execute('ALTER TABLE feedback ADD COLUMN message_hash TEXT')
+        if db.execute('SELECT 1 FROM feedback WHERE message_hash IS NULL LIMIT 1').fetchone():
+            rebuild_overrides(db)
+        db.execute('CREATE INDEX IF NOT EXISTS idx_feedback_message_hash ON feedback (message_hash)')
+        # Databases created before history.campaign_id existed: add it and link the
+        # rows to the campaigns they were counted in
+        if 'campaign_id' not in [c['name'] for c in db.execute('PRAGMA table_info(history)')]:
+            db.execute('ALTER TABLE history ADD COLUMN campaign_id INTEGER')
+            backfill_history_campaigns(db)
+        # Full-text search over history and feedback messages
+        for table in SEARCH_TABLES:
+            create_search_index(db, table)
         db.commit()
+        override_cache.clear()
 
-# Initialize DB structure
-init_db()
+# Model predictions per (model version, message hash); repeated bulk messages skip TF-IDF + NB
+prediction_cache = LRUCache(maxsize=50000, ttl=3600)
 
-model = pickle.load(open("model/spam_model.pkl", "rb"))
-vectorizer = pickle.load(open("model/vectorizer.pkl", "rb"))
+def load_labelled(path="dataset/spam.csv", encoding="latin-1"):
+    # [(message, "ham"/"spam"), ...] from a label,message CSV (the Kaggle one by default);
+    # empty if it is not deployed
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding=encoding, newline="") as f:
+        return [(r[1], r[0]) for r in csv.reader(f) if len(r) > 1 and r[0] in ("ham", "spam") and r[1]]
 
-import re
+# Rows train_model.py kept out of training; hot-reloaded models must score well on them.
+# Without the file only the classes are checked: rows a model was trained on cannot
+# catch a bad one.
+HOLDOUT_PATH = "model/holdout.csv"
 
-# ... existing code ...
+def load_holdout(path=HOLDOUT_PATH):
+    return load_labelled(path, encoding="utf-8")
 
-SPAM_KEYWORDS = [
-    "free", "win", "winner", "cash", "offer",
-    "claim", "urgent", "prize", "money", "congratulations",
-    "click", "link", "subscribe", "buy", "order", "limited", "verify", "account"
-]
+def on_model_swap(new_predictor):
+    global predictor, model_version
+    predictor = new_predictor
+    model_version = new_predictor.version
+    prediction_cache.clear()
+
+# Uses the memory-mapped export from train_model.py when present (arrays are mapped
+# lazily on the first prediction), otherwise unpickles the sklearn objects
+model_registry = ModelRegistry(
+    "model/spam_model.pkl", "model/vectorizer.pkl", "model/compact",
+    holdout=load_holdout(), on_swap=on_model_swap
+)
+
+def load_model(validate=False):
+    # Synchronous (re)load; the startup load skips validation so the lazy mmap stays lazy
+    return model_registry.load(validate=validate)
+
+load_model()
+
+# Online learning from admin-verified feedback (opt-in: ONLINE_LEARNING=1).
+# Serves a hashing-vectorizer NB model updated via partial_fit. admin_train (in any
+# worker) queues examples in online_examples; one process owns the model, applies them
+# and writes the artifact, and the other workers reload it.
+ONLINE_MODEL_PATH = "model/online/online_model.pkl"
+online_trainer = None
+
+def pending_online_examples(after_id, limit):
+    with get_pool(app.config['DATABASE']).connection() as db:
+        return [tuple(r) for r in db.execute(
+            'SELECT id, message, label FROM online_examples WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit)
+        )]
+
+def enable_online_learning(path=ONLINE_MODEL_PATH, batch_size=32, flush_interval=2.0, start=True):
+    global online_trainer
+    if os.path.exists(path):
+        base = HashingModel.load(path)
+    else:
+        held_out = set(model_registry.holdout)
+        rows = [r for r in load_labelled() if r not in held_out]
+        if not rows:
+            raise RuntimeError("No online model and no dataset to bootstrap one from")
+        base = HashingModel.train([m for m, _ in rows], [y for _, y in rows])
+
+    model_registry.publish(base)
+    model_registry.pinned_by = "online learning"
+    online_trainer = OnlineTrainer(base, model_registry, path, batch_size, flush_interval,
+                                   source=pending_online_examples)
+    if start:
+        online_trainer.start()
+    return online_trainer
+
+def disable_online_learning():
+    # Back to the batch-trained artifacts
+    global online_trainer
+    if online_trainer:
+        online_trainer.stop()
+        online_trainer = None
+    model_registry.pinned_by = None
+    load_model()
+
+if os.environ.get("ONLINE_LEARNING") == "1":
+    enable_online_learning(start=not PREFORK)
+
+def predict_messages(messages, current=None):
+    # [(label, spam_prob %), ...] in input order; cache misses are scored in one vectorized call.
+    # Callers that report a model version pass the predictor they read it from.
+    current = current or predictor
+    keys = [(current.version, hashlib.sha256(m.encode("utf-8")).hexdigest()) for m in messages]
+    results = [prediction_cache.get(k) for k in keys]
+
+    pending = {}
+    for i, r in enumerate(results):
+        if r is MISSING:
+            pending.setdefault(messages[i], []).append(i)
+
+    if len(pending) == 1 and hasattr(current, "score_one"):
+        # One message (the common request): compiled single pass, no sklearn overhead
+        [(m, positions)] = pending.items()
+        with stage("score_one"):
+            label, probs = current.score_one(m)
+        scored = (label, probs[list(current.classes_).index("spam")] * 100)
+        for i in positions:
+            results[i] = scored
+        prediction_cache.set(keys[positions[0]], scored)
+    elif pending:
+        to_score = list(pending)
+        with stage("transform"):
+            features = current.transform(to_score)
+        with stage("predict_proba"):
+            probs = current.score(features)
+        spam_idx = list(current.classes_).index("spam")
+        labels = current.classes_[probs.argmax(axis=1)]
+        for m, label, p in zip(to_score, labels, probs[:, spam_idx]):
+            scored = (str(label), float(p) * 100)
+            for i in pending[m]:
+                results[i] = scored
+            prediction_cache.set(keys[pending[m][0]], scored)
+
+    return results
+
+# Keyword, category and URL rules are compiled once (see rules.py)
+rule_engine = RuleEngine()
+
+# Upper bound for /api/predict/batch (keeps the IN (...) override query under SQLite's variable limit)
+MAX_BATCH_SIZE = 500
+
+# Rows fetched from the cursor per CSV chunk in /export_csv
+EXPORT_CHUNK_SIZE = 1000
+
+# History / feedback listings are paginated by (timestamp, id) cursors
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 def get_smart_categories(message):
-    tags = []
-    msg_lower = message.lower()
-    
-    # Financial
-    if any(w in msg_lower for w in ["bank", "transfer", "account", "verify", "credit", "card", "billing"]):
-        tags.append("💳 Financial Risk")
-    elif any(w in msg_lower for w in ["win", "winner", "cash", "prize", "money", "lottery", "100%", "deposit"]):
-        tags.append("💰 Potential Scam")
-        
-    # Urgency
-    if any(w in msg_lower for w in ["urgent", "immediate", "act now", "limited time", "expire", "warning"]):
-        tags.append("🚨 High Urgency")
-        
-    # Phishing/Links
-    if "http" in msg_lower or ".com" in msg_lower or "click" in msg_lower:
-        tags.append("🔗 Link Analysis")
-        
-    return tags
+    return rule_engine.categories(message)
+
+def api_result(message, result=None, spam_prob=None, override_label=None, version=None):
+    # Shape of a single /api/predict result (also used per item by the batch endpoint);
+    # version is that of the predictor that served the request, not whatever is active now
+    if override_label is not None:
+        prediction = override_label.lower()
+        spam_prob = 50.0
+        is_spam = prediction == "spam"
+    else:
+        prediction = "spam" if result == "spam" else "ham"
+        is_spam = bool(result == "spam")
 
-   # Enhanced URL Scanner with Risk Score
+    return {
+        "prediction": prediction,
+        "spam_probability": float(spam_prob),
+        "is_spam": is_spam,
+        "tags": get_smart_categories(message) if is_spam else [],
+        "model_version": version
+    }
+
+# Enhanced URL Scanner with Risk Score
 def extract_urls(text):
-    urls = re.findall(r'(https?://\S+|www\.\S+)', text)
-    results = []
-    
-    suspicious_tlds = ['.xyz', '.top', '.club', '.info', '.gq', '.tk', '.ml', '.ga', '.cf']
-    suspicious_keywords = ['login', 'verify', 'account', 'update', 'secure', 'bank', 'prize', 'win']
-    
-    for url in urls:
-        risk_score = 0
-        reasons = []
-        
-        # Check TLD
-        if any(tld in url for tld in suspicious_tlds):
-            risk_score += 50
-            reasons.append("Suspicious TLD")
-            
-        # Check Keywords
-        if any(kw in url.lower() for kw in suspicious_keywords):
-            risk_score += 30
-            reasons.append("Suspicious Keyword")
-            
-        # Check for IP address based URL
-        if re.search(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', url):
-            risk_score += 80
-            reasons.append("IP Address URL")
-            
-        risk_level = "Low"
-        if risk_score > 70:
-            risk_level = "CRITICAL"
-        elif risk_score > 30:
-            risk_level = "High"
-        elif risk_score > 0:
-            risk_level = "Medium"
-            
-        results.append({
-            "url": url,
-            "risk_score": risk_score,
-            "risk_level": risk_level,
-            "reasons": ", ".join(reasons) if reasons else "None"
-        })
-        
-    return results
+    return rule_engine.scan_urls(text)
+
+# Dashboard Aggregates
+RADAR_KEYS = ["Financial", "Urgency", "Phishing", "Scam"]
+
+def history_stat_keys(message, result, timestamp, smart=None):
+    # Counter names a single history row contributes to
+    keys = ["total"]
+    if result and "SPAM" in result and "NOT SPAM" not in result:
+        keys.append("spam")
+
+    if smart is None:
+        smart = get_smart_categories(message)
+    if "💳 Financial Risk" in smart: keys.append("radar:Financial")
+    if "🚨 High Urgency" in smart: keys.append("radar:Urgency")
+    if "🔗 Link Analysis" in smart or "http" in message: keys.append("radar:Phishing")
+    if "💰 Potential Scam" in smart: keys.append("radar:Scam")
+
+    try:
+        # Timestamp format: YYYY-MM-DD HH:MM:SS
+        keys.append(f"hour:{int(str(timestamp).split()[1].split(':')[0]):02d}")
+    except (IndexError, ValueError):
+        pass
+
+    return keys
+
+def publish_counts(counts):
+    # After commit (db.after_commit): the shared counters only move for rows that landed
+    state.publish_counts(counts)
+    stats_memo.clear()
+
+def bump_stats(db, keys, delta):
+    db.executemany(
+        'INSERT INTO stats (name, count) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET count = count + excluded.count',
+        [(k, delta) for k in keys]
+    )
+    db.after_commit(publish_counts, {k: delta for k in keys})
+
+# Rollup names that are also dashboard counters
+STAT_ROLLUP_FILTER = "(name IN ('total', 'spam') OR name LIKE 'radar:%' OR name LIKE 'hour:%')"
+
+def rebuild_stats(db):
+    # Archived periods come from the daily rollups, the rest from the live rows
+    before = {row['name']: row['count'] for row in db.execute('SELECT name, count FROM stats')}
+    counts = {"total": 0}
+    for row in db.execute(f"SELECT name, SUM(count) AS n FROM history_rollups WHERE period = 'day' AND {STAT_ROLLUP_FILTER} GROUP BY name"):
+        counts[row['name']] = row['n']
+    for row in db.execute('SELECT message, result, timestamp FROM history'):
+        for k in history_stat_keys(row['message'], row['result'], row['timestamp']):
+            counts[k] = counts.get(k, 0) + 1
+    db.execute('DELETE FROM stats')
+    db.executemany('INSERT INTO stats (name, count) VALUES (?, ?)', list(counts.items()))
+    # Shared counters move by this replica's difference
+    db.after_commit(publish_counts, {k: counts.get(k, 0) - before.get(k, 0) for k in counts.keys() | before.keys()})
+
+def load_stats(db):
+    # This replica's counters, or the cluster-wide ones with a shared state backend
+    counts = state.fetch_counts(db)
+
+    tag_counts = {k: counts.get(f"radar:{k}", 0) for k in RADAR_KEYS}
+    hours = [f"{i:02d}:00" for i in range(24)]
+    traffic_data = {h: counts.get(f"hour:{h[:2]}", 0) for h in hours}
+
+    total = counts.get("total", 0)
+    spam_count = counts.get("spam", 0)
+    return {
+        "total": total,
+        "spam_count": spam_count,
+        "ham_count": total - spam_count,
+        "radar_data": tag_counts,
+        "traffic_data": traffic_data
+    }
+
+# /api/stats bodies per database, served for up to STATS_TTL seconds; writes in this
+# process drop them right away (other workers' writes show up after the TTL)
+STATS_TTL = 2.0
+stats_memo = LRUCache(maxsize=16, ttl=STATS_TTL)
+
+def stats_response():
+    # (JSON body, ETag); the ETag is a digest of the body, so it only changes with the counters.
+    # A memo hit does not touch the database at all.
+    database = app.config['DATABASE']
+    cached = stats_memo.get(database)
+    if cached is MISSING:
+        body = json.dumps(load_stats(get_db()), separators=(",", ":"))
+        cached = (body, hashlib.sha256(body.encode("utf-8")).hexdigest()[:20])
+        stats_memo.set(database, cached)
+    return cached
+
+def write_history(db, entries):
+    # entries: [(row, stat keys), ...]; caller commits, so rows and counters land together
+    campaign_ids = assign_campaigns(db, [(row[0], row[4]) for row, _ in entries])
+    db.executemany(
+        'INSERT INTO history (message, source, result, probability, timestamp, campaign_id) VALUES (?, ?, ?, ?, ?, ?)',
+        [(*row, campaign_id) for (row, _), campaign_id in zip(entries, campaign_ids)]
+    )
+    counts = {}
+    for _, keys in entries:
+        for k in keys:
+            counts[k] = counts.get(k, 0) + 1
+    db.executemany(
+        'INSERT INTO stats (name, count) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET count = count + excluded.count',
+        list(counts.items())
+    )
+    # Only once committed, so a failed (and retried) batch is never counted twice
+    db.after_commit(publish_counts, counts)
+
+def apply_history_batch(database, entries):
+    # Called by the write-behind thread: one transaction per flush
+    with get_pool(database).connection() as db:
+        write_history(db, entries)
+        db.commit()
+
+# History inserts are queued and committed in groups off the request path. At most
+# HISTORY_QUEUE_MAX rows wait per process; past that, requests write their own row.
+app.config['HISTORY_WRITE_BEHIND'] = True
+history_writer = HistoryWriter(apply_history_batch, flush_size=200, flush_interval=0.5,
+                               max_queue=int(os.environ.get("HISTORY_QUEUE_MAX", "10000")))
+atexit.register(history_writer.stop)
+HISTORY_COLUMNS = ("message", "source", "result", "probability", "timestamp")
+
+def record_history(db, message, source, result, probability, smart=None):
+    # Timestamp and counters are fixed at request time, even when the write is deferred
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    entry = ((message, source, result, probability, timestamp), history_stat_keys(message, result, timestamp, smart))
+    if app.config['HISTORY_WRITE_BEHIND'] and history_writer.submit(app.config['DATABASE'], entry):
+        return
+    # Synchronous (also when the write-behind queue is full); caller commits
+    write_history(db, [entry])
+
+def first_history_page(db):
+    # Newest page plus rows still waiting in this process's write-behind queue, so a
+    # submitter sees their own message right away. Pending rows have no id yet.
+    pending = history_writer.pending(app.config['DATABASE'])
+    rows, next_cursor = fetch_page(db, 'history')
+    written = {(r['message'], r['timestamp']) for r in rows}
+    unwritten = [dict(zip(HISTORY_COLUMNS, row), id=None) for row, _ in reversed(pending)
+                 if (row[0], row[4]) not in written]
+    return unwritten + rows, next_cursor
+
+# Shared state (opt-in: STATE_BACKEND=redis://host:6379/0)
+# Every replica keeps its own SQLite rows; overrides and dashboard counters are also
+# published to the backend, and read from it, so all replicas agree on them
+state = make_state(os.environ.get("STATE_BACKEND"))
+
+# Feedback Overrides
+# Keyed by (database, message hash); None is cached too, since most lookups miss
+override_cache = LRUCache(maxsize=10000)
+
+def normalize_message(message):
+    return " ".join(message.split()).casefold()
+
+def message_hash(message):
+    return hashlib.sha256(normalize_message(message).encode("utf-8")).hexdigest()
+
+def newest_label(db, msg_hash, admin):
+    row = db.execute(
+        f'SELECT user_label FROM feedback WHERE message_hash = ? AND user_label {"" if admin else "NOT "}LIKE "ADMIN%" '
+        'ORDER BY timestamp DESC, id DESC LIMIT 1',
+        (msg_hash,)
+    ).fetchone()
+    return row['user_label'].replace("ADMIN_", "") if row else None
+
+def resolve_override(db, msg_hash):
+    # Single resolution rule: ADMIN labels first, then the newest feedback
+    admin_label = newest_label(db, msg_hash, admin=True)
+    user_label = newest_label(db, msg_hash, admin=False)
+
+    label = admin_label or user_label
+    if label:
+        db.execute(
+            'INSERT INTO overrides (message_hash, label, is_admin) VALUES (?, ?, ?) '
+            'ON CONFLICT(message_hash) DO UPDATE SET label = excluded.label, is_admin = excluded.is_admin',
+            (msg_hash, label, int(admin_label is not None))
+        )
+    else:
+        db.execute('DELETE FROM overrides WHERE message_hash = ?', (msg_hash,))
+    # Both labels are published, so one replica's admin verdict outranks another's newer user report
+    return msg_hash, admin_label, user_label
+
+def publish_overrides(database, entries, remove_missing=False):
+    # After commit: other replicas only see labels that landed here
+    state.publish_overrides(entries, remove_missing)
+    for msg_hash, _, _ in entries:
+        override_cache.discard((database, msg_hash))
+
+def refresh_override(db, msg_hash, removed=False):
+    # removed: feedback for the message was deleted here, so labels this replica no longer
+    # has are withdrawn cluster-wide too (otherwise other replicas' labels are left alone)
+    db.after_commit(publish_overrides, app.config['DATABASE'], [resolve_override(db, msg_hash)], removed)
+    state.mark_overrides_changed(db)
+    override_cache.discard((app.config['DATABASE'], msg_hash))
+
+def rebuild_overrides(db):
+    rows = db.execute('SELECT id, message FROM feedback WHERE message_hash IS NULL').fetchall()
+    db.executemany('UPDATE feedback SET message_hash = ? WHERE id = ?', [(message_hash(r['message']), r['id']) for r in rows])
+    db.execute('DELETE FROM overrides')
+    hashes = [row['message_hash'] for row in db.execute('SELECT DISTINCT message_hash FROM feedback').fetchall()]
+    db.after_commit(publish_overrides, app.config['DATABASE'], [resolve_override(db, h) for h in hashes])
+    state.mark_overrides_changed(db)
+    db.after_commit(override_cache.clear)
+
+def lookup_overrides(db, messages):
+    # message -> label ("SPAM" / "NOT SPAM") for every message that has an override;
+    # cache misses are resolved with one indexed IN (...) query (or one pipelined round
+    # trip to the shared backend)
+    if state.overrides_changed(db):
+        # Another worker or replica changed an override: cached answers may be stale
+        override_cache.clear()
+    found, pending = {}, {}
+    for m in messages:
+        h = message_hash(m)
+        label = override_cache.get((app.config['DATABASE'], h))
+        if label is MISSING:
+            pending.setdefault(h, []).append(m)
+        elif label is not None:
+            found[m] = label
+
+    if pending:
+        exact = state.fetch_overrides(db, list(pending))
+        # Admin verdicts on a message's campaign cover it unless it has its own admin label
+        campaign = lookup_campaign_labels(db, {h: msgs[0] for h, msgs in pending.items()
+                                               if not exact.get(h, (None, 0))[1]})
+        for h, msgs in pending.items():
+            label, is_admin = exact.get(h, (None, 0))
+            if not is_admin and h in campaign:
+                label = campaign[h]
+            override_cache.set((app.config['DATABASE'], h), label)
+            if label is not None:
+                found.update((m, label) for m in msgs)
+
+    return found
+
+def lookup_override(db, message):
+    return lookup_overrides(db, [message]).get(message)
+
+def add_feedback(db, message, label):
+    msg_hash = message_hash(message)
+    db.execute(
+        'INSERT INTO feedback (message, user_label, message_hash) VALUES (?, ?, ?)',
+        (message, label, msg_hash)
+    )
+    refresh_override(db, msg_hash)
+
+# Campaigns
+# Slight variants of one spam template (different name, number or URL) are grouped
+# through MinHash + LSH band keys (see campaigns.py): a lookup is one indexed query on
+# the message's band keys, not a scan. An admin verdict on one variant is stored on
+# the campaign. A SPAM verdict covers every variant seen later, on every replica (the
+# campaign signature is published to the state backend). NOT SPAM only ever covers
+# the exact message: links, numbers and addresses are masked before shingling, so a
+# "variant" may carry a different, malicious URL.
+campaign_lsh = MinHashLSH()
+CAMPAIGN_SIMILARITY = 0.6
+CAMPAIGN_VIEW_SIZE = 20
+
+def match_campaigns(db, signatures, label=None):
+    # {key: signature} -> {key: (campaign row, similarity)} for the most similar
+    # campaign at or above CAMPAIGN_SIMILARITY (among those with this verdict, if given)
+    band_keys = {k: campaign_lsh.band_keys(sig) for k, sig in signatures.items()}
+    all_keys = list({b for keys in band_keys.values() for b in keys})
+
+    campaigns, by_band = {}, {}
+    for i in range(0, len(all_keys), 900):    # stay under SQLite's variable limit
+        chunk = all_keys[i:i + 900]
+        sql = ('SELECT b.band_key, c.id, c.signature, c.label FROM campaign_bands b '
+               'JOIN campaigns c ON c.id = b.campaign_id '
+               f'WHERE b.band_key IN ({",".join("?" * len(chunk))})')
+        if label:
+            sql += ' AND c.label = ?'
+            chunk = chunk + [label]
+        for row in db.execute(sql, chunk):
+            campaigns[row['id']] = row
+            by_band.setdefault(row['band_key'], []).append(row['id'])
+
+    found = {}
+    for k, sig in signatures.items():
+        best, best_sim = None, CAMPAIGN_SIMILARITY
+        for cid in {cid for b in band_keys[k] for cid in by_band.get(b, ())}:
+            sim = campaign_lsh.similarity(sig, campaign_lsh.from_bytes(campaigns[cid]['signature']))
+            if sim >= best_sim:
+                best, best_sim = campaigns[cid], sim
+        if best is not None:
+            found[k] = (best, best_sim)
+    return found
+
+def create_campaign(db, message, signature, timestamp, size=1):
+    cur = db.execute(
+        'INSERT INTO campaigns (signature, sample, size, first_seen, last_seen) VALUES (?, ?, ?, ?, ?)',
+        (campaign_lsh.to_bytes(signature), message, size, timestamp, timestamp)
+    )
+    db.executemany('INSERT OR IGNORE INTO campaign_bands (band_key, campaign_id) VALUES (?, ?)',
+                   [(b, cur.lastrowid) for b in campaign_lsh.band_keys(signature)])
+    return cur.lastrowid
+
+def assign_campaigns(db, messages):
+    # messages: [(message, timestamp), ...]; each joins its closest campaign or starts one.
+    # One at a time, so variants within the same batch find each other. Returns the
+    # campaign id per message (None for ones too short to have a signature).
+    campaign_ids = []
+    for message, timestamp in messages:
+        signature = campaign_lsh.signature(message)
+        if signature is None:
+            campaign_ids.append(None)
+            continue
+        match = match_campaigns(db, {0: signature}).get(0)
+        if match:
+            db.execute('UPDATE campaigns SET size = size + 1, last_seen = ? WHERE id = ?', (timestamp, match[0]['id']))
+            campaign_ids.append(match[0]['id'])
+        else:
+            campaign_ids.append(create_campaign(db, message, signature, timestamp))
+    return campaign_ids
+
+def release_campaigns(db, campaign_ids):
+    # History rows deleted or archived (their campaign_id values): each campaign shrinks
+    # by its rows, and unreviewed ones left empty are dropped. Caller commits.
+    counts = {}
+    for campaign_id in campaign_ids:
+        if campaign_id is not None:
+            counts[campaign_id] = counts.get(campaign_id, 0) + 1
+    db.executemany('UPDATE campaigns SET size = MAX(size - ?, 0) WHERE id = ?',
+                   [(n, campaign_id) for campaign_id, n in counts.items()])
+    drop_empty_campaigns(db)
+
+def drop_empty_campaigns(db):
+    # Campaigns with no history rows left, with their band keys. One carrying an admin
+    # verdict stays until the verdict is withdrawn: it still covers future variants.
+    empty = [(r[0],) for r in db.execute('SELECT id FROM campaigns WHERE size = 0 AND label IS NULL')]
+    db.executemany('DELETE FROM campaign_bands WHERE campaign_id = ?', empty)
+    db.executemany('DELETE FROM campaigns WHERE id = ?', empty)
+
+def backfill_history_campaigns(db):
+    # Links existing history rows to the campaign each one matches now
+    linked = []
+    for row in db.execute('SELECT id, message FROM history').fetchall():
+        signature = campaign_lsh.signature(row['message'])
+        match = match_campaigns(db, {0: signature}).get(0) if signature is not None else None
+        if match:
+            linked.append((match[0]['id'], row['id']))
+    db.executemany('UPDATE history SET campaign_id = ? WHERE id = ?', linked)
+
+def match_published_campaigns(signatures, published):
+    # Keys whose signature is within CAMPAIGN_SIMILARITY of a published spam campaign
+    if not signatures or not published:
+        return set()
+    matrix = np.stack([campaign_lsh.from_bytes(bytes.fromhex(h)) for h in published])
+    return {k for k, sig in signatures.items() if (matrix == sig).mean(axis=1).max() >= CAMPAIGN_SIMILARITY}
+
+def lookup_campaign_labels(db, messages):
+    # {key: message} -> {key: "SPAM"} for messages whose campaign an admin marked as spam,
+    # on this replica (indexed band lookup) or another one (published signatures)
+    if not messages:
+        return {}
+    local = db.execute("SELECT 1 FROM campaigns WHERE label = 'SPAM' LIMIT 1").fetchone() is not None
+    published = state.fetch_campaign_verdicts()
+    if not local and not published:
+        return {}
+    signatures = {}
+    for k, m in messages.items():
+        signature = campaign_lsh.signature(m)
+        if signature is not None:
+            signatures[k] = signature
+    found = {k: row['label'] for k, (row, _) in match_campaigns(db, signatures, label="SPAM").items()} if local else {}
+    rest = {k: sig for k, sig in signatures.items() if k not in found}
+    found.update((k, "SPAM") for k in match_published_campaigns(rest, published))
+    return found
+
+def publish_campaign_verdict(signature, spam):
+    # After commit. Withdrawing a spam verdict also withdraws the same campaign as
+    # published by other replicas (their cluster signature differs slightly from ours).
+    key = campaign_lsh.to_bytes(signature).hex()
+    if spam:
+        state.publish_campaign_verdicts(add=[key])
+    else:
+        published = state.fetch_campaign_verdicts()
+        similar = [h for h in published if match_published_campaigns({0: signature}, [h])]
+        state.publish_campaign_verdicts(remove=[key] + similar)
+
+def label_campaign(db, message, label):
+    # Admin verdict (None clears it) for the message's campaign, started here if the
+    # message has none yet. Caller commits, then clears override_cache: cached answers
+    # for the other variants are stale (other workers see the version bump).
+    signature = campaign_lsh.signature(message)
+    if signature is None:
+        return None
+    match = match_campaigns(db, {0: signature}).get(0)
+    if match:
+        campaign_id = match[0]['id']
+    elif label is None:
+        return None
+    else:
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        campaign_id = create_campaign(db, message, signature, timestamp, size=0)
+    db.execute('UPDATE campaigns SET label = ? WHERE id = ?', (label, campaign_id))
+    state.mark_overrides_changed(db)
+    stored = db.execute('SELECT signature FROM campaigns WHERE id = ?', (campaign_id,)).fetchone()[0]
+    db.after_commit(publish_campaign_verdict, campaign_lsh.from_bytes(stored), label == "SPAM")
+    if label is None:
+        drop_empty_campaigns(db)
+    return campaign_id
+
+def top_campaigns(db, limit=CAMPAIGN_VIEW_SIZE):
+    # Largest clusters first; single messages are not campaigns
+    return db.execute(
+        'SELECT id, sample, size, label, first_seen, last_seen FROM campaigns '
+        'WHERE size >= 2 ORDER BY size DESC, id DESC LIMIT ?', (limit,)
+    ).fetchall()
+
+# Keyset Pagination
+def make_cursor(row):
+    return f"{row['timestamp']}|{row['id']}"
+
+def parse_cursor(value):
+    # "<timestamp>|<id>" -> (timestamp, id); raises ValueError on garbage
+    if not value:
+        return None
+    timestamp, _, row_id = value.rpartition("|")
+    if not timestamp:
+        raise ValueError("Invalid cursor")
+    return timestamp, int(row_id)
+
+def fetch_page(db, table, cursor=None, limit=PAGE_SIZE, where=None):
+    # One index range scan per page, no matter how deep the cursor is
+    clauses = [where] if where else []
+    params = []
+    if cursor:
+        clauses.append('(timestamp, id) < (?, ?)')
+        params.extend(cursor)
+
+    sql = f'SELECT * FROM {table}'
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+
+    rows = db.execute(sql, params + [limit + 1]).fetchall()
+    next_cursor = make_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def page_args(cursor_param="cursor"):
+    # Cursor + limit from the query string; invalid values raise ValueError
+    cursor = parse_cursor(request.args.get(cursor_param))
+    limit = min(max(int(request.args.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    return cursor, limit
+
+def safe_cursor(cursor_param):
+    # HTML views fall back to the first page instead of erroring
+    try:
+        return parse_cursor(request.args.get(cursor_param))
+    except ValueError:
+        return None
+
+ADMIN_QUEUE_FILTER = 'user_label NOT LIKE "ADMIN%"'
+
+def page_json(table, where=None):
+    try:
+        cursor, limit = page_args()
+    except ValueError:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+
+    rows, next_cursor = fetch_page(get_db(), table, cursor, limit, where)
+    return jsonify({"items": [dict(r) for r in rows], "next_cursor": next_cursor})
+
+# History Filters (CSV export)
+RESULT_LABELS = {"spam": "🚫 SPAM", "ham": "✅ NOT SPAM"}
+
+def parse_time_bound(value, end=False):
+    # ISO 8601 date or timestamp (naive values are UTC) -> the stored 'YYYY-MM-DD HH:MM:SS'
+    # form, so the string comparison in SQL orders correctly; a bare end date covers the whole day
+    value = value.strip()
+    try:
+        bound = datetime.combine(date.fromisoformat(value), dt_time.max if end else dt_time.min)
+    except ValueError:
+        bound = datetime.fromisoformat(value)
+    if bound.tzinfo is None:
+        bound = bound.replace(tzinfo=timezone.utc)
+    return bound.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def history_filters(args):
+    where, params = [], []
+    if args.get("start"):
+        try:
+            params.append(parse_time_bound(args["start"]))
+        except ValueError:
+            raise ValueError("Invalid start date")
+        where.append('timestamp >= ?')
+    if args.get("end"):
+        try:
+            params.append(parse_time_bound(args["end"], end=True))
+        except ValueError:
+            raise ValueError("Invalid end date")
+        where.append('timestamp <= ?')
+    if args.get("result"):
+        if args["result"].lower() not in RESULT_LABELS:
+            raise ValueError("result must be 'spam' or 'ham'")
+        where.append('result = ?')
+        params.append(RESULT_LABELS[args["result"].lower()])
+    if args.get("source"):
+        where.append('source = ?')
+        params.append(args["source"])
+    return where, params
+
+# Full-text Search
+# One external-content FTS5 index per table (the text is not stored twice), kept in
+# step with the table by triggers, so every insert/delete path stays searchable
+SEARCH_TABLES = ("history", "feedback")
+SEARCH_SORTS = ("rank", "newest")
+MAX_SEARCH_TERMS = 16
+# bm25 costs a few microseconds per match, so ranking scores only the newest
+# SEARCH_RANK_WINDOW matches (recent campaigns first); sort=newest has no limit.
+# A ranked response says when matches were left out and gives an older_cursor that
+# continues with them newest-first (sort=newest&cursor=...)
+SEARCH_RANK_WINDOW = 5000
+# Ranked results page by offset within the window
+MAX_SEARCH_OFFSET = SEARCH_RANK_WINDOW
+FEEDBACK_RESULT_LABELS = {"spam": ("SPAM", "ADMIN_SPAM"), "ham": ("NOT SPAM", "ADMIN_NOT SPAM")}
+SEARCH_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+def create_search_index(db, table):
+    fts = f"{table}_fts"
+    exists = db.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (fts,)).fetchone()
+    db.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(message, content='{table}', content_rowid='id')")
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts} (rowid, message) VALUES (new.id, new.message);
+        END
+    ''')
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+    ''')
+    db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF message ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO {fts} (rowid, message) VALUES (new.id, new.message);
+        END
+    ''')
+    # Existing database: index the rows written before search existed
+    if not exists:
+        db.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def match_query(text):
+    # User text -> FTS5 MATCH expression. Every word or "quoted phrase" must appear;
+    # a trailing * turns a word into a prefix. Terms are always quoted, so FTS5
+    # syntax typed by the user (AND, NEAR, column:...) is searched for literally.
+    terms = []
+    for phrase, word in SEARCH_TERM.findall(text or ""):
+        prefix = len(word) > 1 and word.endswith("*")
+        term = (phrase or word.rstrip("*")).strip()
+        # Punctuation-only terms have no tokens to match
+        if not re.search(r'\w', term):
+            continue
+        terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    if not terms:
+        raise ValueError("Search query must contain at least one word")
+    if len(terms) > MAX_SEARCH_TERMS:
+        raise ValueError(f"Too many search terms (max {MAX_SEARCH_TERMS})")
+    return " ".join(terms)
+
+def search_filters(table, args):
+    # Same filters as the CSV export; feedback has labels instead of result/source
+    if table == "history":
+        return history_filters(args)
+    if args.get("source"):
+        raise ValueError("source filter only applies to history")
+    where, params = history_filters({k: args[k] for k in ("start", "end") if args.get(k)})
+    if args.get("result"):
+        labels = FEEDBACK_RESULT_LABELS.get(args["result"].lower())
+        if not labels:
+            raise ValueError("result must be 'spam' or 'ham'")
+        where.append('user_label IN (?, ?)')
+        params.extend(labels)
+    return where, params
+
+def parse_search_cursor(value, sort):
+    # rank: offset into the ranked results; newest: last id seen
+    if not value:
+        return None
+    cursor = int(value)
+    if cursor < 0 or (sort == "rank" and cursor > MAX_SEARCH_OFFSET):
+        raise ValueError("Invalid cursor")
+    return cursor
+
+def search(db, table, query, where=(), params=(), sort="rank", cursor=None, limit=PAGE_SIZE):
+    # Ranked (bm25) or newest-first matches. The MATCH drives the plan and walks the
+    # index in rowid order; filters apply to the joined rows. Returns the page, the
+    # next cursor and, for a ranked search that hit the window, the older_cursor.
+    fts = f"{table}_fts"
+    clauses = [f'{fts} MATCH ?'] + list(where)
+    args = [query] + list(params)
+    if sort == "newest" and cursor:
+        clauses.append(f'{fts}.rowid < ?')
+        args.append(cursor)
+    joined = f'FROM {fts} JOIN {table} t ON t.id = {fts}.rowid WHERE {" AND ".join(clauses)} ORDER BY {fts}.rowid DESC'
+    matches = f'SELECT t.*, {fts}.rank AS score {joined}'
+
+    older_cursor = None
+    if sort == "newest":
+        rows = db.execute(f'{matches} LIMIT ?', args + [limit + 1]).fetchall()
+    else:
+        rows = db.execute(
+            f'SELECT * FROM ({matches} LIMIT {SEARCH_RANK_WINDOW}) ORDER BY score, id DESC LIMIT ? OFFSET ?',
+            args + [limit + 1, cursor or 0]
+        ).fetchall()
+        # Oldest match inside the window, if there are more beyond it (rowids only, no bm25)
+        edge = db.execute(f'SELECT t.id {joined} LIMIT 2 OFFSET {SEARCH_RANK_WINDOW - 1}', args).fetchall()
+        if len(edge) > 1:
+            older_cursor = str(edge[0][0])
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not more:
+        next_cursor = None
+    elif sort == "newest":
+        next_cursor = str(rows[-1]['id'])
+    else:
+        offset = (cursor or 0) + limit
+        next_cursor = str(offset) if offset < MAX_SEARCH_OFFSET else None
+
+    # Highlighted snippets for this page only
+    snippets = {}
+    if rows:
+        ids = [r['id'] for r in rows]
+        snippets = dict(db.execute(
+            f"SELECT rowid, snippet({fts}, 0, '[', ']', '…', 12) FROM {fts} "
+            f"WHERE {fts} MATCH ? AND rowid IN ({','.join('?' * len(ids))})",
+            [query] + ids
+        ).fetchall())
+
+    items = []
+    for r in rows:
+        item = dict(r)
+        item['score'] = round(-item['score'], 4)    # bm25: lower is better, flip for readability
+        item['snippet'] = snippets.get(r['id'], r['message'])
+        items.append(item)
+    return items, next_cursor, older_cursor
+
+# Initialize DB structure
+init_db()
+
+# History Retention (opt-in: HISTORY_RETENTION_DAYS=30)
+# Rows older than the window are archived to gzip CSV, rolled up and deleted in
+# small batches every RETENTION_INTERVAL seconds
+ARCHIVE_DIR = os.environ.get("HISTORY_ARCHIVE_DIR", "archive")
+archiver = None
+
+def archive_keys(row):
+    smart = get_smart_categories(row['message'])
+    return history_stat_keys(row['message'], row['result'], row['timestamp'], smart) + [f"category:{t}" for t in smart]
+
+def make_archiver(days, archive_dir=ARCHIVE_DIR, batch_size=500):
+    return HistoryArchiver(app.config['DATABASE'], archive_dir, days, archive_keys, batch_size,
+                           release_campaigns=release_campaigns)
+
+if float(os.environ.get("HISTORY_RETENTION_DAYS", "0")) > 0:
+    archiver = make_archiver(float(os.environ["HISTORY_RETENTION_DAYS"]))
+    atexit.register(archiver.stop)
+
+def start_background_tasks():
+    # Per-process threads; they do not survive fork, so the pre-fork server calls
+    # this in every worker (post_fork) rather than once at import in the master
+    metrics.start_writer(float(os.environ.get("METRICS_WRITE_INTERVAL", "1")))
+    if os.environ.get("PROFILE_SAMPLE_INTERVAL"):
+        profiler.start(float(os.environ["PROFILE_SAMPLE_INTERVAL"]))
+    # Optional artifact watcher, e.g. MODEL_WATCH_INTERVAL=30
+    if float(os.environ.get("MODEL_WATCH_INTERVAL", "0")) > 0:
+        model_registry.start_watcher(float(os.environ["MODEL_WATCH_INTERVAL"]))
+    if online_trainer:
+        online_trainer.start()
+    if archiver:
+        archiver.start(float(os.environ.get("RETENTION_INTERVAL", "300")))
+
+if not PREFORK:
+    start_background_tasks()
+
+# Executors for /api/predict/async: model scoring and SQLite lookups get separate
+# bounded pools, so a slow disk never holds up scoring and vice versa. Threads are
+# created on first use, i.e. after fork in pre-fork workers.
+inference_executor = ThreadPoolExecutor(int(os.environ.get("INFERENCE_THREADS", "4")), thread_name_prefix="inference")
+db_executor = ThreadPoolExecutor(int(os.environ.get("DB_THREADS", "4")), thread_name_prefix="db")
+
+async def run_in(executor, fn, *args):
+    # Await fn(*args) on an executor thread; the copied context keeps the request
+    # and app context (get_db, stage labels) visible there
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(ctx.run, fn, *args))
+
+def daily_activity(db, days):
+    # [{day, total, spam}] for the last `days` days: rollups for archived periods,
+    # live rows (one timestamp index range scan) for the rest
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    activity = {}
+    for row in db.execute(
+        "SELECT bucket, name, count FROM history_rollups "
+        "WHERE period = 'day' AND bucket >= ? AND name IN ('total', 'spam')", (since,)
+    ):
+        activity.setdefault(row['bucket'], {"total": 0, "spam": 0})[row['name']] += row['count']
+    for row in db.execute(
+        "SELECT substr(timestamp, 1, 10) AS day, COUNT(*) AS total, "
+        "SUM(result LIKE '%SPAM%' AND result NOT LIKE '%NOT SPAM%') AS spam "
+        "FROM history WHERE timestamp >= ? GROUP BY day", (since,)
+    ):
+        day = activity.setdefault(row['day'], {"total": 0, "spam": 0})
+        day["total"] += row['total']
+        day["spam"] += row['spam']
+    return [{"day": day, **counts} for day, counts in sorted(activity.items())]
 
 # Authentication Routes
 @app.route("/login", methods=["GET", "POST"])
@@ -151,8 +1136,15 @@ def delete_feedback(id):
         return redirect(url_for('login'))
         
     db = get_db()
-    db.execute('DELETE FROM feedback WHERE id = ?', (id,))
-    db.commit()
+    row = db.execute('SELECT message, user_label, message_hash FROM feedback WHERE id = ?', (id,)).fetchone()
+    if row:
+        db.execute('DELETE FROM feedback WHERE id = ?', (id,))
+        refresh_override(db, row['message_hash'], removed=True)
+        # Withdrawing an admin verdict also withdraws it from the message's campaign
+        if row['user_label'].startswith("ADMIN_"):
+            label_campaign(db, row['message'], None)
+        db.commit()
+        override_cache.clear()
     return redirect(url_for('admin'))
 
 @app.route("/", methods=["GET", "POST"])
@@ -174,106 +1166,66 @@ def index():
         source = request.form.get("source")
 
         if message and message.strip():
-            # 1. Check Feedback Override (Database)
-            # Prioritize ADMIN labels first
-            override = db.execute(
-                'SELECT user_label FROM feedback WHERE message = ? ORDER BY CASE WHEN user_label LIKE "ADMIN%" THEN 1 ELSE 2 END, timestamp DESC LIMIT 1', 
-                (message,)
-            ).fetchone()
+            # 1. Check Feedback Override (cached, ADMIN labels take priority)
+            with stage("override"):
+                override = lookup_override(db, message)
             
+            # Rule scan: smart tags and trigger keywords from one word scan
+            with stage("rules"):
+                hits = rule_engine.match_words(message)
+                smart = rule_engine.categories(message, hits)
+                keywords_found = rule_engine.keywords(message, hits)
+
             # URL Scan
-            urls_found = extract_urls(message)
+            with stage("urls"):
+                urls_found = extract_urls(message)
             if any(u['risk_score'] > 0 for u in urls_found):
                 tags.append("🔗 Link Analysis")
 
             if override:
-                result = override['user_label']
-                # Strip ADMIN_ prefix if present
-                display_result = result.replace("ADMIN_", "")
-                
                 spam_prob = 50.0
-                prediction = "🚫 SPAM" if "SPAM" in display_result else "✅ NOT SPAM"
+                prediction = "🚫 SPAM" if override == "SPAM" else "✅ NOT SPAM"
                 probability = "50% (Verified)"
                 tags.append("👤 User/Admin Override")
             else:
-                # 2. AI Model Prediction
-                data = vectorizer.transform([message])
-                result = model.predict(data)[0]
-                probs = model.predict_proba(data)[0]
-
-                spam_prob = probs[list(model.classes_).index("spam")] * 100
+                # 2. AI Model Prediction (cached per message + model version)
+                result, spam_prob = predict_messages([message])[0]
                 prediction = "🚫 SPAM" if result == "spam" else "✅ NOT SPAM"
                 probability = f"{spam_prob:.2f}%"
                 
                 # Smart Categorization
-                smart_tags = get_smart_categories(message)
-                tags.extend(smart_tags)
+                tags.extend(smart)
 
-            keywords_found = [k for k in SPAM_KEYWORDS if k in message.lower()]
+            with stage("history_insert"):
+                record_history(db, message, source, prediction, probability, smart=smart)
+                db.commit()
 
-            db.execute(
-                'INSERT INTO history (message, source, result, probability) VALUES (?, ?, ?, ?)',
-                (message, source, prediction, probability)
-            )
-            db.commit()
+    # Fetch History (one page)
+    with stage("history_page"):
+        history_cursor = safe_cursor('history_cursor')
+        if history_cursor is None:
+            history_rows, next_history_cursor = first_history_page(db)
+        else:
+            history_rows, next_history_cursor = fetch_page(db, 'history', history_cursor)
 
-    # Fetch History
-    history_rows = db.execute('SELECT * FROM history ORDER BY timestamp DESC').fetchall()
-    
-    # Calculate Data for Radar Chart
-    tag_counts = {
-        "Financial": 0,
-        "Urgency": 0,
-        "Phishing": 0, 
-        "Scam": 0
-    }
-    
-    for row in history_rows:
-         msg = row['message']
-         smart = get_smart_categories(msg)
-         if "💳 Financial Risk" in smart: tag_counts["Financial"] += 1
-         if "🚨 High Urgency" in smart: tag_counts["Urgency"] += 1
-         if "🔗 Link Analysis" in smart or "http" in msg: tag_counts["Phishing"] += 1
-         if "💰 Potential Scam" in smart: tag_counts["Scam"] += 1
-
-    # Calculate Traffic (Activity by Hour)
-    hours = [f"{i:02d}:00" for i in range(24)]
-    traffic_data = {h: 0 for h in hours}
-    
-    for row in history_rows:
-        try:
-            # Timestamp format: YYYY-MM-DD HH:MM:SS
-            ts = row['timestamp']
-            if ts:
-                hour_key = f"{int(ts.split()[1].split(':')[0]):02d}:00"
-                if hour_key in traffic_data:
-                    traffic_data[hour_key] += 1
-        except:
-            pass
-
-    # Fetch Feedback
-    feedback_rows = db.execute('SELECT * FROM feedback ORDER BY timestamp DESC').fetchall()
-
-    # Statistics
-    total = len(history_rows)
-    spam_count = sum(1 for h in history_rows if "SPAM" in h['result'])
-    ham_count = total - spam_count
-
-    return render_template(
-        "index.html",
-        prediction=prediction,
-        probability=probability,
-        keywords=keywords_found,
-        tags=tags,
-        urls=urls_found,
-        history=history_rows,
-        total=total,
-        spam_count=spam_count,
-        ham_count=ham_count,
-        feedback=feedback_rows,
-        radar_data=tag_counts,
-        traffic_data=traffic_data
-    )
+    # Fetch Feedback (one page)
+    with stage("feedback_page"):
+        feedback_rows, next_feedback_cursor = fetch_page(db, 'feedback', safe_cursor('feedback_cursor'))
+
+    # Statistics, Radar Chart and Traffic (Activity by Hour) are loaded by the page from /api/stats
+    with stage("render"):
+        return render_template(
+            "index.html",
+            prediction=prediction,
+            probability=probability,
+            keywords=keywords_found,
+            tags=tags,
+            urls=urls_found,
+            history=history_rows,
+            next_history_cursor=next_history_cursor,
+            feedback=feedback_rows,
+            next_feedback_cursor=next_feedback_cursor
+        )
 
 @app.route("/api/predict", methods=["POST"])
 def api_predict():
@@ -283,31 +1235,132 @@ def api_predict():
     if not message:
         return jsonify({"error": "No message provided"}), 400
     
+    current = predictor
     # Check Override
-    db = get_db()
-    cursor = db.execute('SELECT user_label FROM feedback WHERE message = ? ORDER BY id DESC LIMIT 1', (message,))
-    override = cursor.fetchone()
+    with stage("override"):
+        override = lookup_override(get_db(), message)
     
     if override:
-        prediction = override['user_label'].lower()
-        spam_prob = 50.0
-        is_spam = prediction == "spam"
+        with stage("serialize"):
+            return jsonify(api_result(message, override_label=override, version=current.version))
+
+    result, spam_prob = predict_messages([message], current)[0]
+    # api_result runs the tag and URL rules
+    with stage("serialize"):
+        return jsonify(api_result(message, result=result, spam_prob=spam_prob, version=current.version))
+
+@app.route("/api/predict/async", methods=["POST"])
+async def api_predict_async():
+    # Same contract as /api/predict. The override lookup and the model run on separate
+    # executors, the model only when no override applies (an override hit skips inference).
+    data = request.json or {}
+    message = data.get("message", "")
+
+    if not message:
+        return jsonify({"error": "No message provided"}), 400
+
+    db = get_db()
+    current = predictor
+    override = await run_in(db_executor, lookup_override, db, message)
+    if override:
+        with stage("serialize"):
+            return jsonify(api_result(message, override_label=override, version=current.version))
+
+    scored = await run_in(inference_executor, predict_messages, [message], current)
+    with stage("serialize"):
+        result, spam_prob = scored[0]
+        return jsonify(api_result(message, result=result, spam_prob=spam_prob, version=current.version))
+
+@app.route("/api/predict/batch", methods=["POST"])
+def api_predict_batch():
+    data = request.json or {}
+    messages = data.get("messages")
+
+    if not isinstance(messages, list) or not messages:
+        return jsonify({"error": "No messages provided"}), 400
+    if len(messages) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch too large (max {MAX_BATCH_SIZE} messages)"}), 400
+    if not all(isinstance(m, str) and m for m in messages):
+        return jsonify({"error": "Every message must be a non-empty string"}), 400
+
+    # Overrides for the whole batch (cache first, then one query for the rest)
+    unique = list(dict.fromkeys(messages))
+    overrides = lookup_overrides(get_db(), unique)
+
+    # One transform + one predict_proba for everything the model (and cache) has not seen
+    current = predictor
+    to_score = [m for m in unique if m not in overrides]
+    scored = dict(zip(to_score, predict_messages(to_score, current))) if to_score else {}
+
+    results = []
+    for m in messages:
+        if m in overrides:
+            results.append(api_result(m, override_label=overrides[m], version=current.version))
+        else:
+            label, spam_prob = scored[m]
+            results.append(api_result(m, result=label, spam_prob=spam_prob, version=current.version))
+
+    return jsonify({"results": results})
+
+@app.route("/api/history")
+def api_history():
+    return page_json('history')
+
+@app.route("/api/feedback")
+def api_feedback():
+    return page_json('feedback')
+
+@app.route("/api/stats")
+def api_stats():
+    # Dashboard aggregates (totals, radar, hourly traffic). Polling clients send the ETag
+    # back in If-None-Match and get an empty 304 until the counters change.
+    with stage("stats"):
+        body, etag = stats_response()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
     else:
-        vec_data = vectorizer.transform([message])
-        result = model.predict(vec_data)[0]
-        probs = model.predict_proba(vec_data)[0]
-        spam_prob = probs[list(model.classes_).index("spam")] * 100
-        prediction = "spam" if result == "spam" else "ham"
-        is_spam = bool(result == "spam")
-    
-    tags = get_smart_categories(message) if is_spam else []
-    
-    return jsonify({
-        "prediction": prediction,
-        "spam_probability": spam_prob,
-        "is_spam": is_spam,
-        "tags": tags
-    })
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/activity")
+def api_activity():
+    try:
+        days = min(max(int(request.args.get("days", 30)), 1), 366)
+    except ValueError:
+        return jsonify({"error": "Invalid days"}), 400
+    return jsonify({"days": daily_activity(get_db(), days)})
+
+@app.route("/api/search")
+def api_search():
+    # ?q=words "exact phrase" prefix*&table=history|feedback&sort=rank|newest
+    #   &result=spam|ham&source=SMS&start=YYYY-MM-DD[ HH:MM:SS]&end=...&cursor=...&limit=...
+    table = request.args.get("table", "history")
+    sort = request.args.get("sort", "rank")
+    if table not in SEARCH_TABLES:
+        return jsonify({"error": "table must be 'history' or 'feedback'"}), 400
+    if sort not in SEARCH_SORTS:
+        return jsonify({"error": "sort must be 'rank' or 'newest'"}), 400
+
+    try:
+        query = match_query(request.args.get("q"))
+        where, params = search_filters(table, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        cursor = parse_search_cursor(request.args.get("cursor"), sort)
+        limit = min(max(int(request.args.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor or limit"}), 400
+
+    with stage("search"):
+        items, next_cursor, older_cursor = search(get_db(), table, query, where, params, sort, cursor, limit)
+    result = {"items": items, "next_cursor": next_cursor}
+    if sort == "rank":
+        # Ranking covers the newest rank_window matches; older ones via sort=newest&cursor=older_cursor
+        result.update(truncated=older_cursor is not None, rank_window=SEARCH_RANK_WINDOW, older_cursor=older_cursor)
+    return jsonify(result)
 
 @app.route("/feedback", methods=["POST"])
 def feedback():
@@ -316,46 +1369,80 @@ def feedback():
     
     if message and user_label:
         db = get_db()
-        db.execute(
-            'INSERT INTO feedback (message, user_label) VALUES (?, ?)',
-            (message, user_label)
-        )
+        add_feedback(db, message, user_label)
         db.commit()
         
     return redirect(url_for('index'))
 
 @app.route("/delete_history/<int:id>", methods=["POST"])
 def delete_history_item(id):
+    history_writer.flush()
     db = get_db()
-    db.execute('DELETE FROM history WHERE id = ?', (id,))
-    db.commit()
+    row = db.execute('SELECT message, result, timestamp, campaign_id FROM history WHERE id = ?', (id,)).fetchone()
+    if row:
+        db.execute('DELETE FROM history WHERE id = ?', (id,))
+        bump_stats(db, history_stat_keys(row['message'], row['result'], row['timestamp']), -1)
+        release_campaigns(db, [row['campaign_id']])
+        db.commit()
     return redirect(url_for('index'))
 
 @app.route("/clear_history", methods=["POST"])
 def clear_history():
+    # Pending rows predate the clear, so write them first and let them be deleted too
+    history_writer.flush()
     db = get_db()
     db.execute('DELETE FROM history')
+    db.execute('DELETE FROM history_rollups')
+    # Campaigns are built from history; only admin verdicts outlive it
+    db.execute('UPDATE campaigns SET size = 0')
+    drop_empty_campaigns(db)
+    rebuild_stats(db)
     db.commit()
     return redirect(url_for('index'))
 
 @app.route("/export_csv")
 def export_csv():
-    db = get_db()
-    cur = db.execute('SELECT * FROM history')
-    rows = cur.fetchall()
-    
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Message', 'Source', 'Result', 'Probability', 'Timestamp'])
-    
-    for row in rows:
-        writer.writerow([row['id'], row['message'], row['source'], row['result'], row['probability'], row['timestamp']])
-        
-    output.seek(0)
-    
+    # Optional filters: ?start=YYYY-MM-DD[ HH:MM:SS]&end=...&result=spam|ham&source=SMS
+    try:
+        where, params = history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sql = 'SELECT id, message, source, result, probability, timestamp FROM history'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY timestamp, id'
+
+    database = app.config['DATABASE']
+
+    def generate():
+        # Own connection: the request's one is returned before the stream finishes.
+        # Stream the cursor chunk by chunk; memory stays flat regardless of table size
+        pool = get_pool(database)
+        db = pool.acquire()
+        cur = None
+        try:
+            cur = db.execute(sql, params)
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(['ID', 'Message', 'Source', 'Result', 'Probability', 'Timestamp'])
+
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK_SIZE)
+                writer.writerows(rows)
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+                if not rows:
+                    break
+        finally:
+            # Abandoned downloads must not leave a live statement on a pooled connection
+            if cur is not None:
+                cur.close()
+            pool.release(db)
+
     return Response(
-        output,
+        generate(),
         mimetype="text/csv",
         headers={"Content-Disposition": "attachment;filename=spam_history.csv"}
     )
@@ -371,18 +1458,159 @@ def admin():
     db = get_db()
     
     # Calculate stats for admin dashboard
-    total = db.execute('SELECT COUNT(*) FROM history').fetchone()[0]
-    spam_count = db.execute('SELECT COUNT(*) FROM history WHERE result LIKE "%SPAM%"').fetchone()[0]
-    ham_count = total - spam_count
+    with stage("stats"):
+        stats = load_stats(db)
     
-    # Fetch ONLY User Feedback (Exclude Admin's own actions)
-    feedback_queue = db.execute('SELECT * FROM feedback WHERE user_label NOT LIKE "ADMIN%" ORDER BY timestamp DESC').fetchall()
+    # Fetch ONLY User Feedback (Exclude Admin's own actions), one page at a time
+    with stage("feedback_page"):
+        feedback_queue, next_cursor = fetch_page(db, 'feedback', safe_cursor('cursor'), where=ADMIN_QUEUE_FILTER)
+
+    # Near-duplicate campaigns by size
+    with stage("campaigns"):
+        campaigns = top_campaigns(db)
     
-    return render_template('admin.html', 
-                           feedback=feedback_queue, 
-                           total=total, 
-                           spam_count=spam_count, 
-                           ham_count=ham_count)
+    with stage("render"):
+        return render_template('admin.html', 
+                               feedback=feedback_queue, 
+                               next_cursor=next_cursor,
+                               campaigns=campaigns,
+                               total=stats['total'], 
+                               spam_count=stats['spam_count'], 
+                               ham_count=stats['ham_count'])
+
+@app.route("/admin/api/feedback")
+def admin_api_feedback():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+
+    return page_json('feedback', where=ADMIN_QUEUE_FILTER)
+
+@app.route("/admin/api/campaigns")
+def admin_api_campaigns():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+
+    try:
+        limit = min(max(int(request.args.get("limit", CAMPAIGN_VIEW_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    return jsonify({"items": [dict(r) for r in top_campaigns(get_db(), limit)]})
+
+@app.route("/admin/api/retention", methods=["GET", "POST"])
+def admin_api_retention():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+    if archiver is None:
+        return jsonify({"error": "Retention is disabled (set HISTORY_RETENTION_DAYS)"}), 404
+
+    if request.method == "POST":
+        # Pending write-behind rows may already be past the window
+        history_writer.flush()
+        archiver.run(max_batches=100)
+    return jsonify(archiver.status())
+
+@app.route("/admin/api/cache")
+def admin_api_cache():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+
+    return jsonify({
+        "model_version": model_version,
+        "prediction_cache": prediction_cache.stats(),
+        "override_cache": override_cache.stats(),
+        "state": state.status()
+    })
+
+@app.route("/admin/api/admission")
+def admin_api_admission():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+
+    return jsonify({
+        "endpoints": list(ADMITTED_ENDPOINTS),
+        "gate": admission_gate.status(),
+        "rate_limit": rate_limiter.status() if rate_limiter else None
+    })
+
+@app.route("/admin/api/history_writer")
+def admin_api_history_writer():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+
+    return jsonify(history_writer.stats())
+
+@app.route("/admin/api/model", methods=["GET"])
+def admin_api_model():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+
+    status = model_registry.status()
+    status["online_learning"] = online_trainer.status() if online_trainer else None
+    return jsonify(status)
+
+@app.route("/admin/api/model/reload", methods=["POST"])
+def admin_api_model_reload():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+
+    # Loads + validates in the background; the swap is atomic, requests keep flowing
+    started = model_registry.reload_async()
+    status = model_registry.status()
+    status["reload_started"] = started
+    return jsonify(status), 202
+
+# Scrape-time gauges for the caches, the history queue and the model
+metrics.gauge("spam_prediction_cache_hit_ratio", "Prediction cache hit rate.",
+              lambda: prediction_cache.stats()["hit_rate"])
+metrics.gauge("spam_override_cache_hit_ratio", "Override cache hit rate.",
+              lambda: override_cache.stats()["hit_rate"])
+metrics.gauge("spam_history_queue_depth", "History rows waiting in the write-behind queue.",
+              history_writer.depth)
+metrics.counter_func("spam_history_write_errors_total", "Failed write-behind flushes.",
+                     lambda: history_writer.errors)
+metrics.counter_func("spam_history_rows_dropped_total", "History rows dropped after repeated write failures.",
+                     lambda: history_writer.dropped)
+metrics.counter_func("spam_history_rows_rejected_total", "History rows written synchronously because the queue was full.",
+                     lambda: history_writer.rejected)
+metrics.counter_func("spam_state_publish_dropped_total",
+                     "Counter deltas and override labels the shared state backend never received.",
+                     lambda: state.dropped_counts + state.dropped_overrides)
+metrics.gauge("spam_profiler_samples", "Stack samples taken by the sampling profiler.",
+              lambda: profiler.samples)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Prometheus text format; one scrape target per replica (workers merged, see metrics)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/api/profile", methods=["GET", "POST"])
+def admin_api_profile():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+
+    if request.method == "POST":
+        data = request.json or {}
+        action = data.get("action")
+        if action == "start":
+            try:
+                interval = float(data.get("interval") or profiler.interval)
+            except (TypeError, ValueError):
+                return jsonify({"error": "Invalid interval"}), 400
+            if not 0.001 <= interval <= 1:
+                return jsonify({"error": "Interval must be between 0.001 and 1 seconds"}), 400
+            profiler.start(interval)
+        elif action == "stop":
+            profiler.stop()
+        else:
+            return jsonify({"error": "Action must be 'start' or 'stop'"}), 400
+        return jsonify(profiler.status())
+
+    # ?format=collapsed returns flamegraph input; default is a JSON summary
+    if request.args.get("format") == "collapsed":
+        return Response(profiler.collapsed(), mimetype="text/plain")
+    status = profiler.status()
+    status["top_functions"] = [{"frame": f, "samples": n} for f, n in profiler.top_functions()]
+    return jsonify(status)
 
 @app.route("/admin/train", methods=["POST"])
 def admin_train():
@@ -407,15 +1635,20 @@ def admin_train():
         # Better approach: DELETE the user row(s) for this message and INSERT the Admin Rule.
         # This keeps the table clean and the queue empty.
         
-        db.execute('DELETE FROM feedback WHERE message = ?', (message,))
-        db.execute(
-            'INSERT INTO feedback (message, user_label) VALUES (?, ?)',
-            (message, admin_label)
-        )
+        db.execute('DELETE FROM feedback WHERE message_hash = ?', (message_hash(message),))
+        add_feedback(db, message, admin_label)
+        # The verdict covers the message's whole near-duplicate campaign
+        if label in ("SPAM", "NOT SPAM"):
+            label_campaign(db, message, label)
+            # Verified label also feeds the online model (applied in the owner's next micro-batch)
+            if online_trainer:
+                db.execute('INSERT INTO online_examples (message, label) VALUES (?, ?)', (message, label))
         db.commit()
+        override_cache.clear()
     
     return redirect(url_for('admin'))
 
 if __name__ == "__main__":
+    # Development server; production runs `gunicorn -c gunicorn.conf.py app:app`
     init_db()
     app.run(host="0.0.0.0", port=5000)
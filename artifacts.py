@@ -0,0 +1,364 @@
+import hashlib
+import json
+import math
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+# Compact model format (one directory per version):
+#   meta.json              tokenizer settings, classes, version
+#   vocab.npy              sorted UTF-8 terms (fixed-width bytes), searched with np.searchsorted
+#   idf.npy                idf weight per term (vocab order)
+#   feature_log_prob.npy   NB log P(term | class), shape (n_terms, n_classes), vocab order
+#   class_log_prior.npy    NB log P(class)
+# Every .npy file is memory-mapped read-only, so pre-forked workers share the same pages.
+# Versions live in <compact_dir>/v-<version>/ and are never rewritten once published
+# (truncating a mapped file kills its readers with SIGBUS); <compact_dir>/CURRENT names
+# the published one and is swapped atomically.
+COMPACT_FORMAT = 1
+COMPACT_ARRAYS = ["vocab", "idf", "feature_log_prob", "class_log_prior"]
+COMPACT_POINTER = "CURRENT"
+COMPACT_KEEP_VERSIONS = 3
+
+
+def vectorizer_settings(vectorizer):
+    # What a scorer needs to reproduce TfidfVectorizer.transform without sklearn
+    if vectorizer.analyzer != "word" or vectorizer.tokenizer or vectorizer.preprocessor or vectorizer.strip_accents:
+        raise ValueError("Only the default word analyzer is supported")
+    return {
+        "lowercase": vectorizer.lowercase,
+        "token_pattern": vectorizer.token_pattern,
+        "stop_words": sorted(vectorizer.get_stop_words() or []),
+        "ngram_range": list(vectorizer.ngram_range),
+        "binary": vectorizer.binary,
+        "sublinear_tf": vectorizer.sublinear_tf,
+        "use_idf": vectorizer.use_idf,
+        "norm": vectorizer.norm,
+    }
+
+
+def make_analyzer(settings):
+    # Same steps as sklearn's word analyzer: lowercase, token regex, stop words, n-grams
+    findall = re.compile(settings["token_pattern"]).findall
+    stop_words = frozenset(settings["stop_words"])
+    lowercase = settings["lowercase"]
+    min_n, max_n = settings["ngram_range"]
+
+    def analyze(message):
+        if lowercase:
+            message = message.lower()
+        tokens = [t for t in findall(message) if t not in stop_words] if stop_words else findall(message)
+        if max_n == 1:
+            return tokens
+        grams = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), max_n + 1):
+            grams.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return grams
+
+    return analyze
+
+
+class FastScorer:
+    """Single-message TF-IDF + Naive Bayes scoring in plain Python.
+
+    The vocabulary is compiled into one dict, term -> (idf, idf * log P(term | class)
+    per class), so a message costs one lookup per token and a short loop over the
+    classes: no input validation, sparse matrix or separate predict/predict_proba
+    passes. Matches transform() + predict_proba() up to float rounding.
+    """
+
+    def __init__(self, settings, terms, idf, feature_log_prob, class_log_prior, classes):
+        # feature_log_prob: (n_terms, n_classes), rows in `terms` order
+        self.analyze = make_analyzer(settings)
+        self.classes = [str(c) for c in classes]
+        self.class_log_prior = [float(p) for p in class_log_prior]
+        self.binary = settings["binary"]
+        self.sublinear_tf = settings["sublinear_tf"]
+        self.norm = settings["norm"]
+
+        idf = np.asarray(idf, dtype=np.float64) if settings["use_idf"] else np.ones(len(terms))
+        weighted = np.asarray(feature_log_prob, dtype=np.float64) * idf[:, None]
+        self.table = {t: (w, tuple(row)) for t, w, row in zip(terms, idf.tolist(), weighted.tolist())}
+
+    @classmethod
+    def from_sklearn(cls, vectorizer, model):
+        terms = list(vectorizer.vocabulary_)
+        columns = [vectorizer.vocabulary_[t] for t in terms]
+        idf = vectorizer.idf_[columns] if vectorizer.use_idf else np.ones(len(terms))
+        return cls(vectorizer_settings(vectorizer), terms, idf, model.feature_log_prob_[:, columns].T,
+                   model.class_log_prior_, model.classes_)
+
+    def predict(self, message):
+        # (label, [probability per class]) in one pass
+        counts = {}
+        table = self.table
+        for term in self.analyze(message):
+            if term in table:
+                counts[term] = counts.get(term, 0) + 1
+
+        jll = list(self.class_log_prior)
+        if counts:
+            weights = []
+            for term, count in counts.items():
+                tf = 1.0 if self.binary else (math.log(count) + 1.0 if self.sublinear_tf else float(count))
+                weights.append((tf, table[term]))
+            if self.norm == "l2":
+                scale = 1.0 / math.sqrt(math.fsum((tf * idf) ** 2 for tf, (idf, _) in weights))
+            elif self.norm == "l1":
+                scale = 1.0 / math.fsum(tf * idf for tf, (idf, _) in weights)
+            else:
+                scale = 1.0
+            for c in range(len(jll)):
+                jll[c] += scale * math.fsum(tf * row[c] for tf, (_, row) in weights)
+
+        top = max(jll)
+        exp = [math.exp(j - top) for j in jll]
+        total = math.fsum(exp)
+        probs = [e / total for e in exp]
+        return self.classes[probs.index(max(probs))], probs
+
+
+def compact_path(compact_dir):
+    # Directory of the published export (None if there is none). Exports written
+    # before versioning have their files directly in compact_dir.
+    try:
+        with open(os.path.join(compact_dir, COMPACT_POINTER)) as f:
+            return os.path.join(compact_dir, f.read().strip())
+    except FileNotFoundError:
+        pass
+    if os.path.exists(os.path.join(compact_dir, "meta.json")):
+        return compact_dir
+    return None
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_durably(path, write):
+    with open(path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def export_compact(vectorizer, model, out_dir, keep=COMPACT_KEEP_VERSIONS):
+    # Writes a new version directory next to the live ones, then points CURRENT at it
+    settings = vectorizer_settings(vectorizer)
+    terms = sorted(vectorizer.vocabulary_, key=lambda t: t.encode("utf-8"))
+    columns = np.array([vectorizer.vocabulary_[t] for t in terms])
+    idf = vectorizer.idf_[columns] if vectorizer.use_idf else np.ones(len(terms))
+    arrays = {
+        "vocab": np.array([t.encode("utf-8") for t in terms]),
+        "idf": np.ascontiguousarray(idf, dtype=np.float64),
+        "feature_log_prob": np.ascontiguousarray(model.feature_log_prob_[:, columns].T, dtype=np.float64),
+        "class_log_prior": np.ascontiguousarray(model.class_log_prior_, dtype=np.float64),
+    }
+
+    digest = hashlib.sha256()
+    for name in COMPACT_ARRAYS:
+        digest.update(arrays[name].tobytes())
+
+    meta = {
+        "format": COMPACT_FORMAT,
+        "version": digest.hexdigest()[:12],
+        "classes": [str(c) for c in model.classes_],
+        **settings,
+    }
+
+    os.makedirs(out_dir, exist_ok=True)
+    version_name = f"v-{meta['version']}"
+    target = os.path.join(out_dir, version_name)
+    # Same content, same version: an existing directory is reused as it is
+    if not os.path.exists(target):
+        staging = tempfile.mkdtemp(dir=out_dir, prefix=".staging-")
+        try:
+            for name in COMPACT_ARRAYS:
+                _write_durably(os.path.join(staging, f"{name}.npy"), lambda f: np.save(f, arrays[name]))
+            _write_durably(os.path.join(staging, "meta.json"), lambda f: f.write(json.dumps(meta).encode("utf-8")))
+            _fsync_dir(staging)
+            # mkdtemp creates 0700; workers and tools running as other users read it too
+            os.chmod(staging, 0o755)
+            os.rename(staging, target)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.exists(os.path.join(target, "meta.json")):
+                raise
+            # Another exporter published the same version first
+        _fsync_dir(out_dir)
+
+    fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=".pointer-")
+    with os.fdopen(fd, "w") as f:
+        f.write(version_name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, os.path.join(out_dir, COMPACT_POINTER))
+    _fsync_dir(out_dir)
+
+    _remove_old_versions(out_dir, version_name, keep)
+    return meta
+
+
+def _remove_old_versions(out_dir, current, keep):
+    # Keeps the newest `keep` versions. Unlinking is safe even for a version a worker
+    # still has mapped: the pages stay valid until that worker lets go of them.
+    versions = [d for d in os.listdir(out_dir) if d.startswith("v-") and d != current]
+    versions.sort(key=lambda d: os.path.getmtime(os.path.join(out_dir, d)), reverse=True)
+    for d in versions[max(keep - 1, 0):]:
+        shutil.rmtree(os.path.join(out_dir, d), ignore_errors=True)
+
+
+class SklearnModel:
+    """Pickled TfidfVectorizer + MultinomialNB, as written by train_model.py."""
+
+    def __init__(self, model, vectorizer, version):
+        self.model = model
+        self.vectorizer = vectorizer
+        self.version = version
+        self.classes_ = model.classes_
+        self._fast = None
+
+    @classmethod
+    def from_pickles(cls, model_path, vectorizer_path):
+        with open(model_path, "rb") as f:
+            model_bytes = f.read()
+        with open(vectorizer_path, "rb") as f:
+            vectorizer_bytes = f.read()
+        # Version = content hash of both artifacts, so identical files keep their cache
+        version = hashlib.sha256(model_bytes + vectorizer_bytes).hexdigest()[:12]
+        return cls(pickle.loads(model_bytes), pickle.loads(vectorizer_bytes), version)
+
+    # transform() and score() are the two halves of predict_proba, timed separately by the app
+    def transform(self, messages):
+        return self.vectorizer.transform(messages)
+
+    def score(self, features):
+        return self.model.predict_proba(features)
+
+    def predict_proba(self, messages):
+        return self.score(self.transform(messages))
+
+    def score_one(self, message):
+        # Single-message fast path: (label, [probability per class])
+        if self._fast is None:
+            self._fast = FastScorer.from_sklearn(self.vectorizer, self.model)
+        return self._fast.predict(message)
+
+
+class CompactModel:
+    """Memory-mapped TF-IDF + Naive Bayes scorer over an export_compact() directory.
+
+    Only meta.json is read up front; the arrays are mapped on the first prediction.
+    `path` is an export_compact() directory; the version it publishes is resolved once,
+    so a model keeps the files it started with even after a newer export.
+    """
+
+    def __init__(self, path):
+        resolved = compact_path(path)
+        if resolved is None:
+            raise FileNotFoundError(f"No compact model in {path}")
+        self.path = resolved
+        with open(os.path.join(self.path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != COMPACT_FORMAT:
+            raise ValueError(f"Unsupported compact model format: {self.meta.get('format')}")
+
+        self.version = self.meta["version"]
+        self.classes_ = np.array(self.meta["classes"])
+        self.analyze = make_analyzer(self.meta)
+        self._arrays = None
+        self._fast = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._arrays is not None
+
+    def _load(self):
+        with self._lock:
+            return self._load_unlocked()
+
+    def _load_unlocked(self):
+        if self._arrays is None:
+            self._arrays = {
+                name: np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+                for name in COMPACT_ARRAYS
+            }
+        return self._arrays
+
+    def term_weights(self, message):
+        # (term indices, tf-idf weights) for one message
+        arrays = self._arrays or self._load()
+        vocab = arrays["vocab"]
+        width = vocab.dtype.itemsize
+
+        encoded = [t.encode("utf-8") for t in self.analyze(message)]
+        encoded = np.array([t for t in encoded if len(t) <= width], dtype=vocab.dtype)
+        if not len(encoded):
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        pos = np.searchsorted(vocab, encoded)
+        pos[pos == len(vocab)] = 0
+        idx, counts = np.unique(pos[vocab[pos] == encoded], return_counts=True)
+
+        tf = counts.astype(np.float64)
+        if self.meta["binary"]:
+            tf[:] = 1.0
+        elif self.meta["sublinear_tf"]:
+            tf = np.log(tf) + 1.0
+        if self.meta["use_idf"]:
+            tf *= arrays["idf"][idx]
+
+        norm = self.meta["norm"]
+        if norm == "l2" and len(tf):
+            tf /= np.sqrt(np.dot(tf, tf))
+        elif norm == "l1" and len(tf):
+            tf /= np.abs(tf).sum()
+        return idx, tf
+
+    def transform(self, messages):
+        return [self.term_weights(m) for m in messages]
+
+    def score(self, features):
+        # features: [(term indices, weights), ...] from transform()
+        arrays = self._arrays or self._load()
+        flp = arrays["feature_log_prob"]
+        jll = np.tile(np.asarray(arrays["class_log_prior"]), (len(features), 1))
+        for row, (idx, weights) in enumerate(features):
+            if len(idx):
+                jll[row] += weights @ flp[idx]
+
+        jll -= jll.max(axis=1, keepdims=True)
+        probs = np.exp(jll)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, messages):
+        return self.score(self.transform(messages))
+
+    def score_one(self, message):
+        # Single-message fast path; the term table is built from the mapped arrays on first use
+        if self._fast is None:
+            with self._lock:
+                if self._fast is None:
+                    arrays = self._arrays or self._load_unlocked()
+                    terms = [t.decode("utf-8") for t in arrays["vocab"].tolist()]
+                    self._fast = FastScorer(self.meta, terms, arrays["idf"], arrays["feature_log_prob"],
+                                            arrays["class_log_prior"], self.classes_)
+        return self._fast.predict(message)
+
+
+def load_predictor(model_path, vectorizer_path, compact_dir):
+    # Prefer the compact export (no unpickling at startup); fall back to the pickles
+    if compact_dir and compact_path(compact_dir):
+        return CompactModel(compact_dir)
+    return SklearnModel.from_pickles(model_path, vectorizer_path)
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from artifacts import FastScorer
+from db_pool import close_pools
+
+# Rows per executemany batch while seeding
+SEED_BATCH = 50000
+SOURCES = ["SMS", "Email", "WhatsApp", "Other"]
+
+
+def seed_database(app_module, database, history_rows, feedback_rows, messages, labels, days=30):
+    # Fill a fresh database with history/feedback generated from spam.csv. Rows go through
+    # write_history(), so the stats counters match what the app would have produced.
+    app = app_module.app
+    app.config['DATABASE'] = database
+    app_module.init_db()
+
+    now = datetime.now()
+    step = timedelta(days=days) / max(history_rows, 1)
+    smart_cache = {}
+
+    with app.app_context():
+        db = app_module.get_db()
+        entries = []
+        for i in range(history_rows):
+            k = i % len(messages)
+            message = messages[k]
+            result = "🚫 SPAM" if labels[k] == "spam" else "✅ NOT SPAM"
+            timestamp = (now - step * (history_rows - i)).strftime('%Y-%m-%d %H:%M:%S')
+            smart = smart_cache.get(k)
+            if smart is None:
+                smart = smart_cache[k] = app_module.get_smart_categories(message)
+            row = (message, SOURCES[i % len(SOURCES)], result, f"{(i * 37) % 10000 / 100:.2f}%", timestamp)
+            entries.append((row, app_module.history_stat_keys(message, result, timestamp, smart=smart)))
+            if len(entries) >= SEED_BATCH:
+                app_module.write_history(db, entries)
+                db.commit()
+                entries = []
+        if entries:
+            app_module.write_history(db, entries)
+            db.commit()
+
+        # Suffixed so feedback overrides do not short-circuit the model in the predict benchmarks
+        feedback = []
+        for i in range(feedback_rows):
+            message = f"{messages[i % len(messages)]} [report {i}]"
+            label = "SPAM" if labels[i % len(messages)] == "spam" else "NOT SPAM"
+            feedback.append((message, label, app_module.message_hash(message)))
+            if len(feedback) >= SEED_BATCH or i == feedback_rows - 1:
+                db.executemany('INSERT INTO feedback (message, user_label, message_hash) VALUES (?, ?, ?)', feedback)
+                feedback = []
+        app_module.rebuild_overrides(db)
+        db.commit()
+    app_module.override_cache.clear()
+
+
+def summarize(samples, elapsed=None):
+    # Latency percentiles in ms; throughput in operations per second
+    ms = np.array(samples) * 1000
+    total = elapsed if elapsed is not None else float(np.sum(samples))
+    return {
+        "n": len(samples),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_per_s": round(len(samples) / total, 1) if total else None,
+    }
+
+
+def time_calls(fn, args_list, warmup=3):
+    for args in args_list[:warmup]:
+        fn(*args)
+    samples = []
+    start = time.perf_counter()
+    for args in args_list:
+        t = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - t)
+    return summarize(samples, time.perf_counter() - start)
+
+
+def bench_http(app_module, messages, requests, export_requests):
+    app = app_module.app
+    client = app.test_client()
+    # Separate admin session: index() logs the admin out
+    admin_client = app.test_client()
+    with admin_client.session_transaction() as sess:
+        sess['logged_in'] = True
+
+    def check(response):
+        assert response.status_code == 200, response.status_code
+        return response
+
+    def predict(message):
+        check(client.post("/api/predict", json={"message": message}))
+
+    def export():
+        # Drain the streamed body so the whole export is measured
+        response = check(admin_client.get("/export_csv"))
+        for _ in response.response:
+            pass
+        response.close()
+
+    # Distinct messages so the prediction cache does not hide the model cost
+    app_module.prediction_cache.clear()
+    results = {"api_predict": time_calls(predict, [(messages[i % len(messages)],) for i in range(requests)])}
+    results["index"] = time_calls(lambda: check(client.get("/")), [()] * requests)
+    results["admin"] = time_calls(lambda: check(admin_client.get("/admin")), [()] * requests)
+    results["export_csv"] = time_calls(export, [()] * export_requests, warmup=1)
+    return results
+
+
+def bench_model(messages, requests, batch_size=1000, model_dir="model"):
+    # Raw sklearn cost, outside Flask: vectorizer.transform and predict_proba separately,
+    # next to the compiled single-message path the app uses for one message
+    with open(os.path.join(model_dir, "vectorizer.pkl"), "rb") as f:
+        vectorizer = pickle.load(f)
+    with open(os.path.join(model_dir, "spam_model.pkl"), "rb") as f:
+        model = pickle.load(f)
+    fast = FastScorer.from_sklearn(vectorizer, model)
+
+    singles = [([messages[i % len(messages)]],) for i in range(requests)]
+    matrices = [(vectorizer.transform(m),) for (m,) in singles]
+    batch = messages[:batch_size]
+
+    results = {
+        "transform_single": time_calls(vectorizer.transform, singles),
+        "predict_proba_single": time_calls(model.predict_proba, matrices),
+        "score_one_single": time_calls(fast.predict, [(m[0],) for (m,) in singles]),
+    }
+    # Single-message calls are tens of microseconds on the fast path
+    for r in results.values():
+        r["p50_us"] = round(r["p50_ms"] * 1000, 1)
+    batch_transform = time_calls(vectorizer.transform, [(batch,)] * 20, warmup=1)
+    batch_predict = time_calls(model.predict_proba, [(vectorizer.transform(batch),)] * 20, warmup=1)
+    for name, r in (("transform_batch", batch_transform), ("predict_proba_batch", batch_predict)):
+        r["batch_size"] = len(batch)
+        r["messages_per_s"] = round(r["throughput_per_s"] * len(batch), 1)
+        results[name] = r
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark prediction, dashboard and export paths.")
+    parser.add_argument("--history", type=int, default=10000, help="history rows to seed")
+    parser.add_argument("--feedback", type=int, default=1000, help="feedback rows to seed")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint / model call")
+    parser.add_argument("--export-requests", type=int, default=3, help="full /export_csv downloads")
+    parser.add_argument("--dataset", default="dataset/spam.csv")
+    parser.add_argument("--db", help="seed into this file and keep it (default: temporary database)")
+    parser.add_argument("--output", "-o", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    import app as app_module
+
+    labelled = app_module.load_labelled(args.dataset)
+    messages = [m for m, _ in labelled]
+    labels = [label for _, label in labelled]
+    workdir = None if args.db else tempfile.mkdtemp()
+    database = args.db or os.path.join(workdir, "bench.db")
+
+    try:
+        start = time.perf_counter()
+        seed_database(app_module, database, args.history, args.feedback, messages, labels)
+        seed_s = time.perf_counter() - start
+
+        http = bench_http(app_module, messages, args.requests, args.export_requests)
+        model = bench_model(messages, args.requests)
+        app_module.history_writer.flush()
+    finally:
+        close_pools()
+        if workdir:
+            shutil.rmtree(workdir)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "model_version": app_module.model_registry.version,
+            "history_rows": args.history,
+            "feedback_rows": args.feedback,
+            "requests": args.requests,
+            "seed_s": round(seed_s, 2),
+        },
+        "http": http,
+        "model": model,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
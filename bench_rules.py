@@ -0,0 +1,107 @@
+"""Benchmark the compiled rule engine against the original per-rule scans.
+
+Usage: python bench_rules.py [path/to/spam.csv] [repeats]
+"""
+import csv
+import re
+import sys
+import time
+
+from rules import RuleEngine, SPAM_KEYWORDS
+
+
+# Original implementations from app.py, kept as the parity/speed baseline
+def legacy_categories(message):
+    tags = []
+    msg_lower = message.lower()
+
+    if any(w in msg_lower for w in ["bank", "transfer", "account", "verify", "credit", "card", "billing"]):
+        tags.append("💳 Financial Risk")
+    elif any(w in msg_lower for w in ["win", "winner", "cash", "prize", "money", "lottery", "100%", "deposit"]):
+        tags.append("💰 Potential Scam")
+
+    if any(w in msg_lower for w in ["urgent", "immediate", "act now", "limited time", "expire", "warning"]):
+        tags.append("🚨 High Urgency")
+
+    if "http" in msg_lower or ".com" in msg_lower or "click" in msg_lower:
+        tags.append("🔗 Link Analysis")
+
+    return tags
+
+
+def legacy_keywords(message):
+    return [k for k in SPAM_KEYWORDS if k in message.lower()]
+
+
+def legacy_urls(text):
+    urls = re.findall(r'(https?://\S+|www\.\S+)', text)
+    results = []
+
+    suspicious_tlds = ['.xyz', '.top', '.club', '.info', '.gq', '.tk', '.ml', '.ga', '.cf']
+    suspicious_keywords = ['login', 'verify', 'account', 'update', 'secure', 'bank', 'prize', 'win']
+
+    for url in urls:
+        risk_score = 0
+        reasons = []
+        if any(tld in url for tld in suspicious_tlds):
+            risk_score += 50
+            reasons.append("Suspicious TLD")
+        if any(kw in url.lower() for kw in suspicious_keywords):
+            risk_score += 30
+            reasons.append("Suspicious Keyword")
+        if re.search(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', url):
+            risk_score += 80
+            reasons.append("IP Address URL")
+
+        risk_level = "Low"
+        if risk_score > 70:
+            risk_level = "CRITICAL"
+        elif risk_score > 30:
+            risk_level = "High"
+        elif risk_score > 0:
+            risk_level = "Medium"
+
+        results.append({
+            "url": url,
+            "risk_score": risk_score,
+            "risk_level": risk_level,
+            "reasons": ", ".join(reasons) if reasons else "None"
+        })
+    return results
+
+
+def legacy_analyze(text):
+    return {"tags": legacy_categories(text), "keywords": legacy_keywords(text), "urls": legacy_urls(text)}
+
+
+def load_messages(path):
+    with open(path, encoding="latin-1", newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [row[1] for row in reader if len(row) > 1 and row[1]]
+
+
+def time_it(fn, messages, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for m in messages:
+            fn(m)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "dataset/spam.csv"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    messages = load_messages(path)
+    engine = RuleEngine()
+
+    mismatches = sum(1 for m in messages if engine.analyze(m) != legacy_analyze(m))
+    legacy = time_it(legacy_analyze, messages, repeats)
+    compiled = time_it(engine.analyze, messages, repeats)
+
+    print(f"messages:   {len(messages)}  (mismatches: {mismatches})")
+    print(f"legacy:     {legacy * 1000:.1f} ms  ({legacy / len(messages) * 1e6:.2f} us/msg)")
+    print(f"compiled:   {compiled * 1000:.1f} ms  ({compiled / len(messages) * 1e6:.2f} us/msg)")
+    print(f"speedup:    {legacy / compiled:.2f}x")
@@ -0,0 +1,83 @@
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+# Variable parts of a template (links, addresses, numbers) are masked before shingling,
+# so "Call 0800123456 now" and "Call 0800999111 now" produce the same shingles
+MASKS = [
+    (re.compile(r'\b[\w.+-]+@[\w-]+\.[\w.]+\b'), " _email_ "),
+    (re.compile(r'(?:https?://|www\.)\S+|\b[\w-]+(?:\.[\w-]+)*\.(?:com|net|org|xyz|top|info|biz|co|uk|in)\b\S*'), " _url_ "),
+    (re.compile(r'[£$€₹]?\d(?:[\d,.:/-]| (?=\d))*'), " _num_ "),   # "0800 123 456" is one number
+]
+WORD = re.compile(r"_(?:email|url|num)_|[a-z]+")
+
+
+class MinHashLSH:
+    """MinHash signatures and LSH band keys for near-duplicate messages.
+
+    Two messages whose shingle sets have Jaccard similarity s share at least one
+    band key with probability 1 - (1 - s**rows)**bands, so candidates are found
+    with a few indexed key lookups instead of comparing against every message.
+    """
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=2, min_tokens=4, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.min_tokens = min_tokens
+
+        # Multiply-shift hashing: odd 64-bit multipliers, products wrap mod 2**64
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+
+    def tokens(self, message):
+        text = message.lower()
+        for pattern, replacement in MASKS:
+            text = pattern.sub(replacement, text)
+        return WORD.findall(text)
+
+    def shingles(self, message):
+        words = self.tokens(message)
+        if len(words) < self.min_tokens:
+            # Too short to tell a template from ordinary chatter ("ok see you")
+            return set()
+        k = self.shingle_size
+        return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+    def signature(self, message):
+        # uint32 MinHash signature, or None when the message is too short to cluster
+        shingles = self.shingles(message)
+        if not shingles:
+            return None
+        x = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            hashed = self._a[:, None] * x[None, :] + self._b[:, None]
+        return (hashed >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+    def band_keys(self, signature):
+        # One signed 64-bit key per band (fits an SQLite INTEGER column)
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            digest = hashlib.blake2b(bytes([band]) + chunk, digest_size=8).digest()
+            keys.append(int.from_bytes(digest, "big", signed=True))
+        return keys
+
+    @staticmethod
+    def similarity(a, b):
+        # Estimated Jaccard similarity of the underlying shingle sets
+        return float(np.mean(a == b))
+
+    @staticmethod
+    def to_bytes(signature):
+        return signature.tobytes()
+
+    @staticmethod
+    def from_bytes(data):
+        return np.frombuffer(data, dtype=np.uint32)
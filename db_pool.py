@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Applied to every new connection. WAL lets dashboard reads run while a prediction
+# write is in progress; NORMAL sync is durable across app crashes in WAL mode.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",     # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",   # map up to 256 MB of the file
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+]
+
+# Prepared statements kept per connection (sqlite3's statement cache)
+CACHED_STATEMENTS = 256
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that runs after_commit() callbacks once the transaction commits.
+
+    Side effects outside the database (publishing to a shared backend) are queued here,
+    so they happen only for changes that were actually committed; a rollback, or
+    returning the connection to the pool, drops them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._after_commit = []
+
+    def after_commit(self, fn, *args):
+        self._after_commit.append((fn, args))
+
+    def commit(self):
+        super().commit()
+        callbacks, self._after_commit = self._after_commit, []
+        for fn, args in callbacks:
+            fn(*args)
+
+    def rollback(self):
+        self._after_commit = []
+        super().rollback()
+
+
+class ConnectionPool:
+    """Per-process pool of tuned SQLite connections for one database file.
+
+    Connections are created on demand; up to `size` idle ones are kept for reuse,
+    so requests skip connect + pragma setup + schema parsing.
+    """
+
+    def __init__(self, database, size=8):
+        self.database = database
+        self.size = size
+        self.created = 0
+        self.reused = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, cached_statements=CACHED_STATEMENTS,
+                               factory=Connection)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.row_factory = sqlite3.Row
+        self.created += 1
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: never share the parent's connections
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        conn._after_commit = []
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        return {"database": self.database, "idle": len(self._idle), "size": self.size,
+                "created": self.created, "reused": self.reused}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database, size=8):
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = _pools[database] = ConnectionPool(database, size)
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,48 @@
+# Production server: gunicorn -c gunicorn.conf.py app:app
+#
+# Pre-fork: the master imports app.py once (model, vectorizer, rule tables, schema),
+# then forks the workers, which share those pages copy-on-write. Each worker runs
+# `threads` request threads, so blocking SQLite I/O does not stall a whole process
+# and CPU-bound scoring scales with the number of workers (cores).
+import gc
+import multiprocessing
+import os
+import tempfile
+
+# Tells app.py to leave background threads to post_fork
+os.environ.setdefault("PREFORK", "1")
+# Workers write their metrics here so /metrics in any of them reports the whole server
+os.environ.setdefault("METRICS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="spam-metrics-"))
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+# Admission in-flight + queue (app.py, one budget for all prediction endpoints) plus
+# headroom: bursts reach the gate and are shed with 429s instead of piling up unseen in
+# gunicorn's backlog, and the headroom threads keep page loads, /metrics and the admin
+# responsive while the gate is full
+admitted = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "4")) + int(os.environ.get("ADMISSION_MAX_QUEUE", "16"))
+threads = int(os.environ.get("WORKER_THREADS", admitted + int(os.environ.get("WORKER_THREAD_HEADROOM", "12"))))
+preload_app = True
+timeout = int(os.environ.get("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then (jittered so they do not all restart together)
+max_requests = int(os.environ.get("MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+
+
+def when_ready(server):
+    import app
+    # Build the single-message term table once here rather than in every worker
+    if hasattr(app.predictor, "score_one"):
+        app.predictor.score_one("")
+    # Everything loaded so far lives until exit: move it out of the GC's generations, so
+    # collections in the workers do not touch (and copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background_tasks()
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class HistoryWriter:
+    """Write-behind queue for history inserts.
+
+    Request threads only append to an in-memory queue; a background thread hands the
+    queued rows to `apply(database, rows)` in grouped transactions once flush_size rows
+    are waiting or flush_interval seconds have passed. The thread starts on first use
+    in each process, so it also works under pre-fork servers.
+
+    The queue is bounded: with max_queue rows waiting (e.g. SQLite locked or the disk
+    full), submit() refuses and the caller writes synchronously, which slows producers
+    down instead of growing memory. A row that failed max_attempts flushes is dropped
+    and counted.
+    """
+
+    def __init__(self, apply, flush_size=200, flush_interval=0.5, max_queue=10000, max_attempts=5):
+        self.apply = apply
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+
+        self.enqueued = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.last_error = None
+
+        self._queue = deque()       # (database, row, failed attempts)
+        self._inflight = []         # batch being written by flush()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stop = False
+        self._thread = None
+        self._pid = None
+
+    def submit(self, database, row):
+        # False when the queue is full: the caller has to write the row itself
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                return False
+            self._ensure_thread()
+            self._queue.append((database, row, 0))
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            if len(self._queue) >= self.flush_size:
+                self._cond.notify()
+            return True
+
+    def pending(self, database):
+        # Rows for `database` not committed yet, oldest first (queued or being written)
+        with self._cond:
+            return [row for d, row, _ in self._inflight + list(self._queue) if d == database]
+
+    def _ensure_thread(self):
+        # (Re)start after fork: threads do not survive into child processes
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._stop = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stop and len(self._queue) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stop
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self):
+        # Write everything queued so far; safe to call from any thread. Returns rows written.
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._queue)
+                self._queue.clear()
+                self._inflight = batch
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            by_database = {}
+            for entry in batch:
+                by_database.setdefault(entry[0], []).append(entry)
+            failed = []
+            for database, entries in by_database.items():
+                try:
+                    self.apply(database, [row for _, row, _ in entries])
+                except Exception as e:
+                    failed.extend(entries)
+                    self.last_error = f"{type(e).__name__}: {e}"
+
+            # Failed rows go back to the front (in order), e.g. after "database is locked",
+            # until they have used up their attempts
+            retry = [(d, row, n + 1) for d, row, n in failed if n + 1 < self.max_attempts]
+            with self._cond:
+                self._queue.extendleft(reversed(retry))
+                self._inflight = []
+            written = len(batch) - len(failed)
+            self.written += written
+            if failed:
+                self.errors += 1
+                self.dropped += len(failed) - len(retry)
+                return written
+
+            self.flushes += 1
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            return written
+
+    def stop(self):
+        # Clean shutdown: stop the thread and flush whatever is left
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread and thread.is_alive():
+            thread.join()
+        self._thread = None
+        self.flush()
+
+    def depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "last_error": self.last_error,
+        }
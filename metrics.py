@@ -0,0 +1,451 @@
+import fcntl
+import glob
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter as _Tally
+
+# Latency buckets in seconds (0.25 ms .. 5 s)
+DEFAULT_BUCKETS = (0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def reset(self):
+        # Called in a forked child: a fresh lock, as another thread may have held the old one
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self, items=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.snapshot() if items is None else items):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class CounterFunc(Counter):
+    """Counter read from a callback at scrape time (a running total kept elsewhere)."""
+
+    def __init__(self, name, help, fn):
+        super().__init__(name, help)
+        self.fn = fn
+        self._base = 0
+
+    def reset(self):
+        # The total lives with its owner; drop what was counted before fork
+        self._base = self._read()
+
+    def _read(self):
+        try:
+            return self.fn() or 0
+        except Exception:
+            return 0
+
+    def snapshot(self):
+        return [((), self._read() - self._base)]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination (Prometheus semantics)."""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}   # labels -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        # Bucket counts are stored non-cumulative and summed on render
+        i = 0
+        while value > self.buckets[i]:
+            i += 1
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def snapshot(self):
+        with self._lock:
+            return [(labels, list(series)) for labels, series in self._series.items()]
+
+    def render(self, items=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.snapshot() if items is None else items):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = _labels(self.labelnames, labels, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time."""
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def reset(self):
+        pass
+
+    def snapshot(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        return [] if value is None else [((), value)]
+
+    def render(self, items=None):
+        # Merged across processes, each live process's value carries a pid label
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.snapshot() if items is None else items):
+            lines.append(f"{self.name}{_labels(('pid',), labels)} {_number(value)}")
+        return lines
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """Metrics rendered in the Prometheus text exposition format.
+
+    By default the values are this process's own. With multiproc_dir (shared by every
+    worker of one server), each process writes a snapshot file there and /metrics in
+    any worker sums the counters and histograms of all of them, dead workers included,
+    so the totals of a pre-fork server do not depend on which worker was scraped.
+    Gauges are reported per live process with a pid label.
+
+    A scrape folds the files of exited workers into one aggregate file and deletes
+    them, so the directory and the scrape cost stay bounded as workers are recycled.
+    """
+
+    AGGREGATE_FILE = "exited-workers.json"
+
+    def __init__(self, multiproc_dir=None):
+        self._metrics = []
+        self.multiproc_dir = multiproc_dir
+        self._pid = os.getpid()
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+        if multiproc_dir:
+            # A forked child starts from zero: what it inherited is already in its parent's file
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._claim())
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def counter_func(self, name, help, fn):
+        return self._add(CounterFunc(name, help, fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, fn):
+        return self._add(Gauge(name, help, fn))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def _claim(self):
+        # One snapshot file per process
+        if self._pid != os.getpid():
+            for metric in self._metrics:
+                metric.reset()
+            self._pid = os.getpid()
+            self._file = None
+        if self._file is None:
+            self._file = os.path.join(self.multiproc_dir, f"metrics-{self._pid}-{uuid.uuid4().hex[:8]}.json")
+
+    def write_snapshot(self):
+        if not self.multiproc_dir:
+            return
+        self._claim()
+        data = {"pid": self._pid,
+                "metrics": {m.name: [[list(labels), value] for labels, value in m.snapshot()] for m in self._metrics}}
+        fd, tmp = tempfile.mkstemp(dir=self.multiproc_dir, prefix=".metrics-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self._file)
+
+    def start_writer(self, interval=1.0):
+        # Per-process thread keeping this process's snapshot at most `interval` s old
+        if not self.multiproc_dir:
+            return False
+        self._claim()
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+
+    def _merge(self, merged, data, alive):
+        # Adds one snapshot into merged; gauges only count for live processes
+        for metric in self._metrics:
+            series = merged[metric.name]
+            for labels, value in data["metrics"].get(metric.name, ()):
+                labels = tuple(labels)
+                if isinstance(metric, Gauge):
+                    if alive:
+                        series[(data["pid"],)] = value
+                elif isinstance(metric, Histogram):
+                    current = series.get(labels)
+                    series[labels] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    series[labels] = series.get(labels, 0) + value
+
+    def _merged(self):
+        self.write_snapshot()
+        merged = {m.name: {} for m in self._metrics}
+        # One scrape at a time across workers, so an exited worker's file is folded once
+        fd = os.open(os.path.join(self.multiproc_dir, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            aggregate, live = self._compact()
+        finally:
+            os.close(fd)
+        self._merge(merged, aggregate, alive=False)
+        for data in live:
+            self._merge(merged, data, alive=True)
+        return merged
+
+    def _compact(self):
+        # Folds exited workers' files into the aggregate, then deletes them. The aggregate
+        # lists the files it last folded, so one left behind by a crash between the two
+        # steps is deleted next time instead of counted twice. Returns (aggregate, live snapshots).
+        path = os.path.join(self.multiproc_dir, self.AGGREGATE_FILE)
+        try:
+            with open(path) as f:
+                aggregate = json.load(f)
+        except (OSError, ValueError):
+            aggregate = {"pid": None, "files": [], "metrics": {}}
+
+        names = {os.path.basename(p) for p in glob.glob(os.path.join(self.multiproc_dir, "metrics-*.json"))}
+        folded = [n for n in aggregate["files"] if n in names]
+        live, exited = [], []
+        for name in sorted(names - set(aggregate["files"])):
+            try:
+                with open(os.path.join(self.multiproc_dir, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data["pid"] == self._pid or _pid_alive(data["pid"]):
+                live.append(data)
+            else:
+                exited.append((name, data))
+
+        if exited:
+            totals = {m.name: {} for m in self._metrics}
+            self._merge(totals, aggregate, alive=False)
+            for _, data in exited:
+                self._merge(totals, data, alive=False)
+            aggregate = {
+                "pid": None,
+                "files": folded + [name for name, _ in exited],
+                "metrics": {name: [[list(labels), value] for labels, value in series.items()]
+                            for name, series in totals.items() if series},
+            }
+            fd, tmp = tempfile.mkstemp(dir=self.multiproc_dir, prefix=".metrics-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(aggregate, f)
+            os.replace(tmp, path)
+        for name in folded + [name for name, _ in exited]:
+            try:
+                os.unlink(os.path.join(self.multiproc_dir, name))
+            except FileNotFoundError:
+                pass
+        return aggregate, live
+
+    def render(self):
+        merged = self._merged() if self.multiproc_dir else {}
+        lines = []
+        for metric in self._metrics:
+            items = merged[metric.name].items() if self.multiproc_dir else None
+            lines.extend(metric.render(items))
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval and counts collapsed stacks.
+
+    Output is in the "collapsed" format (frame;frame;frame count) that flamegraph
+    tools read. Meant to be switched on briefly on a live replica.
+    """
+
+    def __init__(self, interval=0.01, max_depth=40, max_stacks=10000):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self.dropped = 0
+        self.started_at = None
+        self._stacks = _Tally()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def start(self, interval=None):
+        if interval:
+            self.interval = interval
+        if self.running:
+            return False
+        self.reset()
+        self._stop.clear()
+        self._pid = os.getpid()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+            self.dropped = 0
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(skip=me)
+
+    def sample(self, skip=None):
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            with self._lock:
+                if key in self._stacks or len(self._stacks) < self.max_stacks:
+                    self._stacks[key] += 1
+                else:
+                    self.dropped += 1
+                self.samples += 1
+
+    def collapsed(self, limit=None):
+        with self._lock:
+            top = self._stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in top)
+
+    def top_functions(self, limit=20):
+        # Leaf frames by sample count: where threads were actually spending time
+        leaves = _Tally()
+        with self._lock:
+            for stack, count in self._stacks.items():
+                leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+    def status(self):
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+            "dropped": self.dropped,
+            "started_at": self.started_at,
+        }
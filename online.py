@@ -0,0 +1,251 @@
+import copy
+import fcntl
+import hashlib
+import os
+import pickle
+import queue
+import tempfile
+import threading
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+
+# Hashing keeps the feature space fixed, so new words never force a refit.
+# alternate_sign=False keeps features non-negative for MultinomialNB.
+HASHING_PARAMS = dict(n_features=2 ** 18, alternate_sign=False, stop_words='english', norm='l2')
+CLASSES = np.array(["ham", "spam"])
+
+# Admin labels -> model classes
+LABELS = {"SPAM": "spam", "NOT SPAM": "ham"}
+
+
+class HashingModel:
+    """HashingVectorizer + MultinomialNB predictor that supports partial_fit updates."""
+
+    def __init__(self, nb, updates=0, last_id=0):
+        self.vectorizer = HashingVectorizer(**HASHING_PARAMS)
+        self.nb = nb
+        self.updates = updates
+        self.last_id = last_id   # newest shared example applied (see OnlineTrainer.pull)
+        self.classes_ = nb.classes_
+        self.version = "online-" + hashlib.sha256(nb.feature_count_.tobytes()).hexdigest()[:12]
+
+    def transform(self, messages):
+        return self.vectorizer.transform(messages)
+
+    def score(self, features):
+        return self.nb.predict_proba(features)
+
+    def predict_proba(self, messages):
+        return self.score(self.transform(messages))
+
+    def updated(self, messages, labels, last_id=None):
+        # New model with the batch applied; the current one is left untouched
+        nb = copy.deepcopy(self.nb)
+        nb.partial_fit(self.vectorizer.transform(messages), labels, classes=CLASSES)
+        return HashingModel(nb, self.updates + len(messages), self.last_id if last_id is None else last_id)
+
+    @classmethod
+    def train(cls, messages, labels):
+        nb = MultinomialNB()
+        nb.partial_fit(HashingVectorizer(**HASHING_PARAMS).transform(messages), labels, classes=CLASSES)
+        return cls(nb)
+
+    def save(self, path):
+        # Write-then-rename so readers never see a half-written model
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"nb": self.nb, "updates": self.updates, "last_id": self.last_id}, f)
+        # mkstemp creates 0600; other workers and tools read this file too
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["nb"], data["updates"], data.get("last_id", 0))
+
+
+class OnlineTrainer:
+    """Turns verified feedback into partial_fit micro-batches and publishes each new model.
+
+    Labels are queued by request threads; a background thread applies them in batches
+    of up to batch_size (or whatever arrived within flush_interval seconds), validates
+    the result through the registry and swaps it in atomically.
+
+    With a shared `source(after_id, limit)` of (id, message, label) rows, as under the
+    pre-fork server, there is a single owner: the process holding an exclusive lock on
+    <path>.lock pulls new rows, applies them and writes the artifact. Every other
+    process only reloads the artifact when it changes, so each label is applied once
+    and one file has one writer. If the owner exits, the next process to poll takes over.
+    """
+
+    def __init__(self, model, registry, path=None, batch_size=32, flush_interval=2.0, source=None):
+        self.model = model
+        self.registry = registry
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.source = source
+        self.published = 0
+        self.rejected = 0
+        self.reloaded = 0
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._owner_fd = None
+        self._owner_pid = None
+        self._artifact = self._artifact_signature()
+
+    def submit(self, message, label):
+        label = LABELS.get(label, label)
+        if label not in CLASSES:
+            raise ValueError(f"Unknown label: {label}")
+        self._queue.put((message, label))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, batch=None):
+        # Apply one micro-batch of queued examples; returns how many were applied
+        batch = batch or []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._apply(batch)
+        return len(batch)
+
+    def pull(self):
+        # Owner only: apply the next batch of shared examples; returns how many were read
+        rows = self.source(self.model.last_id, self.batch_size)
+        if rows:
+            self._apply([(m, LABELS.get(label, label)) for _, m, label in rows], last_id=rows[-1][0])
+        return len(rows)
+
+    def _apply(self, batch, last_id=None):
+        with self._lock:
+            candidate = self.model.updated([m for m, _ in batch], [y for _, y in batch], last_id)
+            try:
+                self.registry.publish(candidate)
+            except Exception as e:
+                # Batch is dropped: a poisoned or bad batch must not block later ones
+                self.rejected += len(batch)
+                self.last_error = f"{type(e).__name__}: {e}"
+                if last_id is not None:
+                    self.model = HashingModel(self.model.nb, self.model.updates, last_id)
+                return
+            self.model = candidate
+            self.published += 1
+            self.last_error = None
+            if self.path:
+                candidate.save(self.path)
+                self._artifact = self._artifact_signature()
+
+    def is_owner(self):
+        # Takes ownership if nobody holds it. flock is tied to this open file, so a
+        # forked child never inherits it by accident: ownership is (re)checked per pid.
+        if self.path is None:
+            return True
+        if self._owner_fd is not None and self._owner_pid == os.getpid():
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._owner_fd, self._owner_pid = fd, os.getpid()
+        # A new owner starts from the newest published artifact, not its own copy
+        self.sync(force=True)
+        return True
+
+    def _artifact_signature(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except (OSError, TypeError):
+            return None
+
+    def sync(self, force=False):
+        # Load the owner's latest artifact if it changed; returns True if a new model was published
+        signature = self._artifact_signature()
+        if signature is None or (signature == self._artifact and not force):
+            return False
+        self._artifact = signature
+        try:
+            loaded = HashingModel.load(self.path)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            return False
+        with self._lock:
+            if loaded.version == self.model.version and loaded.last_id == self.model.last_id:
+                return False
+            # Validated by the owner before it was written
+            self.registry.publish(loaded, validate=False)
+            self.model = loaded
+            self.reloaded += 1
+        return True
+
+    def start(self):
+        if self._thread:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                if self.source is not None:
+                    try:
+                        if self.is_owner():
+                            if self.pull():
+                                continue
+                        else:
+                            self.sync()
+                    except Exception as e:
+                        self.last_error = f"{type(e).__name__}: {e}"
+                    self._stop.wait(self.flush_interval)
+                    continue
+                try:
+                    first = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                # Give the batch a moment to fill up before applying it
+                if self._queue.qsize() + 1 < self.batch_size:
+                    self._stop.wait(self.flush_interval)
+                self.flush([first])
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        while self.flush():
+            pass
+        if self._owner_fd is not None and self._owner_pid == os.getpid():
+            os.close(self._owner_fd)
+            self._owner_fd = None
+
+    def status(self):
+        return {
+            "model_version": self.model.version,
+            "updates": self.model.updates,
+            "pending": self.pending(),
+            "owner": self._owner_fd is not None and self._owner_pid == os.getpid(),
+            "last_example_id": self.model.last_id,
+            "published": self.published,
+            "reloaded": self.reloaded,
+            "rejected_examples": self.rejected,
+            "last_error": self.last_error,
+        }
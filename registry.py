@@ -0,0 +1,164 @@
+import os
+import threading
+from datetime import datetime, timezone
+
+from artifacts import COMPACT_POINTER, load_predictor
+
+
+class ModelRegistry:
+    """Holds the active predictor and swaps in new artifacts without a restart.
+
+    New artifacts are loaded and validated off the request path; only the final
+    reference swap happens under the lock, so in-flight requests keep scoring with
+    the predictor they already picked up.
+    """
+
+    def __init__(self, model_path, vectorizer_path, compact_dir, holdout=None, min_accuracy=0.9, on_swap=None):
+        self.model_path = model_path
+        self.vectorizer_path = vectorizer_path
+        self.compact_dir = compact_dir
+        self.holdout = holdout or []
+        self.min_accuracy = min_accuracy
+        self.on_swap = on_swap
+
+        self.active = None
+        self.loaded_at = None
+        self.last_error = None
+        self.last_accuracy = None
+        self.reloading = False
+        # Set while another component (online learning) publishes the active model;
+        # reloading the batch artifacts then would swap its model out from under it
+        self.pinned_by = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # Held by the admin-triggered reload thread for its whole run
+        self._async_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self._signature = None
+
+    @property
+    def version(self):
+        return self.active.version if self.active else None
+
+    def validate(self, candidate):
+        # Holdout accuracy gate; an empty holdout only checks the classes
+        if "spam" not in list(candidate.classes_):
+            raise ValueError("Model has no 'spam' class")
+        if not self.holdout:
+            return None
+
+        messages = [m for m, _ in self.holdout]
+        labels = [label for _, label in self.holdout]
+        predicted = candidate.classes_[candidate.predict_proba(messages).argmax(axis=1)]
+        accuracy = sum(1 for p, y in zip(predicted, labels) if p == y) / len(labels)
+        if accuracy < self.min_accuracy:
+            raise ValueError(f"Holdout accuracy {accuracy:.3f} below {self.min_accuracy}")
+        return accuracy
+
+    def load(self, validate=True):
+        # Load the artifacts from disk, validate and swap
+        if self.pinned_by:
+            self.last_error = f"Active model is managed by {self.pinned_by}"
+            raise RuntimeError(self.last_error)
+        signature = self.artifact_signature()
+        try:
+            candidate = load_predictor(self.model_path, self.vectorizer_path, self.compact_dir)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            raise
+        candidate = self.publish(candidate, validate=validate)
+        self._signature = signature
+        return candidate
+
+    def publish(self, candidate, validate=True):
+        # Validate an in-memory predictor and swap it in; raises (and keeps the
+        # current model) on failure
+        with self._reload_lock:
+            self.reloading = True
+            try:
+                accuracy = self.validate(candidate) if validate else None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                self.reloading = False
+
+            with self._lock:
+                self.active = candidate
+                self.loaded_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                self.last_accuracy = accuracy
+                self.last_error = None
+            if self.on_swap:
+                self.on_swap(candidate)
+            return candidate
+
+    def reload_async(self):
+        # Admin-triggered reload; returns False if one is already running. The check and
+        # the claim are one non-blocking acquire, so two concurrent calls start one thread.
+        if self.reloading or not self._async_lock.acquire(blocking=False):
+            return False
+        try:
+            threading.Thread(target=self._reload_quietly, daemon=True).start()
+        except BaseException:
+            self._async_lock.release()
+            raise
+        return True
+
+    def _reload_quietly(self):
+        try:
+            self.load()
+        except Exception:
+            pass  # recorded in last_error, old model stays active
+        finally:
+            self._async_lock.release()
+
+    def artifact_signature(self):
+        paths = [self.model_path, self.vectorizer_path]
+        if self.compact_dir:
+            # Exports publish a new version directory and then swap this pointer, so a
+            # change here means a complete new version to load (never a rewrite in place)
+            paths.append(os.path.join(self.compact_dir, COMPACT_POINTER))
+        signature = []
+        for p in paths:
+            try:
+                st = os.stat(p)
+                signature.append((p, st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((p, None, None))
+        return tuple(signature)
+
+    def start_watcher(self, interval):
+        # Poll the artifact files and reload when they change (e.g. after train_model.py)
+        if self._watcher:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                if self.artifact_signature() != self._signature and not self.reloading and not self.pinned_by:
+                    self._reload_quietly()
+                    # Failed loads are not retried until the files change again
+                    self._signature = self.artifact_signature()
+
+        self._stop.clear()
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        if self._watcher:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def status(self):
+        return {
+            "model_version": self.version,
+            "model_type": type(self.active).__name__ if self.active else None,
+            "loaded_at": self.loaded_at,
+            "holdout_size": len(self.holdout),
+            "holdout_accuracy": self.last_accuracy,
+            "reloading": self.reloading,
+            "pinned_by": self.pinned_by,
+            "last_error": self.last_error,
+            "watching": self._watcher is not None,
+        }
@@ -0,0 +1,159 @@
+import argparse
+import socketserver
+import sys
+import threading
+
+# Local stand-in for Redis: the handful of commands shared_state.RedisState uses, kept in
+# memory. For tests and for running several replicas on one machine:
+#   python resp_server.py --port 6379
+#   STATE_BACKEND=redis://localhost:6379/0 python app.py
+
+
+class Store:
+    def __init__(self):
+        self.dbs = {}
+        self.lock = threading.Lock()
+
+    def db(self, index):
+        return self.dbs.setdefault(index, {})
+
+
+def _hash(db, key):
+    value = db.setdefault(key, {})
+    if not isinstance(value, dict):
+        raise TypeError
+    return value
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError
+
+
+def run_command(store, state, args):
+    # Returns the reply value; exceptions become error replies
+    name, args = args[0].upper(), args[1:]
+    with store.lock:
+        db = store.db(state["db"])
+        if name == "PING":
+            return args[0] if args else "PONG"
+        if name == "SELECT":
+            state["db"] = _int(args[0])
+            return "OK"
+        if name == "CLIENT":
+            # CLIENT SETNAME / SETINFO sent by some clients on connect
+            return "OK"
+        if name == "FLUSHDB":
+            db.clear()
+            return "OK"
+        if name == "GET":
+            value = db.get(args[0])
+            return None if isinstance(value, dict) else value
+        if name == "SET":
+            db[args[0]] = args[1]
+            return "OK"
+        if name == "DEL":
+            return sum(db.pop(k, None) is not None for k in args)
+        if name in ("INCR", "INCRBY"):
+            value = _int(db.get(args[0], 0)) + (_int(args[1]) if name == "INCRBY" else 1)
+            db[args[0]] = str(value)
+            return value
+        if name == "HSET":
+            h = _hash(db, args[0])
+            pairs = args[1:]
+            added = sum(pairs[i] not in h for i in range(0, len(pairs), 2))
+            h.update(zip(pairs[::2], pairs[1::2]))
+            return added
+        if name == "HGET":
+            return _hash(db, args[0]).get(args[1])
+        if name == "HMGET":
+            h = _hash(db, args[0])
+            return [h.get(f) for f in args[1:]]
+        if name == "HDEL":
+            h = _hash(db, args[0])
+            return sum(h.pop(f, None) is not None for f in args[1:])
+        if name == "HKEYS":
+            return list(_hash(db, args[0]))
+        if name == "HGETALL":
+            return [x for pair in _hash(db, args[0]).items() for x in pair]
+        if name == "HINCRBY":
+            h = _hash(db, args[0])
+            value = _int(h.get(args[1], 0)) + _int(args[2])
+            h[args[1]] = str(value)
+            return value
+        if name == "HLEN":
+            return len(_hash(db, args[0]))
+    raise NotImplementedError(name)
+
+
+def encode_reply(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(v) for v in value)
+    if value == "OK" or value == "PONG":
+        return b"+%s\r\n" % value.encode()
+    data = value.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def read_command(f):
+    line = f.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command (e.g. typed into telnet)
+        return line.decode("utf-8").split()
+    args = []
+    for _ in range(int(line[1:])):
+        n = int(f.readline()[1:])
+        args.append(f.read(n + 2)[:-2].decode("utf-8"))
+    return args
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        state = {"db": 0}
+        while True:
+            args = read_command(self.rfile)
+            if args is None:
+                return
+            if not args:
+                continue
+            try:
+                reply = encode_reply(run_command(self.server.store, state, args))
+            except NotImplementedError as e:
+                reply = b"-ERR unknown command '%s'\r\n" % str(e).encode()
+            except TypeError:
+                reply = b"-WRONGTYPE Operation against a key holding the wrong kind of value\r\n"
+            except (ValueError, IndexError):
+                reply = b"-ERR value is not an integer or wrong number of arguments\r\n"
+            self.wfile.write(reply)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, Handler)
+        self.store = Store()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-memory Redis stand-in for local runs and tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379, help="0 picks a free port")
+    args = parser.parse_args()
+
+    server = Server((args.host, args.port))
+    # The first line tells the caller (e.g. a test) which port was picked
+    print(f"listening on {server.server_address[0]}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,240 @@
+import argparse
+import csv
+import fcntl
+import gzip
+import io
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from db_pool import get_pool
+
+ARCHIVE_COLUMNS = ['id', 'message', 'source', 'result', 'probability', 'timestamp']
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def rollup_keys(row, stat_keys):
+    # Counter names for one archived row: the dashboard's stat keys plus
+    # result / source / category breakdowns
+    keys = list(stat_keys(row))
+    keys.append("result:spam" if "spam" in keys else "result:ham")
+    keys.append(f"source:{row['source'] or 'Unknown'}")
+    return keys
+
+
+class HistoryArchiver:
+    """Compacts history rows older than the retention window.
+
+    Each batch of raw rows is written to a gzip CSV partitioned by day
+    (<archive_dir>/history/date=YYYY-MM-DD/) and fsynced, then counted into hourly
+    and daily rollups and deleted from history. The delete transaction does no file
+    I/O (a few ms for 500 rows), so request-path writes never wait long for the lock.
+    release_campaigns(db, campaign_ids), if given, shrinks the deleted rows' campaigns
+    in the same transaction.
+    Across pre-fork workers a lock file in archive_dir lets one archive at a time.
+    """
+
+    def __init__(self, database, archive_dir, retention_days, stat_keys, batch_size=500, pause=0.05,
+                 release_campaigns=None):
+        self.database = database
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.stat_keys = stat_keys
+        self.batch_size = batch_size
+        self.pause = pause
+        self.release_campaigns = release_campaigns
+
+        self.archived = 0
+        self.batches = 0
+        self.files = 0
+        self.last_run = None
+        self.last_batch_ms = 0.0
+        self.last_error = None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def cutoff(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        return (now - timedelta(days=self.retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def run_batch(self, cutoff=None):
+        # Archive and delete up to batch_size of the oldest expired rows; returns the count
+        cutoff = cutoff or self.cutoff()
+        with self._lock, self._exclusive() as owner, get_pool(self.database).connection() as db:
+            if not owner:
+                # Another pre-fork worker is archiving; it would write the same rows
+                return 0
+            rows = db.execute(
+                'SELECT id, message, source, result, probability, timestamp FROM history '
+                'WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?',
+                (cutoff, self.batch_size)
+            ).fetchall()
+            if not rows:
+                return 0
+
+            start = time.perf_counter()
+            # Files are durable (fsynced, directories too) before any row is deleted, and
+            # written outside the write transaction so no request waits on disk I/O. If
+            # anything below fails, the rows stay and the next run rewrites the same files.
+            by_day = {}
+            for row in rows:
+                by_day.setdefault(str(row['timestamp'])[:10], []).append(row)
+            for day, day_rows in by_day.items():
+                self._write_archive(day, day_rows)
+
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                # Only the archived rows that are still there (one may have been deleted
+                # from the UI meanwhile) are rolled up and deleted
+                ids = [row['id'] for row in rows]
+                present = {r[0]: r[1] for r in db.execute(
+                    f'SELECT id, campaign_id FROM history WHERE id IN ({",".join("?" * len(ids))})', ids)}
+                counts = {}
+                for row in rows:
+                    if row['id'] not in present:
+                        continue
+                    ts = str(row['timestamp'])
+                    buckets = (("hour", ts[:13] + ":00:00"), ("day", ts[:10]))
+                    for key in rollup_keys(row, self.stat_keys):
+                        for period, bucket in buckets:
+                            counts[(period, bucket, key)] = counts.get((period, bucket, key), 0) + 1
+
+                db.executemany(
+                    'INSERT INTO history_rollups (period, bucket, name, count) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(period, bucket, name) DO UPDATE SET count = count + excluded.count',
+                    [(p, b, k, n) for (p, b, k), n in counts.items()]
+                )
+                db.execute(f'DELETE FROM history WHERE id IN ({",".join("?" * len(ids))})', ids)
+                if self.release_campaigns:
+                    self.release_campaigns(db, list(present.values()))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+
+            self.archived += len(present)
+            self.batches += 1
+            self.files += len(by_day)
+            self.last_batch_ms = (time.perf_counter() - start) * 1000
+            return len(rows)
+
+    @contextmanager
+    def _exclusive(self):
+        # Cross-process lock on the archive directory: yields False if another process holds it
+        os.makedirs(self.archive_dir, exist_ok=True)
+        fd = os.open(os.path.join(self.archive_dir, ".archiver.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)
+
+    def _write_archive(self, day, rows):
+        root = os.path.join(self.archive_dir, "history")
+        directory = os.path.join(root, f"date={day}")
+        created = not os.path.isdir(directory)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"history-{rows[0]['id']:012d}-{rows[-1]['id']:012d}.csv.gz")
+
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(ARCHIVE_COLUMNS)
+        writer.writerows(tuple(row) for row in rows)
+
+        # Write, fsync, rename, fsync the directory: readers never see a partial archive,
+        # and the archive survives a crash that happens after the rows are deleted
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(gzip.compress(output.getvalue().encode("utf-8")))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        _fsync_dir(directory)
+        if created:
+            _fsync_dir(root)
+            _fsync_dir(self.archive_dir)
+
+    def run(self, max_batches=None):
+        # Drain everything past the window, pausing between batches; returns rows archived
+        cutoff = self.cutoff()
+        total = batches = 0
+        try:
+            while max_batches is None or batches < max_batches:
+                n = self.run_batch(cutoff)
+                total += n
+                batches += 1
+                if n < self.batch_size or self._stop.wait(self.pause):
+                    break
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+        self.last_run = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        return total
+
+    def start(self, interval):
+        if self._thread:
+            return
+
+        def loop():
+            while not self._stop.is_set():
+                self.run()
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def status(self):
+        return {
+            "retention_days": self.retention_days,
+            "archive_dir": self.archive_dir,
+            "batch_size": self.batch_size,
+            "archived_rows": self.archived,
+            "batches": self.batches,
+            "files": self.files,
+            "last_run": self.last_run,
+            "last_batch_ms": round(self.last_batch_ms, 3),
+            "last_error": self.last_error,
+            "running": self._thread is not None,
+        }
+
+
+if __name__ == "__main__":
+    # One-off / cron run: python retention.py --days 30
+    parser = argparse.ArgumentParser(description="Archive and roll up history rows older than the retention window.")
+    parser.add_argument("--days", type=float, required=True)
+    parser.add_argument("--database", default="spam_data.db")
+    parser.add_argument("--archive-dir", default="archive")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    import app as app_module
+    app_module.app.config['DATABASE'] = args.database
+    app_module.init_db()
+    archiver = app_module.make_archiver(args.days, args.archive_dir, args.batch_size)
+    archived = archiver.run()
+    print(f"Archived {archived} rows in {archiver.batches} batches ({archiver.files} files)")
+    if archiver.last_error:
+        raise SystemExit(archiver.last_error)
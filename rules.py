@@ -0,0 +1,118 @@
+import re
+
+# Rule tables (all matching is substring-based on the lowercased text, like the original checks)
+SPAM_KEYWORDS = [
+    "free", "win", "winner", "cash", "offer",
+    "claim", "urgent", "prize", "money", "congratulations",
+    "click", "link", "subscribe", "buy", "order", "limited", "verify", "account"
+]
+
+# (tag, trigger words, group) - only the first matching rule of a group applies
+CATEGORY_RULES = [
+    ("💳 Financial Risk", ["bank", "transfer", "account", "verify", "credit", "card", "billing"], "money"),
+    ("💰 Potential Scam", ["win", "winner", "cash", "prize", "money", "lottery", "100%", "deposit"], "money"),
+    ("🚨 High Urgency", ["urgent", "immediate", "act now", "limited time", "expire", "warning"], None),
+    ("🔗 Link Analysis", ["http", ".com", "click"], None),
+]
+
+SUSPICIOUS_TLDS = ['.xyz', '.top', '.club', '.info', '.gq', '.tk', '.ml', '.ga', '.cf']
+SUSPICIOUS_URL_KEYWORDS = ['login', 'verify', 'account', 'update', 'secure', 'bank', 'prize', 'win']
+
+URL_PATTERN = re.compile(r'(https?://\S+|www\.\S+)')
+IP_PATTERN = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}')
+
+
+def _any_of(words):
+    return "|".join(re.escape(w) for w in sorted(set(words), key=len, reverse=True))
+
+
+class RuleEngine:
+    """Compiles the keyword, category and URL rules once and evaluates them in one scan.
+
+    Every distinct trigger word is checked once against the lowercased text; tags and
+    keyword hits are then derived from that hit set. (A combined regex was measured
+    slower than CPython's substring search for word lists this size.)
+    """
+
+    def __init__(self, spam_keywords=SPAM_KEYWORDS, category_rules=CATEGORY_RULES,
+                 suspicious_tlds=SUSPICIOUS_TLDS, suspicious_url_keywords=SUSPICIOUS_URL_KEYWORDS):
+        self.spam_keywords = list(spam_keywords)
+        self.category_rules = [(tag, frozenset(words), group) for tag, words, group in category_rules]
+
+        words = set(self.spam_keywords)
+        for _, rule_words, _ in self.category_rules:
+            words |= rule_words
+        self._words = tuple(sorted(words))
+
+        self._tld_pattern = re.compile(_any_of(suspicious_tlds))
+        self._url_keyword_pattern = re.compile(_any_of(suspicious_url_keywords))
+
+    def match_words(self, text):
+        low = text.lower()
+        return {w for w in self._words if w in low}
+
+    def categories(self, text, hits=None):
+        if hits is None:
+            hits = self.match_words(text)
+        if not hits:
+            return []
+        tags, used_groups = [], set()
+        for tag, words, group in self.category_rules:
+            if group in used_groups:
+                continue
+            if not words.isdisjoint(hits):
+                tags.append(tag)
+                if group:
+                    used_groups.add(group)
+        return tags
+
+    def keywords(self, text, hits=None):
+        if hits is None:
+            hits = self.match_words(text)
+        if not hits:
+            return []
+        return [k for k in self.spam_keywords if k in hits]
+
+    def scan_urls(self, text):
+        results = []
+        # Cheap pre-check: URL_PATTERN can only match around one of these markers
+        if "http" not in text and "www." not in text:
+            return results
+        for url in URL_PATTERN.findall(text):
+            risk_score = 0
+            reasons = []
+
+            if self._tld_pattern.search(url):
+                risk_score += 50
+                reasons.append("Suspicious TLD")
+            if self._url_keyword_pattern.search(url.lower()):
+                risk_score += 30
+                reasons.append("Suspicious Keyword")
+            if IP_PATTERN.search(url):
+                risk_score += 80
+                reasons.append("IP Address URL")
+
+            risk_level = "Low"
+            if risk_score > 70:
+                risk_level = "CRITICAL"
+            elif risk_score > 30:
+                risk_level = "High"
+            elif risk_score > 0:
+                risk_level = "Medium"
+
+            results.append({
+                "url": url,
+                "risk_score": risk_score,
+                "risk_level": risk_level,
+                "reasons": ", ".join(reasons) if reasons else "None"
+            })
+        return results
+
+    def analyze(self, text):
+        # Tags, keyword hits and URL risk from a single word scan
+        hits = self.match_words(text)
+        return {
+            "tags": self.categories(text, hits),
+            "keywords": self.keywords(text, hits),
+            "urls": self.scan_urls(text)
+        }
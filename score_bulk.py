@@ -0,0 +1,200 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from artifacts import load_predictor
+from rules import RuleEngine
+
+MODEL_PATH = "model/spam_model.pkl"
+VECTORIZER_PATH = "model/vectorizer.pkl"
+COMPACT_DIR = "model/compact"
+
+CHUNK_SIZE = 5000
+# The Kaggle SMS Spam CSV is latin-1; every other input is read as UTF-8 unless --encoding says otherwise
+KAGGLE_CSV = "spam.csv"
+KAGGLE_ENCODING = "latin-1"
+CSV_FIELDS = ["id", "prediction", "spam_probability", "is_spam", "tags", "urls"]
+
+# Per-process state: the predictor memory-maps the compact export, so worker
+# processes share the model pages instead of each holding a copy
+_predictor = None
+_rule_engine = None
+
+
+def init_scorer(model_path=MODEL_PATH, vectorizer_path=VECTORIZER_PATH, compact_dir=COMPACT_DIR):
+    global _predictor, _rule_engine
+    _predictor = load_predictor(model_path, vectorizer_path, compact_dir)
+    _rule_engine = RuleEngine()
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_chunks(f, fmt, chunk_size=CHUNK_SIZE, text_column=None):
+    # Yield [(id, message), ...] lists of at most chunk_size; only one chunk is held at a time
+    chunk = []
+    if fmt == "jsonl":
+        column = text_column or "message"
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            chunk.append((record.get("id", n), str(record.get(column) or "")))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    else:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        # Plain exports use "message"; the Kaggle dataset keeps the text in "v2"
+        column = text_column or ("message" if "message" in header else "v2")
+        if column not in header:
+            raise ValueError(f"Column {column!r} not found in CSV header {header}")
+        text_idx = header.index(column)
+        id_idx = header.index("id") if "id" in header else None
+        for n, row in enumerate(reader, 1):
+            if len(row) <= text_idx:
+                continue
+            chunk.append((row[id_idx] if id_idx is not None else n, row[text_idx]))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_chunk(chunk):
+    # Score a whole chunk with one predict_proba call; tags are only added for spam (as in api_result)
+    if _predictor is None:
+        init_scorer()
+    messages = [m for _, m in chunk]
+    probs = _predictor.predict_proba(messages)
+    spam_idx = list(_predictor.classes_).index("spam")
+    labels = _predictor.classes_[probs.argmax(axis=1)]
+
+    results = []
+    for (msg_id, message), label, p in zip(chunk, labels, probs[:, spam_idx]):
+        is_spam = label == "spam"
+        results.append({
+            "id": msg_id,
+            "prediction": "spam" if is_spam else "ham",
+            "spam_probability": round(float(p) * 100, 2),
+            "is_spam": bool(is_spam),
+            "tags": _rule_engine.categories(message) if is_spam else [],
+            "urls": _rule_engine.scan_urls(message),
+        })
+    return results
+
+
+def score_stream(chunks, jobs=1, init_args=()):
+    # Yield scored chunks in input order. With jobs > 1 chunks fan out to a process
+    # pool, with at most 2 * jobs chunks in flight so memory stays flat.
+    if jobs <= 1:
+        init_scorer(*init_args)
+        for chunk in chunks:
+            yield score_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_scorer, initargs=init_args) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(score_chunk, chunk))
+            if len(in_flight) >= 2 * jobs:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class ResultWriter:
+    def __init__(self, f, fmt):
+        self.f = f
+        self.fmt = fmt
+        if fmt == "csv":
+            self.writer = csv.writer(f)
+            self.writer.writerow(CSV_FIELDS)
+
+    def write(self, results):
+        if self.fmt == "jsonl":
+            self.f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in results)
+        else:
+            self.writer.writerows(
+                [r["id"], r["prediction"], r["spam_probability"], r["is_spam"],
+                 "; ".join(r["tags"]), " ".join(u["url"] for u in r["urls"])]
+                for r in results
+            )
+        self.f.flush()
+
+
+def input_encoding(path, encoding=None):
+    if encoding:
+        return encoding
+    return KAGGLE_ENCODING if os.path.basename(path) == KAGGLE_CSV else "utf-8"
+
+
+@contextmanager
+def open_stream(path, mode, encoding="utf-8"):
+    # "-" is stdin / stdout, which stay open afterwards: only real files are closed
+    if path != "-":
+        with open(path, mode, encoding=encoding, newline="") as f:
+            yield f
+    elif "r" in mode:
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, newline="")
+        try:
+            yield stream
+        finally:
+            stream.detach()
+    else:
+        try:
+            yield sys.stdout
+        finally:
+            sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a CSV or JSONL file of messages in streaming chunks.")
+    parser.add_argument("input", help="input file (.csv or .jsonl), or - for stdin")
+    parser.add_argument("output", help="output file (.csv or .jsonl), or - for stdout")
+    parser.add_argument("--input-format", choices=["csv", "jsonl"])
+    parser.add_argument("--output-format", choices=["csv", "jsonl"])
+    parser.add_argument("--text-column", help="message column/field (default: message, or v2 for the Kaggle CSV)")
+    parser.add_argument("--encoding", help=f"input encoding (default: utf-8, or {KAGGLE_ENCODING} for the Kaggle {KAGGLE_CSV})")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--jobs", type=int, default=1, help="worker processes (default: score in-process)")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--vectorizer", default=VECTORIZER_PATH)
+    parser.add_argument("--compact-dir", default=COMPACT_DIR)
+    args = parser.parse_args(argv)
+
+    in_fmt = detect_format(args.input, args.input_format)
+    out_fmt = detect_format(args.output, args.output_format)
+    init_args = (args.model, args.vectorizer, args.compact_dir)
+
+    start = time.perf_counter()
+    total = spam = 0
+    with open_stream(args.input, "r", input_encoding(args.input, args.encoding)) as fin, open_stream(args.output, "w") as fout:
+        writer = ResultWriter(fout, out_fmt)
+        chunks = read_chunks(fin, in_fmt, args.chunk_size, args.text_column)
+        for results in score_stream(chunks, args.jobs, init_args):
+            writer.write(results)
+            total += len(results)
+            spam += sum(1 for r in results if r["is_spam"])
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {total} messages ({spam} spam) in {elapsed:.2f}s "
+          f"({total / elapsed if elapsed else 0:.0f} msgs/s, {args.jobs} job(s))",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
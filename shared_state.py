@@ -0,0 +1,398 @@
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+# Commands per write in pipeline(): large batches are sent in chunks, so neither side
+# blocks on a full socket buffer while the other is still writing
+PIPELINE_CHUNK = 1000
+
+
+class RespError(Exception):
+    """Error reply from the server (-ERR ...)."""
+
+
+def encode_command(args):
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode("utf-8")
+        else:
+            data = str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+def read_reply(f):
+    # One RESP2 reply from a buffered socket file; bulk strings are decoded as UTF-8
+    line = f.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        return RespError(rest.decode("utf-8"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        n = int(rest)
+        if n < 0:
+            return None
+        data = f.read(n + 2)
+        return data[:-2].decode("utf-8")
+    if kind == b"*":
+        n = int(rest)
+        return None if n < 0 else [read_reply(f) for _ in range(n)]
+    raise ConnectionError(f"Bad reply: {line!r}")
+
+
+class RespClient:
+    """Minimal Redis (RESP2) client: one socket per thread and process, with pipelining.
+
+    `pipeline()` writes every command in one send and then reads the replies, so a
+    batch of N commands costs one network round trip.
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self.round_trips = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and conn[0] == os.getpid() and not self._usable(conn[1]):
+            # Closed by the server while idle (restart, idle timeout): reconnect before
+            # sending anything rather than retrying commands that may have run
+            self.close()
+            conn = None
+        if conn is None or conn[0] != os.getpid():
+            # Forked workers open their own sockets
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = (os.getpid(), sock, sock.makefile("rb"))
+            if self.db:
+                try:
+                    self._send(conn, [("SELECT", self.db)])
+                except OSError:
+                    self.close()
+                    raise
+        return conn
+
+    def _usable(self, sock):
+        # An idle socket has nothing to read: EOF or stray bytes mean it is no longer usable
+        sock.setblocking(False)
+        try:
+            sock.recv(1, socket.MSG_PEEK)
+            return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            sock.settimeout(self.timeout)
+
+    def _send(self, conn, commands):
+        _, sock, f = conn
+        sock.sendall(b"".join(encode_command(c) for c in commands))
+        self.round_trips += 1
+        return [read_reply(f) for _ in commands]
+
+    def pipeline(self, commands):
+        # Replies in command order; error replies are raised after all are read. Never
+        # retried: once anything was sent, commands such as INCR may already have run.
+        if not commands:
+            return []
+        conn = self._connection()
+        replies = []
+        try:
+            for i in range(0, len(commands), PIPELINE_CHUNK):
+                replies.extend(self._send(conn, commands[i:i + PIPELINE_CHUNK]))
+        except OSError:
+            # Unread replies may be left on the socket: never reuse it
+            self.close()
+            raise
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn and conn[0] == os.getpid():
+            try:
+                conn[1].close()
+            except OSError:
+                pass
+
+
+class LocalState:
+    """Overrides and dashboard counters in this replica's own SQLite tables (the default).
+
+    The tables are written by app.py in the caller's transaction, so publishing is a no-op.
+    Override changes also bump the 'overrides' row of the versions table in that
+    transaction; every worker process compares it on lookup and drops its override
+    cache when it moved.
+    """
+
+    shared = False
+    dropped_counts = dropped_overrides = 0
+
+    def __init__(self):
+        self._version = None
+        self._lock = threading.Lock()
+
+    def fetch_overrides(self, db, hashes):
+        # {message hash: (label, is_admin)}
+        placeholders = ",".join("?" * len(hashes))
+        return {row['message_hash']: (row['label'], bool(row['is_admin'])) for row in db.execute(
+            f'SELECT message_hash, label, is_admin FROM overrides WHERE message_hash IN ({placeholders})', hashes
+        )}
+
+    def publish_overrides(self, entries, remove_missing=False):
+        pass
+
+    def fetch_campaign_verdicts(self):
+        # Spam campaigns are matched in the local campaigns table
+        return []
+
+    def publish_campaign_verdicts(self, add=(), remove=()):
+        pass
+
+    def mark_overrides_changed(self, db):
+        db.execute("UPDATE versions SET version = version + 1 WHERE name = 'overrides'")
+
+    def overrides_changed(self, db):
+        # True when an override changed (in any process) since this process last looked
+        row = db.execute("SELECT version FROM versions WHERE name = 'overrides'").fetchone()
+        version = row[0] if row else 0
+        with self._lock:
+            changed = self._version is not None and version != self._version
+            self._version = version
+        return changed
+
+    def fetch_counts(self, db):
+        return {row['name']: row['count'] for row in db.execute('SELECT name, count FROM stats')}
+
+    def publish_counts(self, counts):
+        pass
+
+    def status(self):
+        return {"backend": "sqlite", "shared": False}
+
+
+class RedisState:
+    """Overrides and dashboard counters shared by every replica through Redis.
+
+    Each replica still keeps its own SQLite tables; this backend receives their changes
+    and serves the cluster-wide view:
+
+      <prefix>overrides:admin / :user   hash of message hash -> newest admin / user label
+      <prefix>overrides:gen             bumped on every override change
+      <prefix>campaigns:spam            hash of MinHash signature (hex) -> "SPAM" for
+                                        campaigns an admin marked as spam
+      <prefix>stats                     hash of counter name -> count
+
+    Reads avoid a per-request round trip: the app's override cache is only dropped when
+    the generation moved (checked at most every sync_interval seconds), and counters are
+    cached for counts_ttl seconds. If Redis is unreachable, reads fall back to the local
+    tables and the error is kept in status().
+
+    Override writes are idempotent, so a failed publish is kept (newest label per
+    message, up to max_unpublished) and sent again with the next publish or sync.
+    Counter deltas are not (HINCRBY may have run before the error), so a failed batch
+    is dropped and counted in dropped_counts instead of risking a double count.
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix="spam:", sync_interval=1.0, counts_ttl=2.0, max_unpublished=10000):
+        self.client = client
+        self.prefix = prefix
+        self.sync_interval = sync_interval
+        self.counts_ttl = counts_ttl
+        self.max_unpublished = max_unpublished
+        self.local = LocalState()
+
+        self.errors = 0
+        self.last_error = None
+        self.dropped_counts = 0
+        self.dropped_overrides = 0
+        self._unpublished = {}   # (field, message hash or signature) -> command
+        self._campaigns = None
+        self._gen = None
+        self._synced_at = 0.0
+        self._counts = None
+        self._counts_at = 0.0
+        self._lock = threading.Lock()
+
+    def key(self, name):
+        return self.prefix + name
+
+    def _failed(self, e):
+        self.errors += 1
+        self.last_error = f"{type(e).__name__}: {e}"
+
+    def fetch_overrides(self, db, hashes):
+        try:
+            admin, user = self.client.pipeline([
+                ("HMGET", self.key("overrides:admin"), *hashes),
+                ("HMGET", self.key("overrides:user"), *hashes),
+            ])
+        except (OSError, RespError) as e:
+            self._failed(e)
+            return self.local.fetch_overrides(db, hashes)
+        found = {}
+        for h, a, u in zip(hashes, admin, user):
+            if a is not None:
+                found[h] = (a, True)
+            elif u is not None:
+                found[h] = (u, False)
+        return found
+
+    def publish_overrides(self, entries, remove_missing=False):
+        # [(message hash, newest admin label, newest user label)] from this replica. A None
+        # label leaves other replicas' label in place unless remove_missing (feedback was
+        # deleted). One pipelined round trip per PIPELINE_CHUNK commands.
+        updates = {}
+        for msg_hash, admin_label, user_label in entries:
+            for field, label in (("overrides:admin", admin_label), ("overrides:user", user_label)):
+                if label is None:
+                    if remove_missing:
+                        updates[(field, msg_hash)] = ("HDEL", self.key(field), msg_hash)
+                else:
+                    updates[(field, msg_hash)] = ("HSET", self.key(field), msg_hash, label)
+        self._publish(updates)
+
+    def fetch_campaign_verdicts(self):
+        # Signatures of spam campaigns from every replica; cached until the generation moves
+        campaigns = self._campaigns
+        if campaigns is None:
+            try:
+                campaigns = self.client.execute("HKEYS", self.key("campaigns:spam"))
+            except (OSError, RespError) as e:
+                self._failed(e)
+                return []
+            self._campaigns = campaigns
+        return campaigns
+
+    def publish_campaign_verdicts(self, add=(), remove=()):
+        field = "campaigns:spam"
+        updates = {(field, h): ("HDEL", self.key(field), h) for h in remove}
+        updates.update(((field, h), ("HSET", self.key(field), h, "SPAM")) for h in add)
+        self._campaigns = None
+        self._publish(updates)
+
+    def _publish(self, updates):
+        # Idempotent writes plus a generation bump, in one round trip
+        with self._lock:
+            pending = dict(self._unpublished)
+        pending.update(updates)
+        if not pending:
+            return
+        commands = list(pending.values()) + [("INCR", self.key("overrides:gen"))]
+        try:
+            gen = self.client.pipeline(commands)[-1]
+        except (OSError, RespError) as e:
+            self._failed(e)
+            with self._lock:
+                # Newer labels win; past the cap the oldest are given up (and counted)
+                self._unpublished = pending
+                while len(self._unpublished) > self.max_unpublished:
+                    self._unpublished.pop(next(iter(self._unpublished)))
+                    self.dropped_overrides += 1
+            return
+        with self._lock:
+            for key in pending:
+                if self._unpublished.get(key) == pending[key]:
+                    del self._unpublished[key]
+            # Our own change needs no cache flush (the caller discards that entry),
+            # unless another replica changed something in between
+            if self._gen is not None and gen == self._gen + 1:
+                self._gen = gen
+
+    def mark_overrides_changed(self, db):
+        # Publishing already bumped the generation every process and replica polls
+        pass
+
+    def overrides_changed(self, db=None):
+        # True when another process or replica changed an override since the last check
+        now = time.monotonic()
+        if now - self._synced_at < self.sync_interval:
+            return False
+        self._synced_at = now
+        if self._unpublished:
+            self._publish({})
+        try:
+            gen = int(self.client.execute("GET", self.key("overrides:gen")) or 0)
+        except (OSError, RespError) as e:
+            self._failed(e)
+            return False
+        with self._lock:
+            changed = self._gen is not None and gen != self._gen
+            self._gen = gen
+        if changed:
+            self._campaigns = None
+        return changed
+
+    def fetch_counts(self, db):
+        now = time.monotonic()
+        counts = self._counts
+        if counts is not None and now - self._counts_at < self.counts_ttl:
+            return counts
+        try:
+            flat = self.client.execute("HGETALL", self.key("stats"))
+        except (OSError, RespError) as e:
+            self._failed(e)
+            return self.local.fetch_counts(db)
+        counts = {flat[i]: int(flat[i + 1]) for i in range(0, len(flat), 2)}
+        self._counts, self._counts_at = counts, now
+        return counts
+
+    def publish_counts(self, counts):
+        # Counter deltas from this replica, one pipelined round trip
+        commands = [("HINCRBY", self.key("stats"), name, n) for name, n in counts.items() if n]
+        try:
+            self.client.pipeline(commands)
+        except (OSError, RespError) as e:
+            self._failed(e)
+            self.dropped_counts += len(commands)
+            return
+        self._counts = None
+
+    def status(self):
+        return {
+            "backend": "redis",
+            "shared": True,
+            "server": f"{self.client.host}:{self.client.port}/{self.client.db}",
+            "prefix": self.prefix,
+            "round_trips": self.client.round_trips,
+            "override_generation": self._gen,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "unpublished_overrides": len(self._unpublished),
+            "dropped_overrides": self.dropped_overrides,
+            "dropped_counts": self.dropped_counts,
+        }
+
+
+def make_state(url=None, **kwargs):
+    # STATE_BACKEND: unset / "sqlite" -> LocalState, "redis://host:port/db" -> RedisState
+    if not url or url == "sqlite":
+        return LocalState()
+    parsed = urlparse(url)
+    if parsed.scheme != "redis":
+        raise ValueError(f"Unsupported state backend: {url}")
+    db = int(parsed.path.lstrip("/") or 0)
+    client = RespClient(parsed.hostname or "localhost", parsed.port or 6379, db)
+    return RedisState(client, **kwargs)
@@ -2,12 +2,15 @@ import unittest
 import os
 import tempfile
 import json
+import app as app_module
 from app import app, init_db, get_db
 
 class AdminAppTestCase(unittest.TestCase):
     def setUp(self):
         self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
         app.config['TESTING'] = True
+        # Synchronous history writes so assertions see rows right away
+        app.config['HISTORY_WRITE_BEHIND'] = False
         self.client = app.test_client()
 
         with app.app_context():
@@ -77,5 +80,162 @@ class AdminAppTestCase(unittest.TestCase):
         rv = self.client.get('/admin', follow_redirects=True)
         assert b'Login' in rv.data
 
+    def test_admin_queue_pagination(self):
+        for i in range(3):
+            self.client.post('/feedback', data={'message': f'Queue {i}', 'user_label': 'SPAM'})
+        self.client.post('/admin/train', data={'message': 'Queue 0', 'label': 'SPAM'})
+
+        data = self.client.get('/admin/api/feedback', query_string={'limit': 1}).get_json()
+        assert [f['message'] for f in data['items']] == ['Queue 2']
+        data = self.client.get('/admin/api/feedback', query_string={'limit': 5, 'cursor': data['next_cursor']}).get_json()
+        assert [f['message'] for f in data['items']] == ['Queue 1']
+        assert data['next_cursor'] is None
+
+        self.client.get('/logout')
+        rv = self.client.get('/admin/api/feedback')
+        assert rv.status_code == 401
+
+    def test_admin_override_beats_newer_user_feedback(self):
+        msg = "Claim your reward now"
+        self.client.post('/admin/train', data={'message': msg, 'label': 'NOT SPAM'})
+        self.client.post('/feedback', data={'message': msg, 'user_label': 'SPAM'})
+
+        # Both endpoints apply the same rule
+        rv = self.client.post('/api/predict', json={'message': msg})
+        assert rv.get_json()['prediction'] == 'not spam'
+        rv = self.client.post('/', data={'message': msg, 'source': 'Test'})
+        assert '✅ NOT SPAM'.encode() in rv.data
+
+        # Dismissing the admin row falls back to the user's label (visiting / logged us out)
+        self.client.post('/login', data={'username': 'admin', 'password': '1234'})
+        with app.app_context():
+            fid = get_db().execute('SELECT id FROM feedback WHERE user_label = "ADMIN_NOT SPAM"').fetchone()['id']
+        self.client.post(f'/admin/delete_feedback/{fid}')
+        rv = self.client.post('/api/predict', json={'message': msg})
+        assert rv.get_json()['prediction'] == 'spam'
+
+    def test_model_reload_endpoint(self):
+        rv = self.client.post('/admin/api/model/reload')
+        assert rv.status_code == 202
+        version = rv.get_json()['model_version']
+
+        rv = self.client.post('/api/predict', json={'message': 'Hello there'})
+        assert rv.get_json()['model_version'] == version
+
+        self.client.get('/logout')
+        assert self.client.post('/admin/api/model/reload').status_code == 401
+
+    def test_admin_train_feeds_online_model(self):
+        path = os.path.join(tempfile.mkdtemp(), 'online_model.pkl')
+        trainer = app_module.enable_online_learning(path=path, start=False)
+        try:
+            base_version = app_module.model_version
+            self.client.post('/admin/train', data={'message': 'Zorblax loyalty voucher inside', 'label': 'SPAM'})
+            # Queued in the database for whichever worker owns the online model
+            assert trainer.pull() == 1
+            assert trainer.pull() == 0
+
+            rv = self.client.get('/admin/api/model')
+            status = rv.get_json()
+            assert status['model_version'] == trainer.model.version != base_version
+            assert status['online_learning']['updates'] == 1
+            assert status['pinned_by'] == "online learning"
+            # The batch artifacts cannot be reloaded over the online model
+            with self.assertRaises(RuntimeError):
+                app_module.load_model()
+        finally:
+            app_module.disable_online_learning()
+            os.unlink(path)
+
+    def test_profiler_endpoint(self):
+        rv = self.client.post('/admin/api/profile', json={'action': 'start', 'interval': 0.001})
+        assert rv.get_json()['running']
+        try:
+            for _ in range(20):
+                self.client.post('/api/predict', json={'message': 'Profile me please'})
+            assert app_module.profiler.samples > 0
+            rv = self.client.get('/admin/api/profile?format=collapsed')
+            assert rv.mimetype == 'text/plain' and rv.get_data(as_text=True).strip()
+        finally:
+            rv = self.client.post('/admin/api/profile', json={'action': 'stop'})
+        status = rv.get_json()
+        assert not status['running'] and status['samples'] > 0
+        assert self.client.get('/admin/api/profile').get_json()['top_functions']
+
+        assert self.client.post('/admin/api/profile', json={'action': 'start', 'interval': 5}).status_code == 400
+        self.client.get('/logout')
+        assert self.client.get('/admin/api/profile').status_code == 401
+
+    def test_campaign_verdict_covers_variants(self):
+        template = "Dear {}, your parcel is held at customs. Pay the {} fee at {} within 24 hours to release it"
+        variants = [template.format(n, f, u) for n, f, u in [
+            ("Alex", "£2.99", "http://parcel-fee.xyz/a1"), ("Sam", "£3.49", "http://dlvry.top/b2"),
+            ("Jo", "£1.99", "www.customs-pay.info/c3"), ("Kim", "£4.10", "http://pkg-hold.xyz/d4")]]
+        for v in variants[:3]:
+            self.client.post('/', data={'message': v, 'source': 'SMS'})
+        self.client.post('/login', data={'username': 'admin', 'password': '1234'})
+
+        # One campaign of three in the admin view and API
+        items = self.client.get('/admin/api/campaigns').get_json()['items']
+        assert [c['size'] for c in items] == [3] and items[0]['label'] is None
+        rv = self.client.get('/admin')
+        assert b'Campaigns' in rv.data and b'Unreviewed' in rv.data
+
+        # Warm the override cache with "no override" for an unseen variant
+        assert self.client.post('/api/predict', json={'message': variants[3]}).get_json()['spam_probability'] != 50.0
+
+        # A NOT SPAM verdict covers only that exact message: variants are matched with
+        # their URLs masked, so one may carry a different (malicious) link
+        self.client.post('/admin/train', data={'message': variants[0], 'label': 'NOT SPAM'})
+        assert self.client.get('/admin/api/campaigns').get_json()['items'][0]['label'] == 'NOT SPAM'
+        assert self.client.post('/api/predict', json={'message': variants[0]}).get_json()['prediction'] == 'not spam'
+        assert self.client.post('/api/predict', json={'message': variants[3]}).get_json()['spam_probability'] != 50.0
+
+        # A SPAM verdict on one variant covers the unseen one, without the model
+        self.client.post('/admin/train', data={'message': variants[1], 'label': 'SPAM'})
+        data = self.client.post('/api/predict', json={'message': variants[3]}).get_json()
+        assert data['prediction'] == 'spam' and data['spam_probability'] == 50.0
+        rv = self.client.post('/api/predict/batch', json={'messages': variants})
+        assert [r['prediction'] for r in rv.get_json()['results']] == ['not spam', 'spam', 'spam', 'spam']
+        assert self.client.get('/admin/api/campaigns').get_json()['items'][0]['label'] == 'SPAM'
+
+        # Unrelated messages are not affected
+        data = self.client.post('/api/predict', json={'message': 'WINNER! Claim your free cash prize now, text WIN to 80086'}).get_json()
+        assert data['spam_probability'] != 50.0
+
+        # Dismissing the admin row withdraws the campaign verdict too
+        with app.app_context():
+            fid = get_db().execute('SELECT id FROM feedback WHERE user_label = "ADMIN_SPAM"').fetchone()['id']
+        self.client.post(f'/admin/delete_feedback/{fid}')
+        assert self.client.post('/api/predict', json={'message': variants[3]}).get_json()['spam_probability'] != 50.0
+
+    def test_campaigns_shrink_with_history(self):
+        template = "Your account {} is locked. Confirm your details at {} to avoid suspension today"
+        variants = [template.format(n, u) for n, u in [("#1234", "http://a.xyz"), ("#5678", "http://b.top"),
+                                                      ("#9012", "http://c.info")]]
+        for v in variants:
+            self.client.post('/', data={'message': v, 'source': 'SMS'})
+        self.client.post('/', data={'message': 'Are we still on for dinner tonight?', 'source': 'SMS'})
+        self.client.post('/login', data={'username': 'admin', 'password': '1234'})
+        assert [c['size'] for c in self.client.get('/admin/api/campaigns').get_json()['items']] == [3]
+
+        with app.app_context():
+            db = get_db()
+            ids = [r['id'] for r in db.execute('SELECT id FROM history WHERE message IN (?, ?)', variants[:2])]
+        for i in ids:
+            self.client.post(f'/delete_history/{i}')
+        with app.app_context():
+            db = get_db()
+            assert [r['size'] for r in db.execute('SELECT size FROM campaigns ORDER BY id')] == [1, 1]
+
+        # A verdict outlives the history it was given on; everything else is cleared
+        self.client.post('/admin/train', data={'message': variants[2], 'label': 'SPAM'})
+        self.client.post('/clear_history')
+        with app.app_context():
+            db = get_db()
+            assert [(r['size'], r['label']) for r in db.execute('SELECT size, label FROM campaigns')] == [(0, 'SPAM')]
+            campaign_ids = {r[0] for r in db.execute('SELECT campaign_id FROM campaign_bands')}
+            assert campaign_ids == {db.execute('SELECT id FROM campaigns').fetchone()[0]}
+
 if __name__ == '__main__':
     unittest.main()
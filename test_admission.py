@@ -0,0 +1,154 @@
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import app as app_module
+from app import app, init_db
+from admission import AdmissionGate, RateLimiter, Rejected
+
+class AdmissionGateTestCase(unittest.TestCase):
+    def test_queue_then_reject(self):
+        gate = AdmissionGate(max_in_flight=1, max_queue=1, queue_timeout=5)
+        assert gate.acquire() == 0.0
+
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(gate.acquire()))
+        waiter.start()
+        while gate.queued == 0:
+            time.sleep(0.001)
+
+        # Slot busy and queue full: rejected at once, with a Retry-After hint
+        with self.assertRaises(Rejected) as cm:
+            gate.acquire()
+        assert cm.exception.reason == "queue_full" and cm.exception.retry_after >= 1
+
+        time.sleep(0.02)
+        gate.release(0.02)
+        waiter.join()
+        assert waited[0] >= 0.02 and gate.in_flight == 1
+        gate.release()
+        assert gate.status()["rejected"] == {"queue_full": 1, "queue_timeout": 0}
+        assert gate.status()["admitted"] == 2
+
+    def test_queue_timeout(self):
+        gate = AdmissionGate(max_in_flight=1, max_queue=4, queue_timeout=0.05)
+        gate.acquire()
+        start = time.monotonic()
+        with self.assertRaises(Rejected) as cm:
+            gate.acquire()
+        assert cm.exception.reason == "queue_timeout"
+        assert time.monotonic() - start < 1 and gate.queued == 0
+
+    def test_fifo_order(self):
+        gate = AdmissionGate(max_in_flight=1, max_queue=10, queue_timeout=5)
+        gate.acquire()
+        order = []
+
+        def worker(i):
+            gate.acquire()
+            order.append(i)
+            gate.release()
+
+        threads = []
+        for i in range(5):
+            t = threading.Thread(target=worker, args=(i,))
+            t.start()
+            threads.append(t)
+            while gate.queued < i + 1:
+                time.sleep(0.001)
+        gate.release()
+        for t in threads:
+            t.join()
+        assert order == list(range(5))
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=2, burst=3)
+        for _ in range(3):
+            limiter.take("a", now=100.0)
+        with self.assertRaises(Rejected) as cm:
+            limiter.take("a", now=100.0)
+        assert cm.exception.reason == "rate_limited" and cm.exception.retry_after == 1
+
+        # Other clients have their own bucket; tokens refill at `rate` per second
+        limiter.take("b", now=100.0)
+        limiter.take("a", now=100.5)
+        with self.assertRaises(Rejected):
+            limiter.take("a", now=100.5)
+
+    def test_evicts_least_recent_clients(self):
+        limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+        for client in ("a", "b", "c"):
+            limiter.take(client, now=0.0)
+        assert limiter.status()["clients"] == 2
+        limiter.take("a", now=0.0)   # evicted, so a fresh bucket
+
+
+class AdmissionAppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        app.config['TESTING'] = True
+        app.config['HISTORY_WRITE_BEHIND'] = False
+        self.client = app.test_client()
+        self.saved = app_module.admission_gate, app_module.rate_limiter
+        init_db()
+
+    def tearDown(self):
+        app_module.admission_gate, app_module.rate_limiter = self.saved
+        os.close(self.db_fd)
+        os.unlink(app.config['DATABASE'])
+
+    def test_busy_endpoint_sheds_load(self):
+        gate = app_module.admission_gate = AdmissionGate(1, 0, 1.0)
+        gate.acquire()   # another request holds the only slot
+        rv = self.client.post('/api/predict', json={'message': 'hello there'})
+        assert rv.status_code == 429 and int(rv.headers['Retry-After']) >= 1
+        assert rv.get_json()['reason'] == 'queue_full'
+        assert app_module.ADMISSION_REJECTED.value('api_predict', 'queue_full') >= 1
+
+        # One budget for every prediction endpoint; page loads are not affected
+        assert self.client.post('/api/predict/batch', json={'messages': ['hi']}).status_code == 429
+        assert self.client.get('/').status_code == 200
+
+        gate.release()
+        assert self.client.post('/api/predict', json={'message': 'hello there'}).status_code == 200
+        assert gate.in_flight == 0
+
+    def test_slot_released_after_errors(self):
+        gate = app_module.admission_gate = AdmissionGate(1, 0, 1.0)
+        assert self.client.post('/api/predict', json={'message': ''}).status_code == 400
+        assert gate.in_flight == 0
+
+    def test_rate_limit_per_client(self):
+        app_module.rate_limiter = RateLimiter(rate=0.001, burst=2)
+        for _ in range(2):
+            assert self.client.post('/api/predict', json={'message': 'hello'}).status_code == 200
+        rv = self.client.post('/api/predict', json={'message': 'hello'})
+        assert rv.status_code == 429 and rv.get_json()['reason'] == 'rate_limited'
+        assert int(rv.headers['Retry-After']) > 1
+
+        other = self.client.post('/api/predict', json={'message': 'hello'}, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        assert other.status_code == 200
+
+        body = self.client.get('/metrics').get_data(as_text=True)
+        assert 'spam_admission_rejected_total{endpoint="api_predict",reason="rate_limited"}' in body
+        assert 'spam_admission_queue_wait_seconds_count{endpoint="api_predict"}' in body
+
+    def test_worker_threads_cover_budget_plus_headroom(self):
+        saved = dict(os.environ)
+        try:
+            os.environ.update(ADMISSION_MAX_IN_FLIGHT="8", ADMISSION_MAX_QUEUE="40")
+            os.environ.pop("WORKER_THREADS", None)
+            conf = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py"))
+            shutil.rmtree(os.environ["METRICS_MULTIPROC_DIR"], ignore_errors=True)
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+        assert conf["threads"] == 8 + 40 + 12
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,12 +2,17 @@ import unittest
 import os
 import tempfile
 import json
-from app import app, init_db, get_db
+import sqlite3
+import app as app_module
+from app import app, init_db, get_db, load_stats, rebuild_stats, override_cache, prediction_cache, history_writer
+from shared_state import LocalState
 
 class SmartSpamAppTestCase(unittest.TestCase):
     def setUp(self):
         self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
         app.config['TESTING'] = True
+        # Synchronous history writes so assertions see rows right away
+        app.config['HISTORY_WRITE_BEHIND'] = False
         self.client = app.test_client()
 
         with app.app_context():
@@ -64,5 +69,399 @@ class SmartSpamAppTestCase(unittest.TestCase):
             count = db.execute('SELECT COUNT(*) as c FROM history WHERE id = ?', (item_id,)).fetchone()['c']
             assert count == 0
 
+    def test_batch_predict(self):
+        msg = "Safe message that looks like spam maybe"
+        self.client.post('/feedback', data={'message': msg, 'user_label': 'NOT SPAM'})
+
+        messages = ['WINNER! Cash prize waiting.', msg, 'See you at lunch tomorrow', 'WINNER! Cash prize waiting.']
+        rv = self.client.post('/api/predict/batch', json={'messages': messages})
+        results = rv.get_json()['results']
+
+        # Same order and same fields as single predictions
+        assert len(results) == 4
+        for m, r in zip(messages, results):
+            single = self.client.post('/api/predict', json={'message': m}).get_json()
+            assert r['prediction'] == single['prediction']
+            assert r['is_spam'] == single['is_spam']
+            assert abs(r['spam_probability'] - single['spam_probability']) < 1e-6
+        assert results[1]['prediction'] == 'not spam'
+
+        rv = self.client.post('/api/predict/batch', json={'messages': []})
+        assert rv.status_code == 400
+
+    def test_async_predict_matches_sync(self):
+        msg = "Safe message that looks like spam maybe"
+        self.client.post('/feedback', data={'message': msg, 'user_label': 'NOT SPAM'})
+
+        for m in ['WINNER! Cash prize waiting.', msg, 'See you at lunch tomorrow']:
+            rv = self.client.post('/api/predict/async', json={'message': m})
+            assert rv.status_code == 200
+            assert rv.get_json() == self.client.post('/api/predict', json={'message': m}).get_json()
+
+        # Scoring ran on the inference executor, still labelled with the request's endpoint
+        before = app_module.STAGE_SECONDS.count('api_predict_async', 'score_one')
+        self.client.post('/api/predict/async', json={'message': 'A message the cache has not seen 4711'})
+        assert app_module.STAGE_SECONDS.count('api_predict_async', 'score_one') == before + 1
+
+        assert self.client.post('/api/predict/async', json={'message': ''}).status_code == 400
+
+        # An override hit never reaches the model
+        msg = 'An overridden message the cache has not seen 4712'
+        self.client.post('/feedback', data={'message': msg, 'user_label': 'SPAM'})
+        before = app_module.STAGE_SECONDS.count('api_predict_async', 'score_one')
+        assert self.client.post('/api/predict/async', json={'message': msg}).get_json()['prediction'] == 'spam'
+        assert app_module.STAGE_SECONDS.count('api_predict_async', 'score_one') == before
+
+    def test_dashboard_aggregates(self):
+        self.client.post('/', data={'message': 'URGENT! Verify your bank account http://x.xyz', 'source': 'SMS'})
+        self.client.post('/', data={'message': 'WINNER! Cash prize waiting.', 'source': 'SMS'})
+        self.client.post('/', data={'message': 'See you at lunch tomorrow', 'source': 'Email'})
+
+        with app.app_context():
+            db = get_db()
+            stats = load_stats(db)
+            assert stats['total'] == 3
+            assert stats['radar_data']['Financial'] == 1
+            assert stats['radar_data']['Urgency'] == 1
+            assert stats['radar_data']['Phishing'] == 1
+            assert sum(stats['traffic_data'].values()) == 3
+
+            # Incremental counters agree with a full rescan
+            rebuild_stats(db)
+            assert load_stats(db) == stats
+            item_id = db.execute('SELECT id FROM history WHERE source = "Email"').fetchone()['id']
+
+        self.client.post(f'/delete_history/{item_id}')
+        with app.app_context():
+            stats = load_stats(get_db())
+            assert stats['total'] == 2
+            assert sum(stats['traffic_data'].values()) == 2
+
+        self.client.post('/clear_history')
+        with app.app_context():
+            stats = load_stats(get_db())
+            assert stats['total'] == 0
+            assert stats['radar_data'] == {'Financial': 0, 'Urgency': 0, 'Phishing': 0, 'Scam': 0}
+
+    def test_api_stats_conditional_get(self):
+        self.client.post('/', data={'message': 'WINNER! Cash prize waiting.', 'source': 'SMS'})
+        rv = self.client.get('/api/stats')
+        assert rv.status_code == 200 and rv.headers['Cache-Control'] == 'no-cache'
+        etag = rv.headers['ETag']
+        with app.app_context():
+            assert rv.get_json() == load_stats(get_db())
+
+        # Unchanged counters: empty 304, served from the memo
+        hits = app_module.stats_memo.hits
+        rv = self.client.get('/api/stats', headers={'If-None-Match': etag})
+        assert rv.status_code == 304 and rv.data == b''
+        assert app_module.stats_memo.hits == hits + 1
+
+        # A new scan drops the memo and changes the ETag
+        self.client.post('/', data={'message': 'See you at lunch tomorrow', 'source': 'Email'})
+        rv = self.client.get('/api/stats', headers={'If-None-Match': etag})
+        assert rv.status_code == 200 and rv.headers['ETag'] != etag
+        assert rv.get_json()['total'] == 2
+
+        # The page itself no longer renders the counters
+        assert b'id="statTotal"' in self.client.get('/').data
+
+    def test_history_pagination(self):
+        for i in range(5):
+            self.client.post('/', data={'message': f'Page message {i}', 'source': 'SMS'})
+
+        # Walk the JSON endpoint two rows at a time; newest first, no gaps or repeats
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get('/api/history', query_string=params).get_json()
+            seen.extend(item['message'] for item in data['items'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        assert seen == [f'Page message {i}' for i in reversed(range(5))]
+
+        rv = self.client.get('/api/history', query_string={'cursor': 'garbage'})
+        assert rv.status_code == 400
+
+        # Keyset query is served from the (timestamp, id) index
+        with app.app_context():
+            plan = get_db().execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM history WHERE (timestamp, id) < (?, ?) '
+                'ORDER BY timestamp DESC, id DESC LIMIT 10', ('2099-01-01 00:00:00', 1)
+            ).fetchall()
+            assert any('idx_history_timestamp_id' in row[3] for row in plan)
+
+    def test_override_normalized_and_invalidated(self):
+        msg = "Lunch at  noon?"
+        rv = self.client.post('/api/predict', json={'message': msg})
+        assert rv.get_json()['prediction'] == 'ham'
+
+        # Cached "no override" must be dropped once feedback arrives
+        self.client.post('/feedback', data={'message': msg, 'user_label': 'SPAM'})
+        rv = self.client.post('/api/predict', json={'message': 'lunch at noon?  '})
+        assert rv.get_json()['prediction'] == 'spam'
+
+        hits = override_cache.hits
+        self.client.post('/api/predict', json={'message': msg})
+        assert override_cache.hits == hits + 1
+
+        # Feedback recorded by another worker process (its own connection and cache)
+        # reaches this process's cached answer through the versions row
+        other = 'Dinner at eight?'
+        assert self.client.post('/api/predict', json={'message': other}).get_json()['prediction'] == 'ham'
+        db = sqlite3.connect(app.config['DATABASE'])
+        db.row_factory = sqlite3.Row
+        db.execute("INSERT INTO overrides (message_hash, label) VALUES (?, 'SPAM')", (app_module.message_hash(other),))
+        LocalState().mark_overrides_changed(db)
+        db.commit()
+        db.close()
+        assert self.client.post('/api/predict', json={'message': other}).get_json()['prediction'] == 'spam'
+
+        with app.app_context():
+            db = get_db()
+            plan = db.execute(
+                'EXPLAIN QUERY PLAN SELECT label FROM overrides WHERE message_hash = ?', ('x',)
+            ).fetchall()
+            assert 'SCAN' not in ' '.join(row[3] for row in plan)
+
+    def test_export_csv_streams_with_filters(self):
+        self.client.post('/', data={'message': 'WINNER! Cash prize waiting. Claim now!', 'source': 'SMS'})
+        self.client.post('/', data={'message': 'See you at lunch tomorrow', 'source': 'Email'})
+
+        rv = self.client.get('/export_csv')
+        assert rv.is_streamed
+        lines = rv.get_data(as_text=True).strip().splitlines()
+        assert lines[0] == 'ID,Message,Source,Result,Probability,Timestamp'
+        assert len(lines) == 3
+
+        rv = self.client.get('/export_csv', query_string={'source': 'Email', 'result': 'ham'})
+        lines = rv.get_data(as_text=True).strip().splitlines()
+        assert len(lines) == 2 and 'lunch' in lines[1]
+
+        rv = self.client.get('/export_csv', query_string={'end': '2000-01-01'})
+        assert len(rv.get_data(as_text=True).strip().splitlines()) == 1
+
+        rv = self.client.get('/export_csv', query_string={'start': 'yesterday'})
+        assert rv.status_code == 400
+
+    def test_export_csv_returns_connection_when_query_fails(self):
+        pool = app_module.get_pool(app.config['DATABASE'])
+        with app.app_context():
+            get_db().execute('ALTER TABLE history RENAME TO history_moved')
+        in_use = pool.stats()['created'] - pool.stats()['idle']
+        with self.assertRaises(sqlite3.OperationalError):
+            self.client.get('/export_csv').get_data()
+        assert pool.stats()['created'] - pool.stats()['idle'] == in_use
+
+    def test_time_bounds_normalized_to_stored_format(self):
+        parse = app_module.parse_time_bound
+        assert parse('2024-01-01') == '2024-01-01 00:00:00'
+        assert parse('2024-01-01', end=True) == '2024-01-01 23:59:59'
+        assert parse('20240101', end=True) == '2024-01-01 23:59:59'
+        assert parse('2024-01-01T10:00:00') == '2024-01-01 10:00:00'
+        assert parse('2024-01-01T10:00:00+02:00') == '2024-01-01 08:00:00'
+        assert parse('2024-01-01 01:30:00-05:00') == '2024-01-01 06:30:00'
+
+        with app.app_context():
+            db = get_db()
+            db.executemany('INSERT INTO history (message, result, timestamp) VALUES (?, ?, ?)',
+                           [('early', '✅ NOT SPAM', '2024-01-01 07:00:00'), ('late', '✅ NOT SPAM', '2024-01-01 09:00:00')])
+            db.commit()
+        # "T" and offset forms filter the same rows as the stored format
+        for start in ('2024-01-01T08:00:00', '2024-01-01T10:00:00+02:00', '2024-01-01 08:00:00'):
+            lines = self.client.get('/export_csv', query_string={'start': start}).get_data(as_text=True).strip().splitlines()
+            assert [l.split(',')[1] for l in lines[1:]] == ['late'], start
+
+    def test_result_reports_version_that_scored(self):
+        # The global is only updated on swap; the response must come from the predictor used
+        saved, app_module.model_version = app_module.model_version, "stale"
+        try:
+            data = self.client.post('/api/predict', json={'message': 'Lunch at noon?'}).get_json()
+            assert data['model_version'] == app_module.predictor.version
+            data = self.client.post('/api/predict/batch', json={'messages': ['Lunch at noon?']}).get_json()
+            assert data['results'][0]['model_version'] == app_module.predictor.version
+        finally:
+            app_module.model_version = saved
+
+    def test_prediction_cache(self):
+        msg = "FREE entry! Text WIN to 80086 now"
+        first = self.client.post('/api/predict', json={'message': msg}).get_json()
+        hits = prediction_cache.hits
+        second = self.client.post('/api/predict', json={'message': msg}).get_json()
+        assert prediction_cache.hits == hits + 1
+        assert first == second
+
+        # Reloading the model drops every cached prediction
+        app_module.load_model()
+        assert len(prediction_cache) == 0
+        assert self.client.post('/api/predict', json={'message': msg}).get_json() == first
+
+    def test_history_write_behind(self):
+        app.config['HISTORY_WRITE_BEHIND'] = True
+        # Long interval so only the explicit flush below writes (thread restarts on submit)
+        interval, history_writer.flush_interval = history_writer.flush_interval, 60
+        history_writer.stop()
+        try:
+            written = history_writer.written
+            for i in range(3):
+                self.client.post('/', data={'message': f'Queued {i}', 'source': 'SMS'})
+
+            # Nothing committed on the request path...
+            with app.app_context():
+                assert get_db().execute('SELECT COUNT(*) FROM history').fetchone()[0] == 0
+
+            # ...until the writer flushes, as one grouped transaction
+            history_writer.flush()
+            assert history_writer.written == written + 3
+            assert history_writer.depth() == 0
+            with app.app_context():
+                db = get_db()
+                assert db.execute('SELECT COUNT(*) FROM history').fetchone()[0] == 3
+                assert load_stats(db)['total'] == 3
+        finally:
+            app.config['HISTORY_WRITE_BEHIND'] = False
+            history_writer.flush_interval = interval
+            history_writer.stop()
+
+    def test_write_behind_page_shows_own_row(self):
+        app.config['HISTORY_WRITE_BEHIND'] = True
+        interval, history_writer.flush_interval = history_writer.flush_interval, 60
+        history_writer.stop()
+        try:
+            self.client.post('/', data={'message': 'Earlier message, already saved', 'source': 'SMS'})
+            history_writer.flush()
+            rv = self.client.post('/', data={'message': 'Queued but not written yet', 'source': 'SMS'})
+            page = rv.get_data(as_text=True)
+            # The new row is rendered first, without a delete form until it has an id
+            assert page.index('Queued but not written yet') < page.index('Earlier message, already saved')
+            assert page.count('/delete_history/') == 1
+
+            # Once written it is shown once, from the table
+            history_writer.flush()
+            page = self.client.get('/').get_data(as_text=True)
+            assert page.count('Queued but not written yet') == 2   # title attribute + cell
+            assert page.count('/delete_history/') == 2
+
+            # A full queue falls back to a synchronous write
+            history_writer.max_queue = 0
+            self.client.post('/', data={'message': 'Written by the request', 'source': 'SMS'})
+            with app.app_context():
+                assert get_db().execute('SELECT COUNT(*) FROM history').fetchone()[0] == 3
+        finally:
+            history_writer.max_queue = 10000
+            app.config['HISTORY_WRITE_BEHIND'] = False
+            history_writer.flush_interval = interval
+            history_writer.stop()
+
+    def test_metrics_endpoint(self):
+        stages = app_module.STAGE_SECONDS
+        before = stages.count('index', 'render'), stages.count('api_predict', 'score_one')
+        prediction_cache.clear()
+        self.client.post('/', data={'message': 'Visit http://claim-prize.xyz to WIN cash', 'source': 'SMS'})
+        self.client.post('/api/predict', json={'message': 'Lunch at noon tomorrow?'})
+
+        assert stages.count('index', 'render') == before[0] + 1
+        assert stages.count('api_predict', 'score_one') == before[1] + 1
+        for name in ('override', 'rules', 'urls', 'score_one', 'history_insert',
+                     'history_page', 'feedback_page', 'render'):
+            assert stages.count('index', name) > 0, name
+
+        rv = self.client.get('/metrics')
+        assert rv.status_code == 200 and rv.mimetype == 'text/plain'
+        body = rv.get_data(as_text=True)
+        assert '# TYPE spam_stage_duration_seconds histogram' in body
+        assert 'spam_stage_duration_seconds_bucket{endpoint="index",stage="urls",le="+Inf"}' in body
+        assert 'spam_requests_total{endpoint="api_predict",method="POST",status="200"}' in body
+        assert 'spam_history_queue_depth ' in body
+        assert '# TYPE spam_history_write_errors_total counter' in body
+
+    def test_search(self):
+        for msg, source in [('Claim your prize at http://win-prize.xyz today', 'SMS'),
+                            ('Prize draw results: visit win-prize.xyz', 'Email'),
+                            ('Are we still on for dinner tonight?', 'SMS'),
+                            ('Free prize prize prize, claim now', 'SMS')]:
+            self.client.post('/', data={'message': msg, 'source': source})
+        self.client.post('/feedback', data={'message': 'Your prize voucher expires', 'user_label': 'SPAM'})
+
+        # Phrase over URL tokens, ranked
+        data = self.client.get('/api/search?q="win-prize.xyz"').get_json()
+        assert {i['source'] for i in data['items']} == {'SMS', 'Email'}
+        assert all('[' in i['snippet'] for i in data['items'])
+        assert data['next_cursor'] is None
+
+        # Filters combine with the match
+        data = self.client.get('/api/search?q=prize&source=SMS&result=spam').get_json()
+        assert all(i['source'] == 'SMS' and i['result'] == '🚫 SPAM' for i in data['items'])
+        data = self.client.get('/api/search?q=prize&start=2000-01-01&end=2000-12-31').get_json()
+        assert data['items'] == []
+
+        # Ranked pages by offset, newest pages by id
+        page1 = self.client.get('/api/search?q=prize&limit=2').get_json()
+        page2 = self.client.get(f"/api/search?q=prize&limit=2&cursor={page1['next_cursor']}").get_json()
+        assert len(page1['items']) == 2 and len(page2['items']) == 1
+        assert page1['items'][0]['score'] >= page1['items'][1]['score']
+        newest = self.client.get('/api/search?q=prize&sort=newest&limit=2').get_json()
+        ids = [i['id'] for i in newest['items']]
+        older = self.client.get(f"/api/search?q=prize&sort=newest&limit=2&cursor={newest['next_cursor']}").get_json()
+        assert ids == sorted(ids, reverse=True) and older['items'][0]['id'] < ids[-1]
+
+        # Matches past the rank window are flagged, and reachable newest-first
+        assert page1['truncated'] is False and page1['older_cursor'] is None
+        app_module.SEARCH_RANK_WINDOW = 2
+        try:
+            ranked = self.client.get('/api/search?q=prize').get_json()
+        finally:
+            app_module.SEARCH_RANK_WINDOW = 5000
+        assert ranked['truncated'] is True and ranked['rank_window'] == 2 and len(ranked['items']) == 2
+        rest = self.client.get(f"/api/search?q=prize&sort=newest&cursor={ranked['older_cursor']}").get_json()
+        assert len(rest['items']) == 1 and rest['items'][0]['id'] < min(i['id'] for i in ranked['items'])
+        assert 'truncated' not in rest
+
+        # Prefix terms, feedback table, FTS5 syntax is literal
+        assert len(self.client.get('/api/search?q=priz*').get_json()['items']) == 3
+        data = self.client.get('/api/search?q=voucher&table=feedback&result=spam').get_json()
+        assert [i['user_label'] for i in data['items']] == ['SPAM']
+        assert self.client.get('/api/search?q=prize NEAR dinner').get_json()['items'] == []
+
+        # Deleted rows drop out of the index
+        with app.app_context():
+            row_id = get_db().execute("SELECT id FROM history WHERE message LIKE 'Are we%'").fetchone()[0]
+        assert len(self.client.get('/api/search?q=dinner').get_json()['items']) == 1
+        self.client.post(f'/delete_history/{row_id}')
+        assert self.client.get('/api/search?q=dinner').get_json()['items'] == []
+
+        for query in ('', 'q=%22%22', 'q=prize&table=users', 'q=prize&sort=old',
+                      'q=prize&table=feedback&source=SMS', 'q=prize&cursor=abc'):
+            assert self.client.get(f'/api/search?{query}').status_code == 400, query
+
+    def test_search_index_backfilled_for_existing_database(self):
+        with app.app_context():
+            db = get_db()
+            db.execute("INSERT INTO history (message, source, result) VALUES ('Legacy lottery winner', 'SMS', '🚫 SPAM')")
+            for trigger in ('insert', 'delete', 'update'):
+                db.execute(f'DROP TRIGGER history_fts_{trigger}')
+            db.execute('DROP TABLE history_fts')
+            db.execute("INSERT INTO history (message, source, result) VALUES ('Older lottery row', 'SMS', '🚫 SPAM')")
+            db.commit()
+        init_db()
+        data = self.client.get('/api/search?q=lottery').get_json()
+        assert len(data['items']) == 2
+
+    def test_history_linked_to_campaigns_for_existing_database(self):
+        message = 'Claim your reward voucher now at http://x.xyz before it expires'
+        self.client.post('/', data={'message': message, 'source': 'SMS'})
+        with app.app_context():
+            db = get_db()
+            campaign_id = db.execute('SELECT campaign_id FROM history').fetchone()[0]
+            assert campaign_id is not None
+            db.execute('ALTER TABLE history DROP COLUMN campaign_id')
+            db.commit()
+        init_db()
+        with app.app_context():
+            assert get_db().execute('SELECT campaign_id FROM history').fetchone()[0] == campaign_id
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,116 @@
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from artifacts import CompactModel, FastScorer, SklearnModel, compact_path, export_compact, load_predictor
+from bench_rules import load_messages
+
+class CompactModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.sk = SklearnModel.from_pickles("model/spam_model.pkl", "model/vectorizer.pkl")
+        export_compact(self.sk.vectorizer, self.sk.model, self.out_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_matches_sklearn_on_dataset(self):
+        messages = load_messages("dataset/spam.csv")
+        compact = CompactModel(self.out_dir)
+        assert list(compact.classes_) == list(self.sk.classes_)
+        np.testing.assert_allclose(compact.predict_proba(messages), self.sk.predict_proba(messages), atol=1e-9)
+
+    def test_lazy_memory_mapped_load(self):
+        compact = load_predictor("missing.pkl", "missing.pkl", self.out_dir)
+        assert isinstance(compact, CompactModel)
+        assert not compact.loaded
+        compact.predict_proba(["hello"])
+        assert compact.loaded
+        assert isinstance(compact._arrays["feature_log_prob"], np.memmap)
+
+    def test_unknown_and_empty_messages(self):
+        compact = CompactModel(self.out_dir)
+        messages = ["", "zzzzqqqq " * 3, "x" * 500]
+        np.testing.assert_allclose(compact.predict_proba(messages), self.sk.predict_proba(messages), atol=1e-9)
+
+    def test_reexport_publishes_new_version_without_touching_mapped_files(self):
+        old = CompactModel(self.out_dir)
+        messages = ["WINNER! Claim your free prize now", "See you at lunch"]
+        before = old.predict_proba(messages)
+        old_files = {f: os.stat(os.path.join(old.path, f)).st_ino for f in os.listdir(old.path)}
+
+        changed = copy.deepcopy(self.sk.model)
+        changed.class_log_prior_ = changed.class_log_prior_[::-1].copy()
+        meta = export_compact(self.sk.vectorizer, changed, self.out_dir)
+
+        # The mapped model still reads its own, unchanged files
+        np.testing.assert_array_equal(old.predict_proba(messages), before)
+        assert {f: os.stat(os.path.join(old.path, f)).st_ino for f in os.listdir(old.path)} == old_files
+        new = CompactModel(self.out_dir)
+        assert new.version == meta["version"] != old.version
+        assert compact_path(self.out_dir) == new.path != old.path
+
+        # Re-exporting the same content reuses its directory; old versions are pruned
+        export_compact(self.sk.vectorizer, changed, self.out_dir, keep=1)
+        assert compact_path(self.out_dir) == new.path
+        assert sorted(d for d in os.listdir(self.out_dir) if d.startswith("v-")) == [os.path.basename(new.path)]
+
+    def test_published_files_readable_by_other_users(self):
+        version_dir = compact_path(self.out_dir)
+        assert os.stat(version_dir).st_mode & 0o777 == 0o755
+        assert os.stat(os.path.join(self.out_dir, "CURRENT")).st_mode & 0o777 == 0o644
+
+    def test_export_without_idf(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        messages = load_messages("dataset/spam.csv")[:1000]
+        vectorizer = TfidfVectorizer(use_idf=False)
+        model = MultinomialNB().fit(vectorizer.fit_transform(messages), ["spam" if "free" in m.lower() else "ham" for m in messages])
+        out_dir = tempfile.mkdtemp()
+        try:
+            export_compact(vectorizer, model, out_dir)
+            np.testing.assert_allclose(CompactModel(out_dir).predict_proba(messages),
+                                       model.predict_proba(vectorizer.transform(messages)), atol=1e-9)
+        finally:
+            shutil.rmtree(out_dir)
+
+class FastScorerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sk = SklearnModel.from_pickles("model/spam_model.pkl", "model/vectorizer.pkl")
+        self.messages = load_messages("dataset/spam.csv") + ["", "zzzzqqqq " * 3, "free free FREE win"]
+
+    def assert_parity(self, score_one, vectorizer, model):
+        expected = model.predict_proba(vectorizer.transform(self.messages))
+        labels = model.predict(vectorizer.transform(self.messages))
+        for message, probs, label in zip(self.messages, expected, labels):
+            fast_label, fast_probs = score_one(message)
+            assert fast_label == label, message
+            np.testing.assert_allclose(fast_probs, probs, rtol=0, atol=1e-12)
+
+    def test_parity_with_sklearn_on_dataset(self):
+        self.assert_parity(self.sk.score_one, self.sk.vectorizer, self.sk.model)
+
+    def test_parity_from_compact_export(self):
+        out_dir = tempfile.mkdtemp()
+        try:
+            export_compact(self.sk.vectorizer, self.sk.model, out_dir)
+            self.assert_parity(CompactModel(out_dir).score_one, self.sk.vectorizer, self.sk.model)
+        finally:
+            shutil.rmtree(out_dir)
+
+    def test_vectorizer_settings(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        labelled = [(m, "spam" if "free" in m.lower() or "win" in m.lower() else "ham") for m in self.messages[:2000]]
+        for params in ({"ngram_range": (1, 2), "sublinear_tf": True},
+                       {"binary": True, "norm": "l1", "stop_words": None},
+                       {"use_idf": False, "norm": None, "lowercase": False}):
+            vectorizer = TfidfVectorizer(**params)
+            model = MultinomialNB().fit(vectorizer.fit_transform([m for m, _ in labelled]), [y for _, y in labelled])
+            self.messages = [m for m, _ in labelled[:500]]
+            self.assert_parity(FastScorer.from_sklearn(vectorizer, model).predict, vectorizer, model)
+
+if __name__ == '__main__':
+    unittest.main()
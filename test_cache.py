@@ -0,0 +1,26 @@
+import time
+import unittest
+from cache import LRUCache, MISSING
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_size_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        # 'b' was least recently used
+        assert cache.get('b') is MISSING
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
+
+    def test_ttl_expiry(self):
+        cache = LRUCache(maxsize=10, ttl=0.05)
+        cache.set('a', None)
+        assert cache.get('a') is None
+        time.sleep(0.06)
+        assert cache.get('a') is MISSING
+        assert len(cache) == 0
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from campaigns import MinHashLSH
+
+TEMPLATE = "Hi {name}, you have won a {amount} prize! Call {phone} now or visit {url} to claim. T&C apply"
+
+class MinHashLSHTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lsh = MinHashLSH()
+
+    def variant(self, name, amount, phone, url):
+        return TEMPLATE.format(name=name, amount=amount, phone=phone, url=url)
+
+    def test_variants_share_band_keys(self):
+        a = self.lsh.signature(self.variant("John", "£1000", "09061701461", "http://win.xyz/abc"))
+        b = self.lsh.signature(self.variant("Mary", "£2000", "09061709999", "www.claim-now.top/q"))
+        assert self.lsh.similarity(a, b) >= 0.6
+        assert set(self.lsh.band_keys(a)) & set(self.lsh.band_keys(b))
+
+    def test_unrelated_messages_differ(self):
+        a = self.lsh.signature(self.variant("John", "£1000", "09061701461", "http://win.xyz/abc"))
+        c = self.lsh.signature("Are we still meeting for lunch tomorrow at the usual place?")
+        assert self.lsh.similarity(a, c) < 0.2
+        assert not set(self.lsh.band_keys(a)) & set(self.lsh.band_keys(c))
+
+    def test_masks_variable_parts(self):
+        tokens = self.lsh.tokens("Mail bob@x.com or call 0800 123 456 at http://a.b/c, curl numbers")
+        assert tokens == ["mail", "_email_", "or", "call", "_num_", "at", "_url_", "curl", "numbers"]
+
+    def test_short_messages_not_clustered(self):
+        assert self.lsh.signature("ok see you") is None
+        assert self.lsh.signature("") is None
+
+    def test_deterministic_and_serializable(self):
+        msg = self.variant("John", "£1000", "09061701461", "http://win.xyz/abc")
+        sig = self.lsh.signature(msg)
+        assert (MinHashLSH().signature(msg) == sig).all()
+        assert (MinHashLSH.from_bytes(MinHashLSH.to_bytes(sig)) == sig).all()
+        keys = self.lsh.band_keys(sig)
+        assert len(keys) == self.lsh.bands and all(-2 ** 63 <= k < 2 ** 63 for k in keys)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from db_pool import ConnectionPool
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.path = tempfile.mkstemp()
+        self.pool = ConnectionPool(self.path, size=2)
+        with self.pool.connection() as db:
+            db.execute('CREATE TABLE t (x INTEGER)')
+            db.commit()
+
+    def tearDown(self):
+        self.pool.close()
+        os.close(self.db_fd)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+
+    def test_pragmas_and_reuse(self):
+        with self.pool.connection() as db:
+            assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert db.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+            first = db
+        with self.pool.connection() as db:
+            assert db is first
+        assert self.pool.created == 1
+
+    def test_reads_run_alongside_uncommitted_write(self):
+        writer = self.pool.acquire()
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute('INSERT INTO t VALUES (1)')
+
+        # A second connection reads the last committed snapshot without waiting
+        with self.pool.connection() as reader:
+            assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+        writer.commit()
+        self.pool.release(writer)
+        with self.pool.connection() as reader:
+            assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+
+    def test_release_rolls_back_and_caps_idle(self):
+        conns = [self.pool.acquire() for _ in range(3)]
+        conns[0].execute('INSERT INTO t VALUES (2)')
+        for c in conns:
+            self.pool.release(c)
+        assert self.pool.stats()['idle'] == 2
+        with self.pool.connection() as db:
+            assert db.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import threading
+import time
+import unittest
+from history_writer import HistoryWriter
+
+class HistoryWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def apply(self, database, rows):
+        with self.lock:
+            self.batches.append((database, list(rows)))
+
+    def test_size_threshold_triggers_grouped_flush(self):
+        writer = HistoryWriter(self.apply, flush_size=5, flush_interval=10)
+        for i in range(5):
+            writer.submit('db', i)
+        deadline = time.time() + 2
+        while not self.batches and time.time() < deadline:
+            time.sleep(0.01)
+        writer.stop()
+        assert self.batches == [('db', [0, 1, 2, 3, 4])]
+        assert writer.stats()['flushes'] == 1
+
+    def test_time_threshold_and_clean_shutdown(self):
+        writer = HistoryWriter(self.apply, flush_size=1000, flush_interval=0.02)
+        writer.submit('a', 1)
+        writer.submit('b', 2)
+        time.sleep(0.1)
+        writer.submit('a', 3)
+        writer.stop()
+        rows = sorted(r for _, batch in self.batches for r in batch)
+        assert rows == [1, 2, 3]
+        assert writer.stats()['queue_depth'] == 0
+        assert writer.stats()['max_queue_depth'] >= 2
+
+    def test_failed_flush_keeps_rows(self):
+        calls = []
+        def flaky(database, rows):
+            calls.append(rows)
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+        writer = HistoryWriter(flaky, flush_size=1000, flush_interval=10)
+        writer.submit('db', 1)
+        writer.submit('db', 2)
+        assert writer.flush() == 0
+        assert writer.depth() == 2 and writer.stats()['errors'] == 1
+        assert writer.flush() == 2
+        assert calls[-1] == [1, 2]
+        writer.stop()
+
+    def test_full_queue_refuses_and_failing_rows_are_dropped(self):
+        def stuck(database, rows):
+            raise RuntimeError("disk I/O error")
+        writer = HistoryWriter(stuck, flush_size=1000, flush_interval=10, max_queue=3, max_attempts=2)
+        assert all(writer.submit('db', i) for i in range(3))
+        assert not writer.submit('db', 3)
+        assert writer.pending('db') == [0, 1, 2] and writer.pending('other') == []
+
+        assert writer.flush() == 0 and writer.depth() == 3
+        assert writer.flush() == 0 and writer.depth() == 0
+        stats = writer.stats()
+        assert stats['rejected'] == 1 and stats['dropped'] == 3 and stats['errors'] == 2
+        writer.stop()
+
+    def test_one_failing_database_does_not_rewrite_another(self):
+        def apply(database, rows):
+            if database == 'bad':
+                raise RuntimeError("database is locked")
+            self.apply(database, rows)
+        writer = HistoryWriter(apply, flush_size=1000, flush_interval=10)
+        writer.submit('good', 1)
+        writer.submit('bad', 2)
+        assert writer.flush() == 1
+        assert writer.flush() == 0
+        assert self.batches == [('good', [1])] and writer.pending('bad') == [2]
+        writer.stop()
+
+if __name__ == '__main__':
+    unittest.main()
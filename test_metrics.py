@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from metrics import MetricsRegistry, SamplingProfiler
+
+class MetricsTestCase(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        h = registry.histogram("latency_seconds", "Latency.", ["stage"], buckets=(0.01, 0.1))
+        for value in (0.005, 0.05, 0.05, 3.0):
+            h.observe(value, "predict")
+        with h.time("render"):
+            pass
+
+        lines = registry.render().splitlines()
+        assert lines[:2] == ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"]
+        assert 'latency_seconds_bucket{stage="predict",le="0.01"} 1' in lines
+        assert 'latency_seconds_bucket{stage="predict",le="0.1"} 3' in lines
+        assert 'latency_seconds_bucket{stage="predict",le="+Inf"} 4' in lines
+        assert 'latency_seconds_sum{stage="predict"} 3.105' in lines
+        assert 'latency_seconds_count{stage="predict"} 4' in lines
+        assert h.count("render") == 1 and h.count("missing") == 0
+
+    def test_counter_gauge_and_label_escaping(self):
+        registry = MetricsRegistry()
+        c = registry.counter("requests_total", "Requests.", ["path"])
+        c.inc('/a"b\\c')
+        c.inc('/a"b\\c', amount=2)
+        registry.gauge("depth", "Queue depth.", lambda: 7)
+        registry.gauge("broken", "Raises.", lambda: 1 / 0)
+
+        body = registry.render()
+        assert 'requests_total{path="/a\\"b\\\\c"} 3' in body
+        assert "depth 7" in body
+        assert "# TYPE broken gauge" in body and "\nbroken " not in body
+
+    def test_multiprocess_totals_summed_across_workers(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        registry = MetricsRegistry(directory)
+        c = registry.counter("requests_total", "Requests.", ["path"])
+        h = registry.histogram("x_seconds", "X.", buckets=(0.1,))
+        registry.gauge("depth", "Queue depth.", lambda: 7)
+        c.inc("/")
+        h.observe(0.05)
+        registry.write_snapshot()
+
+        pid = os.fork()
+        if pid == 0:
+            # A worker: starts from zero, reports its own work, then exits
+            c.inc("/", amount=2)
+            h.observe(1.0)
+            registry.write_snapshot()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        exited = [f for f in os.listdir(directory) if f.startswith(f"metrics-{pid}-")]
+        shutil.copy(os.path.join(directory, exited[0]), os.path.join(directory, "exited.bak"))
+
+        body = registry.render()
+        assert 'requests_total{path="/"} 3' in body
+        assert 'x_seconds_bucket{le="0.1"} 1' in body and 'x_seconds_count 2' in body
+        # Gauges only for live processes
+        assert f'depth{{pid="{os.getpid()}"}} 7' in body and f'pid="{pid}"' not in body
+        assert c.value("/") == 1
+
+        # The exited worker's file was folded into the aggregate and removed; totals hold
+        assert len([f for f in os.listdir(directory) if f.startswith("metrics-")]) == 1
+        # Crash after the aggregate was written but before the file was deleted: not counted twice
+        shutil.copy(os.path.join(directory, "exited.bak"), os.path.join(directory, exited[0]))
+        assert registry.render() == body
+        assert not os.path.exists(os.path.join(directory, exited[0]))
+
+    def test_histogram_thread_safe(self):
+        registry = MetricsRegistry()
+        h = registry.histogram("x_seconds", "X.")
+
+        def work():
+            for _ in range(1000):
+                h.observe(0.001)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert h.count() == 4000
+
+    def test_profiler_collects_collapsed_stacks(self):
+        profiler = SamplingProfiler(interval=0.001)
+        stop = threading.Event()
+
+        def busy_loop():
+            while not stop.is_set():
+                sum(range(1000))
+
+        worker = threading.Thread(target=busy_loop)
+        worker.start()
+        profiler.start()
+        try:
+            time.sleep(0.1)
+        finally:
+            profiler.stop()
+            stop.set()
+            worker.join()
+
+        assert not profiler.status()["running"] and profiler.samples > 0
+        assert "busy_loop" in profiler.collapsed()
+        assert any("busy_loop" in frame for frame, _ in profiler.top_functions())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+from online import HashingModel, OnlineTrainer
+from registry import ModelRegistry
+
+class OnlineTrainerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import csv
+        with open("dataset/spam.csv", encoding="latin-1", newline="") as f:
+            rows = [(r[1], r[0]) for r in csv.reader(f) if len(r) > 1 and r[0] in ("ham", "spam")]
+        cls.base = HashingModel.train([m for m, _ in rows], [y for _, y in rows])
+        cls.holdout = rows[::50]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.registry = ModelRegistry(None, None, None, holdout=self.holdout)
+        self.registry.publish(self.base)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def spam_prob(self, model, message):
+        return model.predict_proba([message])[0][list(model.classes_).index("spam")]
+
+    def test_feedback_shifts_model_and_publishes_new_version(self):
+        path = os.path.join(self.dir, "online_model.pkl")
+        trainer = OnlineTrainer(self.base, self.registry, path, batch_size=8)
+        msg = "Quarterly zorblax voucher for loyal members"
+        before = self.spam_prob(self.base, msg)
+
+        for _ in range(5):
+            trainer.submit(msg, "SPAM")
+        assert trainer.flush() == 5
+
+        active = self.registry.active
+        assert active is trainer.model and active.version != self.base.version
+        assert active.updates == 5
+        assert self.spam_prob(active, msg) > before
+        # Published copy on disk round-trips to the same version
+        assert HashingModel.load(path).version == active.version
+
+    def test_rejected_batch_keeps_current_model(self):
+        trainer = OnlineTrainer(self.base, self.registry, batch_size=4000)
+        self.registry.min_accuracy = 1.01
+        trainer.submit("anything", "SPAM")
+        trainer.flush()
+        assert self.registry.active is self.base
+        assert trainer.rejected == 1 and "below" in trainer.last_error
+
+    def test_background_thread_applies_batches(self):
+        trainer = OnlineTrainer(self.base, self.registry, batch_size=2, flush_interval=0.01)
+        trainer.start()
+        trainer.submit("hello friend", "NOT SPAM")
+        trainer.submit("cheap pills online", "SPAM")
+        trainer.stop()
+        assert trainer.pending() == 0
+        assert self.registry.active.updates == 2
+
+    def test_single_owner_applies_shared_examples_once(self):
+        # Two workers' trainers over one artifact and one shared example queue
+        path = os.path.join(self.dir, "online_model.pkl")
+        examples = []
+        source = lambda after_id, limit: [e for e in examples if e[0] > after_id][:limit]
+        other_registry = ModelRegistry(None, None, None, holdout=self.holdout)
+        other_registry.publish(self.base)
+        first = OnlineTrainer(self.base, self.registry, path, batch_size=8, source=source)
+        second = OnlineTrainer(self.base, other_registry, path, batch_size=8, source=source)
+        try:
+            assert first.is_owner() and not second.is_owner()
+            examples.extend((i + 1, "Quarterly zorblax voucher", "SPAM") for i in range(3))
+            assert first.pull() == 3 and first.pull() == 0
+            assert os.stat(path).st_mode & 0o777 == 0o644
+
+            # The other worker only reloads the owner's artifact
+            assert second.sync()
+            assert other_registry.active.version == self.registry.active.version
+            assert second.model.updates == 3 and second.model.last_id == 3
+
+            # Owner gone: the next one takes over from the published artifact
+            first.stop()
+            assert second.is_owner()
+            examples.append((4, "Lunch at noon?", "NOT SPAM"))
+            assert second.pull() == 1 and second.model.updates == 4
+        finally:
+            first.stop()
+            second.stop()
+
+if __name__ == '__main__':
+    unittest.main()
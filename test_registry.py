@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from artifacts import CompactModel, SklearnModel, export_compact
+from registry import ModelRegistry
+
+HOLDOUT = [("WINNER!! Claim your free cash prize now, call 09061701461", "spam"), ("Ok see you at home later", "ham")]
+
+class ModelRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.model_path = os.path.join(self.dir, "spam_model.pkl")
+        self.vectorizer_path = os.path.join(self.dir, "vectorizer.pkl")
+        shutil.copy("model/spam_model.pkl", self.model_path)
+        shutil.copy("model/vectorizer.pkl", self.vectorizer_path)
+        self.swaps = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_registry(self, holdout=HOLDOUT):
+        return ModelRegistry(self.model_path, self.vectorizer_path, None, holdout=holdout, on_swap=self.swaps.append)
+
+    def test_load_validates_and_swaps(self):
+        registry = self.make_registry()
+        active = registry.load()
+        assert registry.active is active and self.swaps == [active]
+        assert registry.status()['holdout_accuracy'] == 1.0
+
+    def test_concurrent_async_reloads_start_one(self):
+        registry = self.make_registry()
+        registry.load()
+        started = threading.Event()
+        release = threading.Event()
+        load = registry.load
+        registry.load = lambda: (started.set(), release.wait(5), load())
+
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(registry.reload_async())) for _ in range(8)]
+        for t in callers:
+            t.start()
+        for t in callers:
+            t.join()
+        assert sorted(results) == [False] * 7 + [True]
+        assert started.wait(5)
+        release.set()
+        for _ in range(100):
+            if registry.reload_async():
+                break
+            time.sleep(0.05)
+        else:
+            self.fail("reload_async stayed busy after the reload finished")
+
+    def test_failed_validation_keeps_current_model(self):
+        registry = self.make_registry()
+        current = registry.load()
+        registry.holdout = [(m, "ham" if y == "spam" else "spam") for m, y in HOLDOUT]
+        with self.assertRaises(ValueError):
+            registry.load()
+        assert registry.active is current
+        assert "below" in registry.status()['last_error']
+
+    def test_watcher_reloads_changed_artifacts(self):
+        registry = self.make_registry()
+        first = registry.load()
+        registry.start_watcher(0.02)
+        os.utime(self.model_path, ns=(time.time_ns() + 10**9,) * 2)
+
+        deadline = time.time() + 5
+        while registry.active is first and time.time() < deadline:
+            time.sleep(0.02)
+        registry.stop_watcher()
+        assert registry.active is not first
+        # Same bytes, same content version
+        assert registry.version == first.version
+
+    def test_watcher_reloads_new_compact_version(self):
+        compact_dir = os.path.join(self.dir, "compact")
+        sk = SklearnModel.from_pickles(self.model_path, self.vectorizer_path)
+        export_compact(sk.vectorizer, sk.model, compact_dir)
+        registry = ModelRegistry(self.model_path, self.vectorizer_path, compact_dir, holdout=HOLDOUT)
+        first = registry.load()
+        assert isinstance(first, CompactModel)
+        first.predict_proba(["mapped now"])
+
+        registry.start_watcher(0.02)
+        sk.model.class_log_prior_ = sk.model.class_log_prior_ + [0.0, -0.01]
+        export_compact(sk.vectorizer, sk.model, compact_dir)
+        deadline = time.time() + 5
+        while registry.active is first and time.time() < deadline:
+            time.sleep(0.02)
+        registry.stop_watcher()
+        assert registry.active.path != first.path and registry.version != first.version
+        # The previous version's mapping is still intact
+        first.predict_proba(["still mapped"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import csv
+import fcntl
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import app as app_module
+from app import app, init_db, get_db, load_stats, rebuild_stats, daily_activity, make_archiver, record_history
+
+class RetentionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        app.config['TESTING'] = True
+        app.config['HISTORY_WRITE_BEHIND'] = False
+        self.archive_dir = tempfile.mkdtemp()
+        self.client = app.test_client()
+        init_db()
+
+    def tearDown(self):
+        shutil.rmtree(self.archive_dir)
+        os.close(self.db_fd)
+        os.unlink(app.config['DATABASE'])
+
+    def seed(self):
+        old = [('2020-01-01 09:15:00', 'URGENT! You won a cash prize, call now', '🚫 SPAM', 'SMS'),
+               ('2020-01-01 09:45:00', 'See you at lunch', '✅ NOT SPAM', 'Email'),
+               ('2020-01-01 17:05:00', 'Verify your bank account password at http://x.xyz', '🚫 SPAM', 'SMS'),
+               ('2020-01-02 08:00:00', 'Happy new year!', '✅ NOT SPAM', 'SMS'),
+               ('2020-01-03 10:30:00', 'Free entry to win a prize', '🚫 SPAM', 'WhatsApp')]
+        with app.app_context():
+            db = get_db()
+            for ts, msg, result, source in old:
+                entry = ((msg, source, result, '90.00%', ts), app_module.history_stat_keys(msg, result, ts))
+                app_module.write_history(db, [entry])
+            record_history(db, 'A fresh message from today', 'SMS', '✅ NOT SPAM', '5.00%')
+            db.commit()
+        return old
+
+    def test_archives_rolls_up_and_keeps_dashboard(self):
+        old = self.seed()
+        with app.app_context():
+            before = load_stats(get_db())
+
+        archiver = make_archiver(30, self.archive_dir, batch_size=2)
+        assert archiver.run() == len(old)
+        assert archiver.batches == 3 and archiver.last_error is None
+
+        with app.app_context():
+            db = get_db()
+            assert [r['message'] for r in db.execute('SELECT message FROM history')] == ['A fresh message from today']
+            # The archived rows' campaigns are gone, band keys included
+            assert [r['sample'] for r in db.execute('SELECT sample FROM campaigns')] == ['A fresh message from today']
+            assert db.execute('SELECT COUNT(DISTINCT campaign_id) FROM campaign_bands').fetchone()[0] == 1
+            # Counters untouched, and a rebuild from rollups + live rows gives the same numbers
+            assert load_stats(db) == before
+            rebuild_stats(db)
+            assert load_stats(db) == before
+
+            rollups = {(r['period'], r['bucket'], r['name']): r['count'] for r in db.execute('SELECT * FROM history_rollups')}
+            assert rollups[('day', '2020-01-01', 'total')] == 3
+            assert rollups[('day', '2020-01-01', 'spam')] == 2
+            assert rollups[('hour', '2020-01-01 09:00:00', 'total')] == 2
+            assert rollups[('day', '2020-01-01', 'source:SMS')] == 2
+            assert rollups[('day', '2020-01-01', 'result:ham')] == 1
+            assert any(k[2].startswith('category:') for k in rollups)
+
+        # Raw rows are in day partitions, readable as plain gzip CSV
+        files = sorted(glob.glob(os.path.join(self.archive_dir, 'history', 'date=*', '*.csv.gz')))
+        assert {os.path.basename(os.path.dirname(f)) for f in files} == {'date=2020-01-01', 'date=2020-01-02', 'date=2020-01-03'}
+        archived = []
+        for f in files:
+            with gzip.open(f, 'rt', newline='') as fh:
+                reader = csv.reader(fh)
+                assert next(reader) == ['id', 'message', 'source', 'result', 'probability', 'timestamp']
+                archived.extend(row[1] for row in reader)
+        assert sorted(archived) == sorted(m for _, m, _, _ in old)
+
+        # Nothing left to do on the next run
+        assert archiver.run() == 0
+
+    def test_activity_reads_rollups_for_archived_days(self):
+        self.seed()
+        make_archiver(30, self.archive_dir).run()
+        with app.app_context():
+            days = {d['day']: d for d in daily_activity(get_db(), 3650)}
+        assert days['2020-01-01'] == {'day': '2020-01-01', 'total': 3, 'spam': 2}
+        assert days['2020-01-03']['spam'] == 1
+        assert sum(d['total'] for d in days.values()) == 6
+
+        # The endpoint caps the window at a year; 2020 is outside it
+        data = self.client.get('/api/activity?days=3650').get_json()
+        assert [d['day'] for d in data['days']] == [max(days)]
+        assert self.client.get('/api/activity?days=abc').status_code == 400
+
+    def test_clear_history_clears_rollups(self):
+        self.seed()
+        make_archiver(30, self.archive_dir).run()
+        self.client.post('/clear_history')
+        with app.app_context():
+            db = get_db()
+            assert db.execute('SELECT COUNT(*) FROM history_rollups').fetchone()[0] == 0
+            assert load_stats(db)['total'] == 0
+
+    def test_failed_batch_keeps_rows(self):
+        self.seed()
+        archiver = make_archiver(30, self.archive_dir, batch_size=2)
+        with app.app_context():
+            db = get_db()
+            db.execute('DROP TABLE history_rollups')
+            db.commit()
+        assert archiver.run() == 0 and 'history_rollups' in archiver.last_error
+        with app.app_context():
+            assert get_db().execute('SELECT COUNT(*) FROM history').fetchone()[0] == 6
+
+    def test_archive_written_outside_the_delete_transaction(self):
+        self.seed()
+        archiver = make_archiver(30, self.archive_dir, batch_size=2)
+        write_archive = archiver._write_archive
+
+        def write_and_check(day, rows):
+            # Other writers are not blocked while the archive is written and fsynced
+            db = sqlite3.connect(app.config['DATABASE'], timeout=0)
+            db.execute("INSERT INTO stats (name, count) VALUES ('probe', 1) "
+                       "ON CONFLICT(name) DO UPDATE SET count = count + 1")
+            db.commit()
+            db.close()
+            write_archive(day, rows)
+
+        archiver._write_archive = write_and_check
+        assert archiver.run() == 5 and archiver.last_error is None
+
+        # Another worker holding the archive lock makes this one skip its turn
+        self.seed()
+        fd = os.open(os.path.join(self.archive_dir, '.archiver.lock'), os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            assert archiver.run_batch() == 0
+        finally:
+            os.close(fd)
+        assert archiver.run_batch() == 2
+
+    def test_admin_endpoint(self):
+        assert self.client.get('/admin/api/retention').status_code == 401
+        self.client.post('/login', data={'username': 'admin', 'password': '1234'})
+        assert self.client.get('/admin/api/retention').status_code == 404
+
+        self.seed()
+        app_module.archiver = make_archiver(30, self.archive_dir)
+        try:
+            status = self.client.post('/admin/api/retention').get_json()
+            assert status['archived_rows'] == 5 and status['files'] == 3
+        finally:
+            app_module.archiver = None
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+from bench_rules import legacy_analyze, load_messages
+from rules import RuleEngine
+
+class RuleEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = RuleEngine()
+
+    def test_matches_legacy_rules_on_dataset(self):
+        for message in load_messages("dataset/spam.csv"):
+            assert self.engine.analyze(message) == legacy_analyze(message), message
+
+    def test_overlapping_and_grouped_rules(self):
+        result = self.engine.analyze("WINNER!! Act now, verify at http://1.2.3.4/login.xyz")
+        # Financial wins the money group, so no Potential Scam tag
+        assert result['tags'] == ["💳 Financial Risk", "🚨 High Urgency", "🔗 Link Analysis"]
+        assert result['keywords'] == ["win", "winner", "verify"]
+        assert result['urls'][0]['risk_level'] == "CRITICAL"
+        assert result['urls'][0]['reasons'] == "Suspicious TLD, Suspicious Keyword, IP Address URL"
+
+    def test_no_hits(self):
+        assert self.engine.analyze("See you at lunch") == {"tags": [], "keywords": [], "urls": []}
+
+if __name__ == '__main__':
+    unittest.main()
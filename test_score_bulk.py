@@ -0,0 +1,91 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import score_bulk
+from score_bulk import input_encoding, main, read_chunks, score_chunk, score_stream
+
+MESSAGES = [
+    "WINNER!! You have won a free prize. Claim at http://win-prize.xyz now",
+    "Are we still meeting for lunch tomorrow?",
+    "URGENT: your bank account is blocked, verify your password immediately",
+    "Ok see you at home",
+    "Free entry in 2 a wkly comp to win FA Cup final tkts, text FA to 87121",
+]
+
+class BulkScoringTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_csv_chunks_bounded_and_ordered(self):
+        f = io.StringIO("id,message\n" + "".join(f"{i},msg {i}\n" for i in range(7)))
+        chunks = list(read_chunks(f, "csv", chunk_size=3))
+        assert [len(c) for c in chunks] == [3, 3, 1]
+        assert chunks[2] == [("6", "msg 6")]
+
+    def test_kaggle_csv_and_jsonl_input(self):
+        f = io.StringIO("v1,v2,,,\nham,hello there,,,\nspam,WIN cash,,,\n")
+        assert list(read_chunks(f, "csv")) == [[(1, "hello there"), (2, "WIN cash")]]
+
+        f = io.StringIO('{"id": "a", "text": "hi"}\n\n{"text": "yo"}\n')
+        assert list(read_chunks(f, "jsonl", text_column="text")) == [[("a", "hi"), (3, "yo")]]
+
+    def test_chunk_scoring_matches_single_messages(self):
+        score_bulk.init_scorer()
+        chunk = list(enumerate(MESSAGES))
+        batch = score_chunk(chunk)
+        assert [r["id"] for r in batch] == list(range(len(MESSAGES)))
+        for item in chunk:
+            assert score_chunk([item]) == [batch[item[0]]]
+        assert batch[0]["is_spam"] and batch[0]["tags"] and batch[0]["urls"]
+        assert not batch[1]["is_spam"] and batch[1]["tags"] == []
+
+    def test_process_pool_preserves_order(self):
+        chunks = [[(f"{n}-{i}", m) for i, m in enumerate(MESSAGES)] for n in range(6)]
+        serial = list(score_stream(iter(chunks), jobs=1))
+        parallel = list(score_stream(iter(chunks), jobs=2))
+        assert parallel == serial
+
+    def test_cli_writes_jsonl(self):
+        src = os.path.join(self.dir, "in.csv")
+        out = os.path.join(self.dir, "out.jsonl")
+        with open(src, "w", newline="") as f:
+            f.write("id,message\n" + "".join(f'{i},"{m}"\n' for i, m in enumerate(MESSAGES)))
+
+        assert main([src, out, "--chunk-size", "2"]) == 0
+        with open(out) as f:
+            rows = [json.loads(line) for line in f]
+        assert [r["id"] for r in rows] == [str(i) for i in range(len(MESSAGES))]
+        assert rows[0]["prediction"] == "spam" and rows[3]["prediction"] == "ham"
+
+    def test_utf8_input_by_default(self):
+        src = os.path.join(self.dir, "in.jsonl")
+        out = os.path.join(self.dir, "out.jsonl")
+        with open(src, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"id": "a", "message": "Café à 8h? 😊"}, ensure_ascii=False) + "\n")
+
+        assert input_encoding(src) == "utf-8"
+        assert input_encoding("dataset/spam.csv") == "latin-1"
+        assert input_encoding(src, "cp1252") == "cp1252"
+        assert main([src, out]) == 0
+        with open(out) as f:
+            assert json.loads(f.readline())["id"] == "a"
+        with open(src, encoding="utf-8") as f:
+            assert list(read_chunks(f, "jsonl")) == [[("a", "Café à 8h? 😊")]]
+
+    def test_stdin_and_stdout_left_open(self):
+        stdin = io.TextIOWrapper(io.BytesIO(b'{"id": "a", "message": "Ok see you at home"}\n'), encoding="utf-8")
+        stdout = io.StringIO()
+        with mock.patch("sys.stdin", stdin), mock.patch("sys.stdout", stdout):
+            assert main(["-", "-", "--input-format", "jsonl", "--output-format", "jsonl"]) == 0
+        assert not stdin.closed and not stdout.closed
+        assert json.loads(stdout.getvalue())["id"] == "a"
+
+if __name__ == "__main__":
+    unittest.main()
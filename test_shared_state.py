@@ -0,0 +1,235 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import app as app_module
+from app import app, init_db, get_db, load_stats, override_cache
+from shared_state import LocalState, RedisState, RespClient, RespError, make_state
+
+
+def start_server():
+    # The stand-in in its own process, on a free port
+    proc = subprocess.Popen([sys.executable, "-m", "resp_server", "--port", "0"], stdout=subprocess.PIPE,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), text=True)
+    host, port = proc.stdout.readline().split()[-1].rsplit(":", 1)
+    return proc, host, int(port)
+
+
+class RespClientTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.proc, cls.host, cls.port = start_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.proc.terminate()
+        cls.proc.wait()
+
+    def setUp(self):
+        self.client = RespClient(self.host, self.port, db=3)
+        self.client.execute("FLUSHDB")
+
+    def test_pipeline_is_one_round_trip(self):
+        before = self.client.round_trips
+        replies = self.client.pipeline([("HINCRBY", "h", f"k{i}", i) for i in range(100)] + [("HGETALL", "h")])
+        assert self.client.round_trips == before + 1
+        assert replies[5] == 5
+        assert dict(zip(replies[-1][::2], replies[-1][1::2]))["k99"] == "99"
+
+        # Large batches are chunked, still in order
+        replies = self.client.pipeline([("INCR", "n")] * 2500)
+        assert replies[-1] == 2500
+        assert self.client.execute("GET", "missing") is None
+        assert self.client.execute("HMGET", "h", "k1", "nope") == ["1", None]
+
+    def test_errors_and_databases(self):
+        self.client.execute("SET", "s", "text")
+        with self.assertRaises(RespError):
+            self.client.execute("INCR", "s")
+        with self.assertRaises(RespError):
+            self.client.execute("HGET", "s", "f")
+        # SELECT on connect: db 3 is separate from db 0
+        assert RespClient(self.host, self.port).execute("GET", "s") is None
+
+    def test_idle_socket_closed_by_server_is_replaced_before_sending(self):
+        self.client.execute("SET", "k", "v")
+        self.client._local.conn[1].shutdown(socket.SHUT_RDWR)
+        assert self.client.execute("GET", "k") == "v"
+
+    def test_commands_never_resent_after_a_failure(self):
+        # A server that takes the commands and drops the connection without replying
+        listener = socket.create_server(("127.0.0.1", 0))
+        received = []
+
+        def serve():
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                received.append(conn.recv(65536))
+                conn.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+        client = RespClient("127.0.0.1", listener.getsockname()[1], timeout=1)
+        with self.assertRaises(ConnectionError):
+            client.pipeline([("INCR", "n")])
+        listener.close()
+        assert len(received) == 1 and getattr(client._local, "conn", None) is None
+
+    def test_make_state(self):
+        assert isinstance(make_state(None), LocalState)
+        state = make_state(f"redis://{self.host}:{self.port}/2")
+        assert isinstance(state, RedisState) and state.client.db == 2
+        with self.assertRaises(ValueError):
+            make_state("memcached://localhost")
+
+
+class SharedStateTestCase(unittest.TestCase):
+    """The app as one replica; a second RedisState plays another replica."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.proc, cls.host, cls.port = start_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.proc.terminate()
+        cls.proc.wait()
+
+    def setUp(self):
+        RespClient(self.host, self.port).execute("FLUSHDB")
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        app.config['TESTING'] = True
+        app.config['HISTORY_WRITE_BEHIND'] = False
+        self.client = app.test_client()
+        self.saved_state = app_module.state
+        app_module.state = RedisState(RespClient(self.host, self.port), sync_interval=0, counts_ttl=0)
+        self.other = RedisState(RespClient(self.host, self.port), sync_interval=0, counts_ttl=0)
+        init_db()
+
+    def tearDown(self):
+        app_module.state = self.saved_state
+        override_cache.clear()
+        os.close(self.db_fd)
+        os.unlink(app.config['DATABASE'])
+
+    def predict(self, message):
+        return self.client.post('/api/predict', json={'message': message}).get_json()['prediction']
+
+    def test_feedback_is_visible_to_other_replicas(self):
+        msg = "Lunch at noon?"
+        self.client.post('/feedback', data={'message': msg, 'user_label': 'SPAM'})
+        h = app_module.message_hash(msg)
+        assert self.other.fetch_overrides(None, [h]) == {h: ("SPAM", False)}
+
+    def test_other_replicas_override_reaches_cached_lookups(self):
+        msg = "See you at lunch tomorrow"
+        assert self.predict(msg) == 'ham'      # "no override" is now cached
+
+        self.other.overrides_changed()
+        self.other.publish_overrides([(app_module.message_hash(msg), None, "SPAM")])
+        assert self.predict(msg) == 'spam'
+
+        # An admin verdict from any replica outranks a newer user report from this one
+        self.other.publish_overrides([(app_module.message_hash(msg), "NOT SPAM", "SPAM")])
+        self.client.post('/feedback', data={'message': msg, 'user_label': 'SPAM'})
+        assert self.predict(msg) == 'not spam'
+
+    def test_deleting_feedback_withdraws_it(self):
+        msg = "Lunch at noon?"
+        h = app_module.message_hash(msg)
+        self.client.post('/login', data={'username': 'admin', 'password': '1234'})
+        self.client.post('/admin/train', data={'message': msg, 'label': 'SPAM'})
+        assert self.other.fetch_overrides(None, [h]) == {h: ("SPAM", True)}
+
+        with app.app_context():
+            fid = get_db().execute('SELECT id FROM feedback').fetchone()[0]
+        self.client.post(f'/admin/delete_feedback/{fid}')
+        assert self.other.fetch_overrides(None, [h]) == {}
+
+    def test_own_changes_keep_the_cache(self):
+        self.predict("Anything at all")
+        app_module.state.overrides_changed()
+        self.client.post('/feedback', data={'message': "Lunch at noon?", 'user_label': 'SPAM'})
+        assert len(override_cache) > 0
+        assert not app_module.state.overrides_changed()
+
+    def test_counters_are_cluster_wide(self):
+        self.client.post('/', data={'message': 'WINNER! Cash prize waiting.', 'source': 'SMS'})
+        self.other.publish_counts({"total": 2, "spam": 1, "hour:09": 2})
+
+        with app.app_context():
+            db = get_db()
+            stats = load_stats(db)
+            assert stats["total"] == 3 and stats["spam_count"] == 2
+            assert stats["traffic_data"]["09:00"] >= 2
+            # This replica's own table only has its own row
+            assert db.execute('SELECT count FROM stats WHERE name = "total"').fetchone()[0] == 1
+
+        # Clearing this replica's history only takes its own rows out of the shared totals
+        self.client.post('/clear_history')
+        with app.app_context():
+            assert load_stats(get_db())["total"] == 2
+
+    def test_spam_campaign_verdicts_are_shared(self):
+        template = "Dear {}, your parcel is held at customs. Pay the {} fee at {} within 24 hours to release it"
+        mine, theirs, unseen = [template.format(*v) for v in [
+            ("Alex", "£2.99", "http://parcel-fee.xyz/a1"), ("Sam", "£3.49", "http://dlvry.top/b2"),
+            ("Kim", "£4.10", "http://pkg-hold.xyz/d4")]]
+        self.predict(unseen)      # "no override" is now cached
+
+        # Another replica's verdict on its own variant reaches this one's unseen variant
+        self.other.overrides_changed()
+        signature = app_module.campaign_lsh.signature(theirs)
+        self.other.publish_campaign_verdicts(add=[app_module.campaign_lsh.to_bytes(signature).hex()])
+        data = self.client.post('/api/predict', json={'message': unseen}).get_json()
+        assert data['prediction'] == 'spam' and data['spam_probability'] == 50.0
+
+        # This replica's verdict is published; withdrawing it withdraws the campaign everywhere
+        self.client.post('/login', data={'username': 'admin', 'password': '1234'})
+        self.client.post('/admin/train', data={'message': mine, 'label': 'SPAM'})
+        assert len(self.other.fetch_campaign_verdicts()) == 2
+        with app.app_context():
+            fid = get_db().execute('SELECT id FROM feedback').fetchone()[0]
+        self.client.post(f'/admin/delete_feedback/{fid}')
+        self.other.overrides_changed()
+        assert self.other.fetch_campaign_verdicts() == []
+
+    def test_publishes_only_after_commit(self):
+        with app.app_context():
+            db = get_db()
+            app_module.write_history(db, [(("Rolled back", "SMS", "✅ NOT SPAM", "1.00%", "2024-01-01 09:00:00"),
+                                           ["total", "hour:09"])])
+            app_module.add_feedback(db, "Rolled back", "SPAM")
+            db.rollback()
+        h = app_module.message_hash("Rolled back")
+        assert self.other.fetch_counts(None) == {} and self.other.fetch_overrides(None, [h]) == {}
+
+    def test_failed_publishes_are_kept_or_counted(self):
+        down = RedisState(RespClient("127.0.0.1", 1, timeout=0.2), sync_interval=0)
+        down.publish_overrides([("h1", None, "SPAM")])
+        down.publish_counts({"total": 1})
+        assert down.status()["unpublished_overrides"] == 1 and down.dropped_counts == 1
+
+        # Back up: the kept labels go out with the next sync
+        down.client = RespClient(self.host, self.port)
+        down.overrides_changed()
+        assert self.other.fetch_overrides(None, ["h1"]) == {"h1": ("SPAM", False)}
+        assert down.status()["unpublished_overrides"] == 0
+
+    def test_reads_fall_back_when_backend_is_down(self):
+        self.client.post('/feedback', data={'message': "Lunch at noon?", 'user_label': 'SPAM'})
+        app_module.state = RedisState(RespClient("127.0.0.1", 1, timeout=0.2), sync_interval=0)
+        override_cache.clear()
+        assert self.predict("lunch at noon?") == 'spam'
+        with app.app_context():
+            assert load_stats(get_db())["total"] == 0
+        assert app_module.state.errors > 0 and app_module.state.last_error
+
+
+if __name__ == "__main__":
+    unittest.main()
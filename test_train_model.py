@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import unittest
+import train_model
+from train_model import (GRID, choose, choose_pruning, confirm_pruning, evaluate, evaluate_pruning, load_corpus, prune, save_holdout,
+                         split_holdout, train_final)
+
+class TrainModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        train_model._corpus = None
+        shutil.rmtree(self.dir)
+
+    def test_corpus_cached_by_dataset_hash(self):
+        path, corpus, cached = load_corpus(cache_dir=self.dir)
+        assert not cached and os.path.exists(path)
+        assert len(corpus["tokens"][(1, 1)]) == len(corpus["messages"]) == len(corpus["labels"])
+
+        path2, corpus2, cached2 = load_corpus(cache_dir=self.dir)
+        assert cached2 and path2 == path
+        assert corpus2["tokens"][(1, 2)] == corpus["tokens"][(1, 2)]
+
+    def test_evaluate_reports_speed_and_quality(self):
+        path, _, _ = load_corpus(cache_dir=self.dir)
+        train_model._init_worker(path)
+        result = evaluate({"ngram_range": (1, 1), "min_df": 2, "alpha": 0.5})
+        assert result["fit_time_s"] > 0 and result["throughput_msgs_s"] > 0
+        assert result["accuracy"] > 0.95 and result["f1"] > 0.85
+        assert result["n_features"] > 0
+
+    def test_holdout_is_fixed_and_kept_out_of_the_search(self):
+        path, corpus, _ = load_corpus(cache_dir=self.dir)
+        train_idx, holdout_idx = split_holdout(corpus["labels"])
+        assert not set(train_idx) & set(holdout_idx)
+        assert len(train_idx) + len(holdout_idx) == len(corpus["messages"])
+        assert list(split_holdout(corpus["labels"])[1]) == list(holdout_idx)
+
+        train_model._init_worker(path, train_idx)
+        assert train_model._corpus["messages"] == [corpus["messages"][i] for i in train_idx]
+        assert len(train_model._corpus["tokens"][(1, 2)]) == len(train_idx)
+
+        # Written in the format the app reads
+        import app as app_module
+        csv_path = os.path.join(self.dir, "holdout.csv")
+        messages = [corpus["messages"][i] for i in holdout_idx]
+        save_holdout(messages, corpus["labels"][holdout_idx], csv_path)
+        rows = app_module.load_holdout(csv_path)
+        assert rows == list(zip(messages, corpus["labels"][holdout_idx]))
+
+    def test_choose_times_only_close_candidates(self):
+        results = [
+            {"accuracy": 0.99, "f1": 0.951, "speed": 100},
+            {"accuracy": 0.99, "f1": 0.945, "speed": 300},
+            {"accuracy": 0.98, "f1": 0.925, "speed": 900},   # fastest, but clearly worse
+            {"accuracy": 0.90, "f1": 0.80, "speed": 2000},
+        ]
+        timed = []
+        timer = lambda r, messages, labels: timed.append(r) or r["speed"]
+        assert choose(results, 0.97, [], [], timer=timer) == (results[1], True)
+        assert timed == results[:2]
+
+        # Within SPEED_TOLERANCE of the fastest is a tie, won by F1
+        results[0]["speed"] = 290
+        assert choose(results, 0.97, [], [], timer=timer)[0] is results[0]
+        assert choose(results, 0.995, [], [], timer=timer) == (results[0], False)
+
+    def test_corpus_cache_keyed_by_grid(self):
+        path, _, _ = load_corpus(cache_dir=self.dir)
+        saved = GRID["ngram_range"]
+        GRID["ngram_range"] = saved + [(1, 3)]
+        try:
+            path2, corpus, cached = load_corpus(cache_dir=self.dir)
+            assert path2 != path and not cached and (1, 3) in corpus["tokens"]
+        finally:
+            GRID["ngram_range"] = saved
+
+    def test_final_model_uses_chosen_config(self):
+        _, corpus, _ = load_corpus(cache_dir=self.dir)
+        vectorizer, model = train_final(corpus["messages"], corpus["labels"],
+                                        {"ngram_range": [1, 2], "min_df": 2, "alpha": 0.1})
+        assert vectorizer.ngram_range == (1, 2) and vectorizer.min_df == 2
+        assert model.alpha == 0.1
+        assert model.predict(vectorizer.transform(["WINNER! Claim your free prize now"]))[0] == "spam"
+
+    def test_prune_keeps_most_relevant_terms(self):
+        _, corpus, _ = load_corpus(cache_dir=self.dir)
+        config = {"ngram_range": [1, 1], "min_df": 1, "alpha": 1.0}
+        vectorizer, model = train_final(corpus["messages"], corpus["labels"], config)
+        for method in ("logodds", "chi2"):
+            pruned, pruned_model = prune(vectorizer, model, corpus["messages"], corpus["labels"], 300, method)
+            assert len(pruned.vocabulary_) == 300 and pruned_model.feature_log_prob_.shape[1] == 300
+            assert set(pruned.vocabulary_) <= set(vectorizer.vocabulary_)
+            # Kept terms keep their idf
+            term = next(iter(pruned.vocabulary_))
+            assert pruned.idf_[pruned.vocabulary_[term]] == vectorizer.idf_[vectorizer.vocabulary_[term]]
+            assert pruned_model.predict(pruned.transform(["WINNER! Claim your free prize now"]))[0] == "spam"
+
+    def test_evaluate_pruning_reports_deltas(self):
+        _, corpus, _ = load_corpus(cache_dir=self.dir)
+        config = {"ngram_range": [1, 1], "min_df": 1, "alpha": 1.0}
+        results = evaluate_pruning(corpus["messages"], corpus["labels"], config, fractions=[0.1], folds=3)
+        full, pruned = results
+        assert full["keep_fraction"] == 1.0 and full["f1_delta"] == 0 and full["size_ratio"] == 1
+        assert abs(pruned["n_features"] - full["n_features"] * 0.1) <= 1
+        assert pruned["size_ratio"] > 5 and pruned["compact_bytes"] < full["compact_bytes"]
+        assert pruned["transform_us"] > 0 and pruned["score_one_us"] > 0
+        assert pruned["f1_delta"] == pruned["f1"] - full["f1"]
+        # Same folds every run, so the choice is reproducible
+        assert evaluate_pruning(corpus["messages"], corpus["labels"], config, fractions=[0.1], folds=3)[1]["f1"] == pruned["f1"]
+
+    def test_confirm_pruning_on_holdout(self):
+        _, corpus, _ = load_corpus(cache_dir=self.dir)
+        train_idx, holdout_idx = split_holdout(corpus["labels"])
+        train = train_model.subset(corpus, train_idx)
+        holdout = train_model.subset(corpus, holdout_idx)
+        full = train_final(train["messages"], train["labels"], {"ngram_range": [1, 1], "min_df": 1, "alpha": 1.0})
+        tiny = prune(*full, train["messages"], train["labels"], 5)
+
+        check = confirm_pruning(full, full, holdout["messages"], holdout["labels"], 0.01)
+        assert check["f1_delta"] == 0 and check["confirmed"]
+        check = confirm_pruning(full, tiny, holdout["messages"], holdout["labels"], 0.01)
+        assert check["f1_delta"] < -0.01 and not check["confirmed"]
+
+    def test_choose_pruning_respects_f1_bound(self):
+        results = [
+            {"n_features": 1000, "f1_delta": 0.0},
+            {"n_features": 250, "f1_delta": -0.008},
+            {"n_features": 100, "f1_delta": -0.03},
+        ]
+        assert choose_pruning(results, 0.01) == results[1]
+        assert choose_pruning(results, 0.001) == results[0]
+
+if __name__ == "__main__":
+    unittest.main()
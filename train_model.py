@@ -1,32 +1,432 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.base import clone
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.feature_selection import chi2
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
 from sklearn.naive_bayes import MultinomialNB
-import pickle
 
-# Load Kaggle dataset
-data = pd.read_csv("dataset/spam.csv", encoding="latin-1")
+from artifacts import FastScorer, compact_path, export_compact
+from online import HashingModel
+
+DATASET = "dataset/spam.csv"
+CACHE_DIR = "model/cache"
+REPORT_PATH = "model/training_report.json"
+# Rows kept out of every step of training (search, pruning, final fit); the app
+# validates hot-reloaded models on them
+HOLDOUT_PATH = "model/holdout.csv"
+HOLDOUT_SIZE = 0.1
+
+# Hyperparameter grid (the original fixed model is ngram (1, 1), min_df 1, alpha 1.0)
+GRID = {
+    "ngram_range": [(1, 1), (1, 2)],
+    "min_df": [1, 2, 3],
+    "alpha": [0.1, 0.5, 1.0],
+}
+CV_FOLDS = 5
+# Throughput measured inside the busy process pool only separates configurations by
+# a few percent, i.e. noise. Candidates within F1_TOLERANCE of the best CV F1 are
+# re-timed one at a time; timings within SPEED_TOLERANCE of the fastest count as a
+# tie, broken by F1.
+F1_TOLERANCE = 0.01
+SPEED_TOLERANCE = 0.05
+TIMING_SAMPLE = 2000
+TIMING_REPEATS = 5
+
+# Vocabulary pruning: fractions of the terms to try keeping. Each is compared with the
+# full model by stratified CV on the training split (fixed seed, so the choice is
+# reproducible), then the choice is confirmed on the untouched holdout.
+PRUNE_FRACTIONS = [0.5, 0.25, 0.1, 0.05, 0.02]
+PRUNE_FOLDS = 5
+
+
+def load_dataset(path=DATASET):
+    # Load Kaggle dataset, keep only required columns, remove empty rows
+    data = pd.read_csv(path, encoding="latin-1")
+    data = data[['v1', 'v2']]
+    data.columns = ['label', 'message']
+    data.dropna(inplace=True)
+    return list(data['message']), np.array(data['label'])
+
+
+def dataset_hash(path=DATASET):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def load_corpus(path=DATASET, cache_dir=CACHE_DIR):
+    # Tokenized corpus per n-gram range, cached on disk by dataset and grid (a changed
+    # GRID needs tokens for n-gram ranges an older cache does not have)
+    grid_hash = hashlib.sha256(json.dumps(GRID, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    cache_path = os.path.join(cache_dir, f"corpus-{dataset_hash(path)}-{grid_hash}.pkl")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return cache_path, pickle.load(f), True
+
+    messages, labels = load_dataset(path)
+    tokens = {}
+    for ngram_range in GRID["ngram_range"]:
+        analyzer = TfidfVectorizer(stop_words='english', ngram_range=ngram_range).build_analyzer()
+        tokens[ngram_range] = [analyzer(m) for m in messages]
+
+    corpus = {"messages": messages, "labels": labels, "tokens": tokens}
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path, "wb") as f:
+        pickle.dump(corpus, f)
+    return cache_path, corpus, False
+
+
+def pretokenized(doc):
+    # Analyzer for already-tokenized documents (module level so worker processes can pickle it)
+    return doc
+
+
+_corpus = None
+
+
+def _init_worker(cache_path, indices=None):
+    # indices: the rows the search may see (the holdout is left out)
+    global _corpus
+    with open(cache_path, "rb") as f:
+        _corpus = pickle.load(f)
+    if indices is not None:
+        _corpus = subset(_corpus, indices)
+
+
+def subset(corpus, indices):
+    return {
+        "messages": [corpus["messages"][i] for i in indices],
+        "labels": corpus["labels"][indices],
+        "tokens": {k: [tokens[i] for i in indices] for k, tokens in corpus["tokens"].items()},
+    }
+
+
+def split_holdout(labels, size=HOLDOUT_SIZE):
+    # (training indices, holdout indices): stratified and fixed, so every run holds out the same rows
+    return train_test_split(np.arange(len(labels)), test_size=size, stratify=labels, random_state=42)
+
+
+def save_holdout(messages, labels, path=HOLDOUT_PATH):
+    # label,message CSV (UTF-8), read by app.load_holdout
+    with open(path + ".tmp", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["label", "message"])
+        writer.writerows(zip(labels, messages))
+    os.replace(path + ".tmp", path)
+
+
+def evaluate(config):
+    # Cross-validate one configuration inside a worker process
+    tokens = _corpus["tokens"][config["ngram_range"]]
+    messages, labels = _corpus["messages"], _corpus["labels"]
+    folds = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=42)
+
+    fit_times, throughputs, f1s, accuracies, n_features = [], [], [], [], []
+    for train_idx, test_idx in folds.split(messages, labels):
+        start = time.perf_counter()
+        counts = CountVectorizer(analyzer=pretokenized, min_df=config["min_df"])
+        tfidf = TfidfTransformer()
+        X_train = tfidf.fit_transform(counts.fit_transform([tokens[i] for i in train_idx]))
+        nb = MultinomialNB(alpha=config["alpha"]).fit(X_train, labels[train_idx])
+        fit_times.append(time.perf_counter() - start)
+
+        # Inference timed end to end from raw text, the way the app scores messages
+        analyzer = TfidfVectorizer(stop_words='english', ngram_range=config["ngram_range"]).build_analyzer()
+        test_messages = [messages[i] for i in test_idx]
+        start = time.perf_counter()
+        predicted = nb.predict(tfidf.transform(counts.transform([analyzer(m) for m in test_messages])))
+        throughputs.append(len(test_messages) / (time.perf_counter() - start))
+
+        f1s.append(f1_score(labels[test_idx], predicted, pos_label="spam"))
+        accuracies.append(accuracy_score(labels[test_idx], predicted))
+        n_features.append(len(counts.vocabulary_))
+
+    return {
+        "ngram_range": list(config["ngram_range"]),
+        "min_df": config["min_df"],
+        "alpha": config["alpha"],
+        "fit_time_s": float(np.mean(fit_times)),
+        "throughput_msgs_s": float(np.mean(throughputs)),
+        "f1": float(np.mean(f1s)),
+        "accuracy": float(np.mean(accuracies)),
+        "n_features": int(np.mean(n_features)),
+    }
+
+
+def grid_search(cache_path, jobs=None, indices=None):
+    configs = [dict(zip(GRID, values)) for values in itertools.product(*GRID.values())]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(cache_path, indices)) as pool:
+        return list(pool.map(evaluate, configs))
+
+
+def shortlist(results, target_accuracy, f1_tolerance=F1_TOLERANCE):
+    # Configurations meeting the target whose CV F1 is within f1_tolerance of the best
+    # of them; the best F1 overall if none meet it
+    eligible = [r for r in results if r["accuracy"] >= target_accuracy]
+    if not eligible:
+        return [max(results, key=lambda r: r["f1"])], False
+    best = max(r["f1"] for r in eligible)
+    return [r for r in eligible if r["f1"] >= best - f1_tolerance], True
+
+
+def time_inference(config, messages, labels, sample=TIMING_SAMPLE, repeats=TIMING_REPEATS):
+    # msgs/s of the fitted configuration from raw text, best of `repeats`, run alone in this process
+    vectorizer, model = train_final(messages, labels, config)
+    sample = messages[:sample]
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict(vectorizer.transform(sample))
+        best = min(best, time.perf_counter() - start)
+    return len(sample) / best
+
+
+def choose(results, target_accuracy, messages, labels, f1_tolerance=F1_TOLERANCE, timer=time_inference):
+    # Fastest of the shortlist, timed sequentially; near-ties go to the better F1
+    candidates, meets_target = shortlist(results, target_accuracy, f1_tolerance)
+    for r in candidates:
+        r["timed_msgs_s"] = timer(r, messages, labels)
+    fastest = max(r["timed_msgs_s"] for r in candidates)
+    tied = [r for r in candidates if r["timed_msgs_s"] >= fastest * (1 - SPEED_TOLERANCE)]
+    return max(tied, key=lambda r: (r["f1"], r["timed_msgs_s"])), meets_target
+
+
+def train_final(messages, labels, config):
+    vectorizer = TfidfVectorizer(stop_words='english', ngram_range=tuple(config["ngram_range"]),
+                                 min_df=config["min_df"])
+    X_vectorized = vectorizer.fit_transform(messages)
+    model = MultinomialNB(alpha=config["alpha"])
+    model.fit(X_vectorized, labels)
+    return vectorizer, model
+
+
+def term_scores(model, X, labels, method):
+    # Relevance of each vectorizer column: NB log-odds spread across classes, or chi²
+    if method == "chi2":
+        return np.nan_to_num(chi2(X, labels)[0])
+    flp = model.feature_log_prob_
+    return flp.max(axis=0) - flp.min(axis=0)
+
+
+def prune(vectorizer, model, messages, labels, keep, method="logodds"):
+    # Refit on the `keep` most relevant terms; the idf of a kept term is unchanged
+    X = vectorizer.transform(messages)
+    scores = term_scores(model, X, labels, method)
+    terms = vectorizer.get_feature_names_out()
+    kept = sorted(terms[np.argsort(-scores, kind="stable")[:keep]])
+
+    pruned = clone(vectorizer).set_params(vocabulary=kept)
+    pruned_model = clone(model).fit(pruned.fit_transform(messages), labels)
+    return pruned, pruned_model
+
+
+def holdout_metrics(vectorizer, model, messages, labels):
+    # Footprint, per-message latency (batch transform and the app's single-message path) and quality
+    with tempfile.TemporaryDirectory() as out_dir:
+        export_compact(vectorizer, model, out_dir)
+        version_dir = compact_path(out_dir)
+        compact_bytes = sum(os.path.getsize(os.path.join(version_dir, f)) for f in os.listdir(version_dir))
+
+    start = time.perf_counter()
+    X = vectorizer.transform(messages)
+    transform_us = (time.perf_counter() - start) * 1e6 / len(messages)
+
+    scorer = FastScorer.from_sklearn(vectorizer, model)
+    start = time.perf_counter()
+    for m in messages:
+        scorer.predict(m)
+    score_one_us = (time.perf_counter() - start) * 1e6 / len(messages)
+
+    predicted = model.predict(X)
+    return {
+        "n_features": len(vectorizer.vocabulary_),
+        "pickle_bytes": len(pickle.dumps(vectorizer)) + len(pickle.dumps(model)),
+        "compact_bytes": compact_bytes,
+        "transform_us": transform_us,
+        "score_one_us": score_one_us,
+        "f1": float(f1_score(labels, predicted, pos_label="spam")),
+        "accuracy": float(accuracy_score(labels, predicted)),
+    }
+
+
+def evaluate_pruning(messages, labels, config, method="logodds", fractions=PRUNE_FRACTIONS, folds=PRUNE_FOLDS):
+    # Full model vs. each pruned size, averaged over stratified folds of the training split
+    messages = np.asarray(messages, dtype=object)
+    per_fold = {fraction: [] for fraction in [1.0] + list(fractions)}
+    for train, test in StratifiedKFold(folds, shuffle=True, random_state=42).split(messages, labels):
+        train_msgs, test_msgs = list(messages[train]), list(messages[test])
+        vectorizer, model = train_final(train_msgs, labels[train], config)
+        full = holdout_metrics(vectorizer, model, test_msgs, labels[test])
+        per_fold[1.0].append(full)
+        for fraction in fractions:
+            keep = max(1, round(full["n_features"] * fraction))
+            pruned = prune(vectorizer, model, train_msgs, labels[train], keep, method)
+            per_fold[fraction].append(holdout_metrics(*pruned, test_msgs, labels[test]))
+
+    results = []
+    for fraction, metrics in per_fold.items():
+        mean = {k: float(np.mean([m[k] for m in metrics])) for k in metrics[0]}
+        mean["n_features"] = round(mean["n_features"])
+        results.append({"keep_fraction": fraction, **mean})
+    full = results[0]
+    for r in results:
+        r["size_ratio"] = full["compact_bytes"] / r["compact_bytes"]
+        r["f1_delta"] = r["f1"] - full["f1"]
+        r["accuracy_delta"] = r["accuracy"] - full["accuracy"]
+    return results
+
+
+def choose_pruning(results, max_f1_drop):
+    # Smallest model whose CV F1 is within max_f1_drop of the full model's
+    eligible = [r for r in results if r["f1_delta"] >= -max_f1_drop]
+    return min(eligible, key=lambda r: r["n_features"])
+
+
+def confirm_pruning(full, pruned, messages, labels, max_f1_drop):
+    # F1 of the full and pruned final models on the untouched holdout
+    full_f1 = f1_score(labels, full[1].predict(full[0].transform(messages)), pos_label="spam")
+    pruned_f1 = f1_score(labels, pruned[1].predict(pruned[0].transform(messages)), pos_label="spam")
+    return {
+        "full_f1": float(full_f1),
+        "pruned_f1": float(pruned_f1),
+        "f1_delta": float(pruned_f1 - full_f1),
+        "confirmed": bool(pruned_f1 - full_f1 >= -max_f1_drop),
+    }
+
+
+def save_artifacts(vectorizer, model, messages, labels):
+    # Save model and vectorizer
+    os.makedirs("model", exist_ok=True)
+    for obj, path in ((model, "model/spam_model.pkl"), (vectorizer, "model/vectorizer.pkl")):
+        # Write-then-rename, so a running app's artifact watcher never reads half a pickle
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(obj, f)
+        os.replace(path + ".tmp", path)
+
+    # Compact, memory-mappable copy the app serves from (no unpickling at startup);
+    # published as a new version, never written over the files workers have mapped
+    export_compact(vectorizer, model, "model/compact")
+
+    # Base model for online learning (ONLINE_LEARNING=1); admin feedback is applied on top
+    HashingModel.train(list(messages), list(labels)).save("model/online/online_model.pkl")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the spam model, optionally with a parallel grid search.")
+    parser.add_argument("--dataset", default=DATASET)
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--target-accuracy", type=float, default=0.97,
+                        help="pick the fastest configuration with at least this CV accuracy")
+    parser.add_argument("--no-search", action="store_true", help="skip the grid search, train the default model")
+    parser.add_argument("--prune-method", choices=["logodds", "chi2"], default="logodds",
+                        help="how terms are ranked for vocabulary pruning")
+    parser.add_argument("--max-f1-drop", type=float, default=0.01,
+                        help="ship the smallest pruned model within this CV F1 of the full one")
+    parser.add_argument("--keep-fraction", type=float,
+                        help="pin the share of the vocabulary to keep instead of choosing it by CV")
+    parser.add_argument("--no-prune", action="store_true", help="keep the full vocabulary")
+    args = parser.parse_args()
+
+    cache_path, corpus, cached = load_corpus(args.dataset)
+    print(f"Corpus: {len(corpus['messages'])} messages ({'cached' if cached else 'tokenized'}: {cache_path})")
+    train_idx, holdout_idx = split_holdout(corpus["labels"])
+    holdout = subset(corpus, holdout_idx)
+    corpus = subset(corpus, train_idx)
+    print(f"Holdout: {len(holdout_idx)} messages kept out of training ({HOLDOUT_PATH})")
+
+    if args.no_search:
+        chosen, meets_target, results = {"ngram_range": [1, 1], "min_df": 1, "alpha": 1.0}, None, []
+    else:
+        start = time.perf_counter()
+        results = grid_search(cache_path, args.jobs, train_idx)
+        print(f"Grid search: {len(results)} configurations x {CV_FOLDS} folds in {time.perf_counter() - start:.1f}s")
+        print(f"{'ngram':>6} {'min_df':>6} {'alpha':>5} {'fit s':>7} {'msgs/s':>9} {'F1':>6} {'acc':>6} {'feats':>6}")
+        for r in sorted(results, key=lambda r: -r["throughput_msgs_s"]):
+            print(f"{str(tuple(r['ngram_range'])):>6} {r['min_df']:>6} {r['alpha']:>5} {r['fit_time_s']:>7.3f} "
+                  f"{r['throughput_msgs_s']:>9.0f} {r['f1']:>6.3f} {r['accuracy']:>6.3f} {r['n_features']:>6}")
+        chosen, meets_target = choose(results, args.target_accuracy, corpus["messages"], corpus["labels"])
+        timed = [r for r in results if "timed_msgs_s" in r]
+        print("Timed alone: " + ", ".join(
+            f"{tuple(r['ngram_range'])}/{r['min_df']}/{r['alpha']} {r['timed_msgs_s']:.0f} msgs/s" for r in timed))
+        if not meets_target:
+            print(f"⚠️  No configuration reached accuracy {args.target_accuracy}; using the best F1 instead")
 
-# Keep only required columns
-data = data[['v1', 'v2']]
-data.columns = ['label', 'message']
+    print(f"Chosen: ngram {tuple(chosen['ngram_range'])}, min_df {chosen['min_df']}, alpha {chosen['alpha']}")
 
-# Remove empty rows
-data.dropna(inplace=True)
+    pruning, prune_results = None, []
+    if args.keep_fraction is not None:
+        pruning = {"keep_fraction": args.keep_fraction, "selected_by": "pinned"}
+        print(f"Keeping {args.keep_fraction:.0%} of the vocabulary (--keep-fraction)")
+    elif not args.no_prune:
+        start = time.perf_counter()
+        prune_results = evaluate_pruning(corpus["messages"], corpus["labels"], chosen, args.prune_method)
+        print(f"Pruning ({args.prune_method}, {PRUNE_FOLDS}-fold CV) in {time.perf_counter() - start:.1f}s")
+        print(f"{'keep':>5} {'feats':>6} {'KB':>7} {'smaller':>7} {'tf us':>6} {'one us':>6} {'F1':>6} {'dF1':>7} {'dacc':>7}")
+        for r in prune_results:
+            print(f"{r['keep_fraction']:>5} {r['n_features']:>6} {r['compact_bytes'] / 1024:>7.1f} "
+                  f"{r['size_ratio']:>6.1f}x {r['transform_us']:>6.1f} {r['score_one_us']:>6.1f} "
+                  f"{r['f1']:>6.3f} {r['f1_delta']:>+7.3f} {r['accuracy_delta']:>+7.3f}")
+        pruning = {**choose_pruning(prune_results, args.max_f1_drop), "selected_by": "cv"}
+        print(f"Keeping {pruning['keep_fraction']:.0%} of the vocabulary (CV F1 {pruning['f1_delta']:+.3f}, "
+              f"{pruning['size_ratio']:.1f}x smaller)")
 
-# Features & labels
-X = data['message']
-y = data['label']
+    vectorizer, model = train_final(corpus["messages"], corpus["labels"], chosen)
+    confirmation = None
+    if pruning and pruning["keep_fraction"] < 1:
+        keep = max(1, round(len(vectorizer.vocabulary_) * pruning["keep_fraction"]))
+        pruned = prune(vectorizer, model, corpus["messages"], corpus["labels"], keep, args.prune_method)
+        confirmation = confirm_pruning((vectorizer, model), pruned, holdout["messages"], holdout["labels"],
+                                       args.max_f1_drop)
+        print(f"Holdout check: pruned F1 {confirmation['pruned_f1']:.3f} vs full {confirmation['full_f1']:.3f} "
+              f"({confirmation['f1_delta']:+.3f})")
+        if confirmation["confirmed"] or pruning["selected_by"] == "pinned":
+            vectorizer, model = pruned
+        else:
+            print(f"⚠️  Pruned model loses more than {args.max_f1_drop} F1 on the holdout; shipping the full vocabulary")
+    save_artifacts(vectorizer, model, corpus["messages"], corpus["labels"])
+    save_holdout(holdout["messages"], holdout["labels"])
+    predicted = model.predict(vectorizer.transform(holdout["messages"]))
+    holdout_scores = {
+        "size": len(holdout_idx),
+        "f1": float(f1_score(holdout["labels"], predicted, pos_label="spam")),
+        "accuracy": float(accuracy_score(holdout["labels"], predicted)),
+    }
+    print(f"Holdout: F1 {holdout_scores['f1']:.3f}, accuracy {holdout_scores['accuracy']:.3f}")
 
-# Convert text to numbers
-vectorizer = TfidfVectorizer(stop_words='english')
-X_vectorized = vectorizer.fit_transform(X)
+    with open(REPORT_PATH, "w") as f:
+        json.dump({
+            "dataset_hash": dataset_hash(args.dataset),
+            "target_accuracy": args.target_accuracy,
+            "meets_target": meets_target,
+            "chosen": chosen,
+            "results": results,
+            "holdout": holdout_scores,
+            "pruning": pruning and {
+                "method": args.prune_method,
+                "max_f1_drop": args.max_f1_drop,
+                "folds": PRUNE_FOLDS,
+                "selected_by": pruning["selected_by"],
+                "keep_fraction": pruning["keep_fraction"],
+                "holdout_check": confirmation,
+                "n_features": len(vectorizer.vocabulary_),
+                "results": prune_results,
+            },
+        }, f, indent=2)
 
-# Train model
-model = MultinomialNB()
-model.fit(X_vectorized, y)
+    print("✅ Model trained successfully using Kaggle SMS Spam dataset!")
 
-# Save model and vectorizer
-pickle.dump(model, open("model/spam_model.pkl", "wb"))
-pickle.dump(vectorizer, open("model/vectorizer.pkl", "wb"))
 
-print("✅ Model trained successfully using Kaggle SMS Spam dataset!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()